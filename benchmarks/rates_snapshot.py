@@ -0,0 +1,89 @@
+"""
+Benchmark of rates_snapshot.rebuild() grouped query and rates page top 10 queries versus number of public users.
+Database is created from schema.sql in temporary folder and filled with random users, depo and log rows.
+Run it from root folder: python -m benchmarks.rates_snapshot [users_count ...]
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from moex_invest import rates_snapshot
+from moex_invest.helpers import helpers_functions
+
+TICKERS = [f"t{i}" for i in range(300)]
+POSITIONS_PER_USER = 5
+TRADES_PER_USER = 20
+
+
+def create_database(path, users_count):
+    """
+    Create database from schema.sql and fill it with random data.
+    :param path: database file name
+    :param users_count: number of public users (the same number of private users is added)
+    :return: sqlite3 connection
+    """
+    database = sqlite3.connect(path)
+    database.row_factory = sqlite3.Row
+    with open(os.path.join(os.path.dirname(rates_snapshot.__file__), 'schema.sql')) as f:
+        database.executescript(f.read())
+
+    random.seed(users_count)
+    with database:
+        database.executemany("INSERT INTO auth (user_id, username, password_hash, account_type) "
+                             "VALUES (?, ?, '', ?)",
+                             [(user_id, f"user{user_id}", 'public' if user_id % 2 else 'private')
+                              for user_id in range(1, 2 * users_count + 1)])
+        database.executemany("INSERT INTO broker (user_id, account) VALUES (?, ?)",
+                             [(user_id, random.uniform(0, 100000)) for user_id in range(1, 2 * users_count + 1)])
+        database.executemany("INSERT INTO depo (user_id, ticker, lotsize, name, isqualifiedinvestors, number, "
+                             "currency, market) "
+                             "VALUES (?, ?, 1, '', 0, ?, 'sur', 'shares')",
+                             [(user_id, ticker, random.randint(1, 1000))
+                              for user_id in range(1, 2 * users_count + 1)
+                              for ticker in random.sample(TICKERS, POSITIONS_PER_USER)])
+        database.executemany("INSERT INTO log (user_id, ticker, operation, price, number, price_total, date_time) "
+                             "VALUES (?, ?, 'buy', 1, 1, ?, '')",
+                             [(user_id, random.choice(TICKERS), random.uniform(1, 10000))
+                              for user_id in range(1, 2 * users_count + 1)
+                              for _ in range(TRADES_PER_USER)])
+    database.execute("ANALYZE")
+    return database
+
+
+def measure(users_count):
+    """
+    Measure rebuild and top 10 queries time.
+    :param users_count: number of public users
+    :return: tuple (rebuild seconds, one user update seconds, four top 10 queries seconds)
+    """
+    prices = {ticker: random.uniform(1, 1000) for ticker in TICKERS}
+    with tempfile.TemporaryDirectory() as folder:
+        database = create_database(os.path.join(folder, 'benchmark.db'), users_count)
+        helpers_functions.database_name = os.path.join(folder, 'benchmark.db')
+
+        start = time.perf_counter()
+        rates_snapshot.rebuild(database, prices=prices)
+        rebuild_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rates_snapshot.rebuild(database, [1], prices=prices)
+        update_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for column in rates_snapshot.RATE_COLUMNS:
+            rates_snapshot.get_top(database, column)
+        top_time = time.perf_counter() - start
+
+        database.close()
+    return rebuild_time, update_time, top_time
+
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000, 50000]
+    print(f"{'public users':>12} {'rebuild, ms':>12} {'one user, ms':>13} {'top 10 x4, ms':>14}")
+    for count in counts:
+        rebuild_time, update_time, top_time = measure(count)
+        print(f"{count:>12} {rebuild_time * 1000:>12.1f} {update_time * 1000:>13.2f} {top_time * 1000:>14.2f}")
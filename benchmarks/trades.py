@@ -0,0 +1,144 @@
+"""
+Concurrency stress test of trade.py buy() and sell().
+Many threads trade for few users at the same time (every thread has own connection, as requests of app), users spend
+more cash than they have. Prints trades per second and checks that no balance or depo number is negative and that
+every balance equals start cash minus purchases plus sales from log table.
+Run it from root folder: python -m benchmarks.trades [threads [trades_per_thread [users]]]
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from moex_invest import trade
+from moex_invest.db import connection_pool
+from moex_invest.helpers import helpers_functions
+
+START_CASH = 10000.0
+TICKERS = [f"t{i}" for i in range(10)]
+PRICE = 100.0
+
+
+def create_database(path, users_count):
+    """
+    Create database from schema.sql with users and broker accounts.
+    :param path: database file name
+    :param users_count: number of users
+    :return: None
+    """
+    database = connection_pool.connect(path)
+    with open(os.path.join(os.path.dirname(trade.__file__), 'schema.sql')) as f:
+        database.executescript(f.read())
+    with database:
+        database.executemany("INSERT INTO auth (user_id, username, password_hash, account_type) "
+                             "VALUES (?, ?, '', 'private')",
+                             [(user_id, f"user{user_id}") for user_id in range(1, users_count + 1)])
+        database.executemany("INSERT INTO broker (user_id, account) VALUES (?, ?)",
+                             [(user_id, START_CASH) for user_id in range(1, users_count + 1)])
+    database.close()
+
+
+def worker(path, trades_count, users_count, counters, seed):
+    """
+    Make random trades (buy is more often than sell, so users run out of cash).
+    :param path: database file name
+    :param trades_count: number of trades
+    :param users_count: number of users
+    :param counters: dictionary {'done', 'rejected'} (changed under counters['lock'])
+    :param seed: random seed
+    :return: None
+    """
+    generator = random.Random(seed)
+    database = connection_pool.connect(path)
+    done = rejected = 0
+    for _ in range(trades_count):
+        user_id = generator.randint(1, users_count)
+        ticker = generator.choice(TICKERS)
+        number = generator.randint(1, 5)
+        results = {'secid': ticker, 'name': ticker, 'isqualifiedinvestors': 0, 'lotsize': 1, 'currencyid': 'sur',
+                   'market': 'shares', 'offer': PRICE, 'bid': PRICE}
+        operation = trade.buy if generator.random() < 0.6 else trade.sell
+        errors, account = operation(database, user_id, results, number, number * PRICE)
+        if errors:
+            rejected += 1
+        else:
+            done += 1
+    database.close()
+    with counters['lock']:
+        counters['done'] += done
+        counters['rejected'] += rejected
+
+
+def check(path):
+    """
+    Check balances and depo of all users.
+    :param path: database file name
+    :return: list of error strings (empty if there are no errors)
+    """
+    database = sqlite3.connect(path)
+    errors = []
+    for user_id, account in database.execute("SELECT user_id, account FROM broker WHERE account < 0").fetchall():
+        errors.append(f"user {user_id}: negative balance {account}")
+    for user_id, ticker, number in database.execute("SELECT user_id, ticker, number FROM depo "
+                                                    "WHERE number <= 0").fetchall():
+        errors.append(f"user {user_id}: {ticker} number {number}")
+    rows = database.execute("SELECT broker.user_id, broker.account, "
+                            "(SELECT TOTAL(CASE operation WHEN 'sell' THEN price_total ELSE -price_total END) "
+                            "FROM log WHERE log.user_id = broker.user_id) "
+                            "FROM broker").fetchall()
+    for user_id, account, change in rows:
+        if abs(account - (START_CASH + change)) > 0.001:
+            errors.append(f"user {user_id}: balance {account} is not start cash + log ({START_CASH + change})")
+    rows = database.execute("SELECT log.user_id, log.ticker, "
+                            "TOTAL(CASE log.operation WHEN 'buy' THEN log.number ELSE -log.number END), "
+                            "COALESCE(depo.number, 0) "
+                            "FROM log "
+                            "LEFT JOIN depo ON depo.user_id = log.user_id AND depo.ticker = log.ticker "
+                            "GROUP BY log.user_id, log.ticker").fetchall()
+    for user_id, ticker, log_number, depo_number in rows:
+        if log_number != depo_number:
+            errors.append(f"user {user_id}: {ticker} depo {depo_number} is not log {log_number}")
+    database.close()
+    return errors
+
+
+def measure(threads_count, trades_count, users_count):
+    """
+    Run workers concurrently and check database.
+    :param threads_count: number of threads
+    :param trades_count: trades per thread
+    :param users_count: number of users
+    :return: tuple (trades per second, done trades, rejected trades, list of errors)
+    """
+    counters = {'lock': threading.Lock(), 'done': 0, 'rejected': 0}
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'benchmark.db')
+        helpers_functions.database_name = path
+        create_database(path, users_count)
+
+        threads = [threading.Thread(target=worker, args=(path, trades_count, users_count, counters, i))
+                   for i in range(threads_count)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        errors = check(path)
+    return threads_count * trades_count / elapsed, counters['done'], counters['rejected'], errors
+
+
+if __name__ == "__main__":
+    arguments = [int(arg) for arg in sys.argv[1:]]
+    threads_count, trades_count, users_count = (arguments + [16, 500, 4][len(arguments):])[:3]
+    trades_per_second, done, rejected, errors = measure(threads_count, trades_count, users_count)
+    print(f"{threads_count} threads x {trades_count} trades, {users_count} users: {trades_per_second:.0f} trades/s, "
+          f"{done} done, {rejected} rejected (not enough cash or securities)")
+    for error in errors:
+        print(f"Error. {error}")
+    print("Balances and depo are consistent with log." if not errors else f"{len(errors)} errors.")
+    sys.exit(1 if errors else 0)
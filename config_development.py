@@ -10,3 +10,81 @@ DEBUG = True
 
 
 
+
+# MOEX API cache: max number of tickers, seconds to keep description/primary board and bid/offer prices
+QUOTE_CACHE_SIZE = 1024
+DESCRIPTION_CACHE_TTL = 6 * 60 * 60
+QUOTE_CACHE_TTL = 60
+
+# Seconds to trust securities metadata table (primary board, face value) before refresh from MOEX API
+SECURITIES_TTL = 7 * 24 * 60 * 60
+
+# MOEX API client: root url, (connect, read) timeout seconds, threads for concurrent requests,
+# max simultaneous requests to MOEX API
+ISS_BASE_URL = "https://iss.moex.com/iss"
+ISS_TIMEOUT = (3.05, 10)
+ISS_MAX_WORKERS = 8
+ISS_MAX_CONNECTIONS = 8
+
+# Currency rates: seconds to keep MOEX fix, additional fixes {currencyid: fix secid} (usd, eur, cny are default)
+FX_RATES_TTL = 60 * 60
+FX_FIXES = {}
+
+# Quotes table: seconds between background refreshes in app process (0 - do not start thread, use worker
+# python -m moex_invest.refresher; with many app processes only the one holding <DATABASE>.refresher.lock refreshes),
+# max age in seconds of stored prices for depo, rates and sell
+QUOTE_REFRESH_INTERVAL = 0
+QUOTE_MAX_AGE = 5 * 60
+
+# Ticker autocomplete: 'memory' - in-memory prefix/trigram index, 'fts' - SQLite FTS5 table listing_fts
+SEARCH_BACKEND = 'memory'
+
+# Buffered app_log: separate database file for logs (None - main DATABASE), max buffered messages,
+# number of messages to flush at once, seconds between flushes
+LOG_DATABASE = None
+LOG_BUFFER_SIZE = 10000
+LOG_FLUSH_SIZE = 100
+LOG_FLUSH_INTERVAL = 2
+
+# Seconds between price polls of alerts engine (0 - do not start it with app, run worker: python -m moex_invest.alerts;
+# with many app processes only the one holding <DATABASE>.alerts.lock checks alerts)
+ALERT_INTERVAL = 0
+
+# Alert emails: SMTP server (login and password from mail_login, mail_password environment variables),
+# for local SMTP sink (python -m aiosmtpd -n -l localhost:8025): MAIL_HOST = 'localhost', MAIL_PORT = 8025,
+# MAIL_SSL = False, MAIL_STARTTLS = False, MAIL_SKIP_LOGIN = True, MAIL_SENDER = 'bot@localhost'
+MAIL_HOST = 'smtp.gmail.com'
+MAIL_PORT = None
+MAIL_SSL = True
+MAIL_STARTTLS = None
+MAIL_SKIP_LOGIN = False
+MAIL_SENDER = None
+# SMTP connections, tries per dispatch, seconds before first retry, tries before message is failed
+MAIL_POOL_SIZE = 2
+MAIL_RETRIES = 3
+MAIL_BACKOFF = 1.0
+MAIL_MAX_ATTEMPTS = 6
+# Seconds of claim of outbox messages by one dispatch (not finished messages are sent again after it)
+MAIL_LEASE = 10 * 60
+
+# Fetch market prices of batch lookups with asyncio httpx client instead of thread pool
+ISS_ASYNC = False
+
+# Prices API for spreadsheets (/api/prices, /api/portfolio): requests per token for period seconds,
+# requests per remote address for period seconds (any token, invalid too), max tickers in one request
+API_RATE_LIMIT = 60
+API_ADDRESS_RATE_LIMIT = 300
+API_RATE_PERIOD = 60
+API_MAX_TICKERS = 100
+
+# SQLite connections of app requests: max idle pooled connections (read-write and read-only each), journal mode,
+# synchronous, milliseconds to wait for locked database, bytes of memory mapped file, page cache (negative - KiB)
+DB_POOL_SIZE = 8
+DB_JOURNAL_MODE = 'WAL'
+DB_SYNCHRONOUS = 'NORMAL'
+DB_BUSY_TIMEOUT = 5000
+DB_MMAP_SIZE = 64 * 1024 * 1024
+DB_CACHE_SIZE = -16000
+
+# Rows on one page of trade history
+HISTORY_PAGE_SIZE = 50
@@ -59,19 +59,36 @@ def create_app():
 
     app.jinja_env.filters["finance"] = finance
 
-    # Register helpers_functions interface class
-    from . import helpers
-    helpers.helpers_functions.database_name = app.config.get("DATABASE")
+    # Configure database name, app_log, MOEX API client, cache and currency rates (config.py)
+    from .config import configure_services
+    configure_services(app.config)
 
-    # Create database if it is not exist
+    # Create database if it is not exist, else bring existing database to schema.sql (new tables, columns, indexes)
     from . import db
-    if not os.path.isfile(app.config.get("DATABASE")):
-        with app.app_context():
+    with app.app_context():
+        if not os.path.isfile(app.config.get("DATABASE")):
             db.init_db()
+        else:
+            db.migrate_db()
 
     # Register app with db.py (database logic)
     db.init_app(app)
 
+    # Load ticker autocomplete index from listing table
+    from .search import ticker_index
+    ticker_index.load(app.config.get("DATABASE"))
+
+    # Start background refresher of quotes table (or run it as worker: python -m moex_invest.refresher).
+    # Every app process starts thread, only one of them (holding worker lock, see locks.py) refreshes
+    if app.config.get("QUOTE_REFRESH_INTERVAL"):
+        from .refresher import quotes_refresher
+        quotes_refresher.start(app.config.get("QUOTE_REFRESH_INTERVAL"))
+
+    # Start price alerts engine (or run it as worker: python -m moex_invest.alerts), only one process checks alerts
+    if app.config.get("ALERT_INTERVAL"):
+        from .alerts import alert_engine
+        alert_engine.start(app.config.get("ALERT_INTERVAL"))
+
     # Register auth blueprint
     from . import auth
     app.register_blueprint(auth.bp)
@@ -80,6 +97,12 @@ def create_app():
     from . import sandbox
     app.register_blueprint(sandbox.bp)
 
+    # Register prices API blueprint (requests per token are limited)
+    from . import api
+    api.rate_limiter.configure(app.config.get("API_RATE_LIMIT"), app.config.get("API_RATE_PERIOD"),
+                               app.config.get("API_ADDRESS_RATE_LIMIT"))
+    app.register_blueprint(api.bp)
+
     '''
     # Create test view
     @app.route("/hello")
@@ -0,0 +1,349 @@
+"""
+Continuous price alerts.
+alert_engine polls prices of alerted tickers every interval seconds and sends email when price crosses min_border or
+max_border of depo row with notification = 'true'. Borders are kept in per-ticker sorted lists of armed and fired
+alerts, so price tick touches only alerts which change state: armed alert is fired (email) when price crosses border,
+fired alert is re-armed when price returns inside border. Fired alerts are stored in alert_state table.
+Started at __init__.py create_app() if ALERT_INTERVAL is set, or run it as standalone worker from root folder:
+python -m moex_invest.alerts
+"""
+
+import asyncio
+import bisect
+import sqlite3
+import threading
+from datetime import datetime
+import pytz
+from moex_invest.helpers import helpers_functions
+from moex_invest.locks import worker_lock
+from moex_invest.iss import async_iss_client
+from moex_invest.schedule import send_alert_emails, DIRECTIONS
+from moex_invest.config import load_config, configure_services
+
+
+class alert_engine:
+    # Seconds between price polls (override it with ALERT_INTERVAL in app.config)
+    interval = 60
+
+    _thread = None
+    # concurrent.futures.Future of run_async() task (ISS_ASYNC)
+    _task = None
+    _stop = threading.Event()
+    # {ticker: (armed min, armed max, fired min, fired max)} - lists of (border, depo_id) sorted by border
+    _index = {}
+    # {depo_id: {user_id, email, ticker, min_border, max_border}}
+    _alerts = {}
+    _signature = None
+    # Crossed borders without email (already sent) on last check
+    suppressed = 0
+
+    @staticmethod
+    def border(value):
+        """
+        Get border from depo row (empty border from depo form is stored as '' or 0).
+        :param value: min_border or max_border
+        :return: float or None
+        """
+        if isinstance(value, (int, float)) and value:
+            return float(value)
+        return None
+
+    @staticmethod
+    def signature(database):
+        """
+        Get cheap signature of alerts in depo and alert_state tables to find out that borders, notifications or
+        states were changed by other process.
+        :param database: sqlite3 connection
+        :return: tuple
+        """
+        return tuple(database.execute("SELECT COUNT(*), MAX(id), TOTAL(min_border), TOTAL(max_border), "
+                                      "(SELECT COUNT(*) FROM alert_state), (SELECT MAX(fired_at) FROM alert_state) "
+                                      "FROM depo "
+                                      "WHERE notification = 'true'").fetchone())
+
+    @staticmethod
+    def load(database):
+        """
+        Build per-ticker sorted border lists from depo rows with notification and alert_state.
+        :param database: sqlite3 connection with row_factory sqlite3.Row
+        :return: number of alerts
+        """
+        signature = alert_engine.signature(database)
+        rows = database.execute("SELECT depo.id, depo.user_id, auth.email, depo.ticker, depo.min_border, "
+                                "depo.max_border, "
+                                "EXISTS (SELECT 1 FROM alert_state "
+                                "WHERE alert_state.user_id = depo.user_id AND alert_state.ticker = depo.ticker "
+                                "AND alert_state.direction = 0) AS min_fired, "
+                                "EXISTS (SELECT 1 FROM alert_state "
+                                "WHERE alert_state.user_id = depo.user_id AND alert_state.ticker = depo.ticker "
+                                "AND alert_state.direction = 1) AS max_fired "
+                                "FROM depo "
+                                "JOIN auth ON depo.user_id = auth.user_id "
+                                "WHERE depo.notification = 'true'").fetchall()
+
+        index = {}
+        alerts = {}
+        for row in rows:
+            min_border = alert_engine.border(row['min_border'])
+            max_border = alert_engine.border(row['max_border'])
+            if min_border is None and max_border is None:
+                continue
+            alerts[row['id']] = {'user_id': row['user_id'], 'email': row['email'], 'ticker': row['ticker'],
+                                 'min_border': min_border, 'max_border': max_border}
+            lists = index.setdefault(row['ticker'], ([], [], [], []))
+            if min_border is not None:
+                lists[2 if row['min_fired'] else 0].append((min_border, row['id']))
+            if max_border is not None:
+                lists[3 if row['max_fired'] else 1].append((max_border, row['id']))
+        for lists in index.values():
+            for borders in lists:
+                borders.sort()
+
+        alert_engine._index = index
+        alert_engine._alerts = alerts
+        alert_engine._signature = signature
+        return len(alerts)
+
+    @staticmethod
+    def move(source, target, start, stop):
+        """
+        Move slice of sorted list to other sorted list.
+        :return: list of moved (border, depo_id)
+        """
+        moved = source[start:stop]
+        del source[start:stop]
+        for item in moved:
+            bisect.insort(target, item)
+        return moved
+
+    @staticmethod
+    def tick(ticker, price):
+        """
+        Change states of ticker alerts for new price: re-arm fired alerts with price inside border, fire armed alerts
+        with crossed border (min_border >= price or max_border <= price).
+        :param ticker: ticker
+        :param price: current price
+        :return: (fired [(depo_id, course)], re-armed [(depo_id, course)], number of suppressed alerts)
+        """
+        armed_min, armed_max, fired_min, fired_max = alert_engine._index.get(ticker, ([], [], [], []))
+        low = bisect.bisect_left
+        high = bisect.bisect_right
+        infinity = float('inf')
+
+        # 1. Re-arm: min_border < price, max_border > price
+        rearmed = [(depo_id, 'minimal_limit') for border, depo_id in
+                   alert_engine.move(fired_min, armed_min, 0, low(fired_min, (price,)))]
+        rearmed += [(depo_id, 'maximum_limit') for border, depo_id in
+                    alert_engine.move(fired_max, armed_max, high(fired_max, (price, infinity)), len(fired_max))]
+
+        # 2. Still fired alerts are crossed - emails were sent
+        suppressed = len(fired_min) + len(fired_max)
+
+        # 3. Fire: min_border >= price, max_border <= price
+        fired = [(depo_id, 'minimal_limit') for border, depo_id in
+                 alert_engine.move(armed_min, fired_min, low(armed_min, (price,)), len(armed_min))]
+        fired += [(depo_id, 'maximum_limit') for border, depo_id in
+                  alert_engine.move(armed_max, fired_max, 0, high(armed_max, (price, infinity)))]
+
+        return fired, rearmed, suppressed
+
+    @staticmethod
+    def check():
+        """
+        Poll prices of alerted tickers, send emails for fired alerts and re-arm alerts with price inside borders.
+        :return: number of sent emails or None if errors
+        """
+        tickers = alert_engine.tickers()
+        if not tickers:
+            return None if tickers is None else 0
+        return alert_engine.apply(tickers, helpers_functions.lookup_many(tickers))
+
+    @staticmethod
+    async def check_async():
+        """
+        Coroutine of check() for event loop of asyncio client: prices are requested natively by the loop, database
+        work and emails are done in threads.
+        :return: number of sent emails or None if errors
+        """
+        tickers = await asyncio.to_thread(alert_engine.tickers)
+        if not tickers:
+            return None if tickers is None else 0
+        quotes = await helpers_functions.lookup_many_async(tickers)
+        return await asyncio.to_thread(alert_engine.apply, tickers, quotes)
+
+    @staticmethod
+    def tickers():
+        """
+        Reload border lists if users changed depo and get alerted tickers.
+        :return: list of tickers or None if errors
+        """
+
+        db_name = helpers_functions.database_name
+        if not db_name:
+            print("Error. alerts.py tickers(): Can not get database name from class helper_functions")
+            return None
+
+        # 1. Reload border lists if users changed depo
+        database = sqlite3.connect(db_name)
+        database.row_factory = sqlite3.Row
+        try:
+            if alert_engine.signature(database) != alert_engine._signature:
+                alert_engine.load(database)
+        except database.Error as e:
+            helpers_functions.app_log_add(f"Error. alerts.py tickers(): sqlite3 {e}.")
+            return None
+        finally:
+            database.close()
+
+        return list(alert_engine._index)
+
+    @staticmethod
+    def apply(tickers, quotes):
+        """
+        Change state of alerts with prices, send emails for fired alerts and write re-armed alerts.
+        :param tickers: list of tickers from tickers()
+        :param quotes: dictionary from helpers.lookup_many() for tickers
+        :return: number of sent emails or None if errors
+        """
+        db_name = helpers_functions.database_name
+
+        # 2. Get prices (bid, or prevadmittedquote if there is not bid) of batch request
+        mail_list = []
+        rearmed = []
+        suppressed = 0
+        date_time = datetime.now(tz=pytz.timezone('Europe/Moscow'))
+        for ticker in tickers:
+            result = quotes[ticker][1]
+            price = result and (result.get('bid') or result.get('prevadmittedquote'))
+            if not price:
+                continue
+
+            # 3. Only alerts which change state
+            fired, ticker_rearmed, ticker_suppressed = alert_engine.tick(ticker, price)
+            for depo_id, course in fired:
+                mail_list.append(dict(alert_engine._alerts[depo_id], course=course, price=price, date_time=date_time))
+            rearmed += [(alert_engine._alerts[depo_id], course) for depo_id, course in ticker_rearmed]
+            suppressed += ticker_suppressed
+        alert_engine.suppressed = suppressed
+
+        if not mail_list and not rearmed:
+            return 0
+
+        # 4. Write re-armed alerts, send emails for fired alerts (alert_state is written with outbox)
+        written = True
+        database = sqlite3.connect(db_name)
+        try:
+            with database:
+                database.executemany("DELETE FROM alert_state "
+                                     "WHERE user_id = ? AND ticker = ? AND direction = ?",
+                                     [(alert['user_id'], alert['ticker'], DIRECTIONS[course])
+                                      for alert, course in rearmed])
+        except database.Error as e:
+            written = False
+            helpers_functions.app_log_add(f"Error. alerts.py apply(): sqlite3 {e}.")
+        finally:
+            database.close()
+
+        sent = send_alert_emails(mail_list) if mail_list else 0
+
+        database = sqlite3.connect(db_name)
+        try:
+            # Reload lists from database on next check if state was not written
+            alert_engine._signature = alert_engine.signature(database) if written and sent is not None else None
+        except database.Error as e:
+            alert_engine._signature = None
+            helpers_functions.app_log_add(f"Error. alerts.py apply(): sqlite3 {e}.")
+        finally:
+            database.close()
+
+        helpers_functions.app_log_add(f"Success. alerts.py apply(): {len(mail_list)} alerts fired, "
+                                      f"{len(rearmed)} re-armed, {suppressed} suppressed (email already sent), "
+                                      f"{sent} emails sent.")
+        return sent
+
+    @staticmethod
+    def run():
+        """
+        Check alerts every interval seconds until stop() (only in process holding 'alerts' worker lock).
+        :return: None
+        """
+        while not alert_engine._stop.is_set():
+            # Only one process of multi-worker server does the work, the others wait to take it over
+            if not worker_lock.acquire(helpers_functions.database_name, 'alerts'):
+                alert_engine._stop.wait(alert_engine.interval)
+                continue
+            try:
+                alert_engine.check()
+            except Exception as e:
+                # Alert engine must survive any error and try again on next interval
+                helpers_functions.app_log_add(f"Error. alerts.py run(): {e}.")
+            alert_engine._stop.wait(alert_engine.interval)
+
+    @staticmethod
+    async def run_async():
+        """
+        Check alerts every interval seconds until stop() as task of event loop of asyncio client (ISS_ASYNC), only in
+        process holding 'alerts' worker lock.
+        :return: None
+        """
+        while not alert_engine._stop.is_set():
+            if worker_lock.acquire(helpers_functions.database_name, 'alerts'):
+                try:
+                    await alert_engine.check_async()
+                except Exception as e:
+                    # Task must survive any error and try again on next interval
+                    helpers_functions.app_log_add(f"Error. alerts.py run_async(): {e}.")
+            await asyncio.sleep(alert_engine.interval)
+
+    @staticmethod
+    def start(interval=None):
+        """
+        Start alert engine in daemon thread, or as task of event loop of asyncio client if ISS_ASYNC is set
+        (only one per process).
+        :param interval: seconds between price polls
+        :return: None
+        """
+        if interval:
+            alert_engine.interval = float(interval)
+
+        if alert_engine._thread and alert_engine._thread.is_alive():
+            return
+        if alert_engine._task and not alert_engine._task.done():
+            return
+
+        alert_engine._stop.clear()
+
+        # Task of event loop of asyncio client - no own thread
+        if helpers_functions.iss_async:
+            alert_engine._task = asyncio.run_coroutine_threadsafe(alert_engine.run_async(), async_iss_client.loop())
+            return
+
+        alert_engine._thread = threading.Thread(target=alert_engine.run, name='alert_engine', daemon=True)
+        alert_engine._thread.start()
+
+    @staticmethod
+    def stop():
+        """
+        Stop alert engine thread or task.
+        :return: None
+        """
+        alert_engine._stop.set()
+        if alert_engine._task:
+            alert_engine._task.cancel()
+            alert_engine._task = None
+        if alert_engine._thread:
+            alert_engine._thread.join()
+            alert_engine._thread = None
+        worker_lock.release('alerts')
+
+
+if __name__ == "__main__":
+    # Standalone worker - take settings from the same file as create_app() (ISS_BASE_URL may point to local stub)
+    config = load_config()
+    configure_services(config)
+    if config.get("ALERT_INTERVAL"):
+        alert_engine.interval = float(config.get("ALERT_INTERVAL"))
+    if helpers_functions.iss_async:
+        async_iss_client.run(alert_engine.run_async(), timeout=None)
+    else:
+        alert_engine.run()
@@ -0,0 +1,275 @@
+"""
+Prices API blueprint for spreadsheets (google sheets, open office, microsoft excel).
+Requests are rate limited per remote address (before token is checked, so guessing tokens is limited too), authorized
+with user API token (created on settings page) and rate limited per token. Prices are taken
+from quote cache, quotes table and batched MOEX API requests (helpers.py lookup_many()), so spreadsheet refreshes
+do not make one MOEX API request per ticker.
+/api/prices?tickers=sber,aflt&format=csv&token=<token> - prices of tickers
+/api/portfolio?format=json&token=<token> - prices of tickers of user depo with number of securities
+"""
+
+import csv
+import hashlib
+import io
+import secrets
+import threading
+import time
+from datetime import datetime
+from functools import wraps
+import pytz
+from flask import Blueprint, g, request, jsonify, make_response, current_app
+from moex_invest.db import get_db
+from moex_invest.helpers import helpers_functions
+from moex_invest.iss import quote_cache
+
+bp = Blueprint('api', __name__, url_prefix="/api")
+
+# Columns of prices table
+PRICE_COLUMNS = ('secid', 'name', 'market', 'boardid', 'currencyid', 'lotsize', 'prevadmittedquote', 'bid', 'offer',
+                 'error')
+
+
+class api_tokens:
+
+    @staticmethod
+    def digest(token: str):
+        """
+        Get hash of token (only hashes are stored in api_token table).
+        :param token: str
+        :return: hex str
+        """
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @staticmethod
+    def create(database, user_id):
+        """
+        Create new API token of user (old token stops working). Caller commits transaction.
+        :param database: sqlite3 connection
+        :param user_id: user_id
+        :return: token: str (it is shown to user once)
+        """
+        token = secrets.token_urlsafe(24)
+        database.execute("INSERT INTO api_token (token_hash, user_id, created_at) "
+                         "VALUES (?, ?, ?) "
+                         "ON CONFLICT (user_id) DO UPDATE SET "
+                         "token_hash = excluded.token_hash, created_at = excluded.created_at",
+                         (api_tokens.digest(token), user_id,
+                          datetime.now(tz=pytz.timezone('Europe/Moscow')).isoformat()))
+        return token
+
+    @staticmethod
+    def get_user(database, token: str):
+        """
+        Get user of API token.
+        :param database: sqlite3 connection
+        :param token: str
+        :return: row of auth table or None
+        """
+        return database.execute("SELECT auth.* "
+                                "FROM api_token "
+                                "JOIN auth ON api_token.user_id = auth.user_id "
+                                "WHERE api_token.token_hash = ?",
+                                (api_tokens.digest(token),)).fetchone()
+
+
+class rate_limiter:
+    """
+    Token bucket per API token and per remote address: limit requests per period seconds (bursts up to limit are
+    allowed).
+    """
+
+    # Default settings (override it with API_RATE_LIMIT, API_ADDRESS_RATE_LIMIT, API_RATE_PERIOD in app.config)
+    limit = 60
+    address_limit = 300
+    period = 60.0
+    # Forget idle buckets when there are more than this number of them
+    max_buckets = 10000
+
+    _lock = threading.Lock()
+    # {key: (tokens, monotonic time of last request, limit)}
+    _buckets = {}
+
+    @staticmethod
+    def configure(limit=None, period=None, address_limit=None):
+        """
+        Change limits. Buckets are dropped.
+        :param limit: max number of requests per period of API token
+        :param period: seconds
+        :param address_limit: max number of requests per period of remote address (valid or not tokens)
+        :return: None
+        """
+        with rate_limiter._lock:
+            if limit:
+                rate_limiter.limit = int(limit)
+            if address_limit:
+                rate_limiter.address_limit = int(address_limit)
+            if period:
+                rate_limiter.period = float(period)
+            rate_limiter._buckets = {}
+
+    @staticmethod
+    def allow(key, limit=None):
+        """
+        Take one request from bucket of key.
+        :param key: API token hash or remote address
+        :param limit: max number of requests per period of key (rate_limiter.limit if None)
+        :return: 0 if request is allowed, else seconds to wait for next request
+        """
+        limit = limit or rate_limiter.limit
+        period = rate_limiter.period
+        now = time.monotonic()
+        with rate_limiter._lock:
+            tokens, updated, _ = rate_limiter._buckets.get(key, (limit, now, limit))
+            tokens = min(limit, tokens + (now - updated) * limit / period)
+            if tokens < 1:
+                rate_limiter._buckets[key] = (tokens, now, limit)
+                return (1 - tokens) * period / limit
+
+            # Full buckets are the same as absent ones
+            if len(rate_limiter._buckets) >= rate_limiter.max_buckets:
+                rate_limiter._buckets = {bucket_key: (bucket_tokens, bucket_updated, bucket_limit)
+                                         for bucket_key, (bucket_tokens, bucket_updated, bucket_limit)
+                                         in rate_limiter._buckets.items()
+                                         if bucket_tokens + (now - bucket_updated) * bucket_limit / period
+                                         < bucket_limit}
+            rate_limiter._buckets[key] = (tokens - 1, now, limit)
+            return 0
+
+    @staticmethod
+    def too_many(wait):
+        """
+        Get 429 response of rate limited request.
+        :param wait: seconds to wait for next request
+        :return: response
+        """
+        response = jsonify(errors=[f'Too many requests. Try again in {wait:.0f} seconds.'])
+        response.status_code = 429
+        response.headers['Retry-After'] = str(int(wait) + 1)
+        return response
+
+
+def token_required(f):
+    """
+    Decorate API routes to require API token (token query parameter or X-API-Token header) and to limit rate
+    of requests per remote address (before token is checked - missing and invalid tokens are limited too) and per
+    token. User row of token is g.api_user.
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # 1. Remote address limit (brute force of tokens gets 429 as well)
+        wait = rate_limiter.allow(f"address:{request.remote_addr}", rate_limiter.address_limit)
+        if wait:
+            return rate_limiter.too_many(wait)
+
+        # 2. Token
+        token = request.args.get('token') or request.headers.get('X-API-Token')
+        if not token:
+            return jsonify(errors=['API token is required (token parameter or X-API-Token header).']), 401
+
+        g.api_user = api_tokens.get_user(get_db(readonly=True), token)
+        if g.api_user is None:
+            return jsonify(errors=['API token is not valid.']), 401
+
+        # 3. Token limit
+        wait = rate_limiter.allow(api_tokens.digest(token))
+        if wait:
+            return rate_limiter.too_many(wait)
+
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def price_rows(tickers):
+    """
+    Get prices of tickers with one batched lookup (quote cache, quotes table, grouped MOEX API requests).
+    :param tickers: list of tickers (lower case)
+    :return: list of dictionaries with PRICE_COLUMNS keys in tickers order
+    """
+    answers = helpers_functions.lookup_many(tickers, max_age=helpers_functions.quote_max_age)
+    rows = []
+    for ticker in tickers:
+        errors, results = answers[ticker]
+        if results:
+            row = {column: results.get(column) for column in PRICE_COLUMNS}
+            row['secid'] = results['secid'].upper()
+            row['currencyid'] = (results.get('currencyid') or '').upper()
+        else:
+            row = dict.fromkeys(PRICE_COLUMNS)
+            row['secid'] = ticker.upper()
+            row['error'] = ' '.join(errors) if errors else 'Ticker is not found.'
+        rows.append(row)
+    return rows
+
+
+def render(rows, columns):
+    """
+    Make CSV or JSON response (format query parameter) with ETag and Cache-Control headers. Answers 304 if client
+    has the same data (If-None-Match).
+    :param rows: list of dictionaries
+    :param columns: columns of CSV table
+    :return: response
+    """
+    if request.args.get('format', 'json').lower() == 'csv':
+        text = io.StringIO()
+        writer = csv.writer(text)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(['' if row.get(column) is None else row.get(column) for column in columns])
+        response = make_response(text.getvalue())
+        response.mimetype = 'text/csv'
+    else:
+        response = jsonify([{column: row.get(column) for column in columns} for row in rows])
+
+    # Prices are not changed until quote cache expires
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.max_age = int(quote_cache.market_ttl)
+    return response.make_conditional(request)
+
+
+@bp.route("/prices")
+@token_required
+def prices():
+    """
+    Prices of tickers (tickers query parameter - comma separated).
+    :return: CSV or JSON table of PRICE_COLUMNS
+    """
+
+    # 1. Check tickers
+    tickers = [ticker.strip().lower() for ticker in request.args.get('tickers', '').split(',') if ticker.strip()]
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        return jsonify(errors=['tickers parameter is required (comma separated tickers).']), 400
+    max_tickers = current_app.config.get("API_MAX_TICKERS") or 100
+    if len(tickers) > max_tickers:
+        return jsonify(errors=[f"Too many tickers (max {max_tickers})."]), 400
+    for ticker in tickers:
+        error_messages = helpers_functions.check_ticker_text_fail(ticker)
+        if error_messages:
+            return jsonify(errors=[error_messages]), 400
+
+    # 2. Prices with one batched lookup
+    return render(price_rows(tickers), PRICE_COLUMNS)
+
+
+@bp.route("/portfolio")
+@token_required
+def portfolio():
+    """
+    Prices of tickers of token user depo with number of securities.
+    :return: CSV or JSON table of PRICE_COLUMNS and number
+    """
+    rows = get_db(readonly=True).execute("SELECT ticker, number "
+                                         "FROM depo "
+                                         "WHERE user_id = ? "
+                                         "ORDER BY ticker",
+                                         (g.api_user['user_id'],)).fetchall()
+    numbers = {row['ticker'].lower(): row['number'] for row in rows}
+
+    price_list = price_rows(list(numbers)) if numbers else []
+    for row, number in zip(price_list, numbers.values()):
+        row['number'] = number
+    return render(price_list, ('secid', 'number') + PRICE_COLUMNS[1:])
+
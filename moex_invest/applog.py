@@ -0,0 +1,169 @@
+"""
+Buffered application log.
+Messages are kept in memory and written to app_log table in batches (one transaction per flush) by background
+thread, when buffer reaches flush_size or at process exit. app_logger configured at __init__.py create_app() from
+app.config, helpers.py app_log_add() puts messages to it.
+"""
+
+import atexit
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime
+import pytz
+
+
+class app_logger:
+    # Default settings (override it with LOG_DATABASE, LOG_BUFFER_SIZE, LOG_FLUSH_SIZE, LOG_FLUSH_INTERVAL in app.config)
+    # Separate database file for app_log table, None - write to database of message
+    log_database = None
+    # Max number of not written messages (the oldest are dropped)
+    buffer_size = 10000
+    # Number of messages which wakes up flush thread
+    flush_size = 100
+    # Seconds between flushes
+    flush_interval = 2.0
+
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _buffer = deque()
+    _dropped = 0
+    _wakeup = threading.Event()
+    _thread = None
+    # Databases with checked app_log table
+    _prepared = set()
+
+    @staticmethod
+    def configure(log_database=None, buffer_size=None, flush_size=None, flush_interval=None):
+        """
+        Change logger settings.
+        :param log_database: database file name for app_log table (created if it is not exist)
+        :param buffer_size: max number of messages in memory
+        :param flush_size: number of messages to flush without waiting for flush_interval
+        :param flush_interval: seconds between flushes
+        :return: None
+        """
+        if log_database:
+            app_logger.log_database = log_database
+        if buffer_size:
+            app_logger.buffer_size = int(buffer_size)
+        if flush_size:
+            app_logger.flush_size = int(flush_size)
+        if flush_interval:
+            app_logger.flush_interval = float(flush_interval)
+
+    @staticmethod
+    def add(message: str, database_name=None):
+        """
+        Put message to buffer (does not touch database).
+        :param message: text of message
+        :param database_name: database of message (used if log_database is not set)
+        :return: None
+        """
+        db_name = app_logger.log_database or database_name
+        if not db_name:
+            print(f"Error. applog.py add(): Can not get database name for message: {message}")
+            return
+
+        row = (db_name, message, datetime.now(tz=pytz.timezone('Europe/Moscow')).isoformat())
+        with app_logger._lock:
+            if len(app_logger._buffer) >= app_logger.buffer_size:
+                app_logger._buffer.popleft()
+                app_logger._dropped += 1
+            app_logger._buffer.append(row)
+            buffered = len(app_logger._buffer)
+
+        app_logger.start()
+        if buffered >= app_logger.flush_size:
+            app_logger._wakeup.set()
+
+    @staticmethod
+    def flush():
+        """
+        Write all buffered messages to app_log tables with one executemany per database.
+        :return: number of written messages
+        """
+        with app_logger._flush_lock:
+            with app_logger._lock:
+                rows = list(app_logger._buffer)
+                app_logger._buffer.clear()
+                dropped = app_logger._dropped
+                app_logger._dropped = 0
+
+            if not rows:
+                return 0
+
+            # 1. Report dropped messages to the first database
+            if dropped:
+                rows.append((rows[0][0], f"Warning. applog.py flush(): {dropped} log messages were dropped "
+                                         f"(buffer size {app_logger.buffer_size}).", rows[-1][2]))
+
+            # 2. Group messages by database
+            databases = {}
+            for db_name, message, date_time in rows:
+                databases.setdefault(db_name, []).append((message, date_time))
+
+            written = 0
+            for db_name, messages in databases.items():
+                database = sqlite3.connect(db_name)
+                try:
+                    with database:
+                        if db_name not in app_logger._prepared:
+                            database.execute("CREATE TABLE IF NOT EXISTS app_log ("
+                                             "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                             "log_text TEXT NOT NULL, "
+                                             "date_time TEXT NOT NULL)")
+                        database.executemany("INSERT INTO app_log (log_text, date_time) "
+                                             "VALUES (?, ?)",
+                                             messages)
+                    app_logger._prepared.add(db_name)
+                    written += len(messages)
+                except database.Error as e:
+                    print(f"Error. applog.py flush(): Can not write {len(messages)} messages to {db_name}: {e}")
+                finally:
+                    database.close()
+
+            return written
+
+    @staticmethod
+    def run():
+        """
+        Flush buffer every flush_interval seconds or when it reaches flush_size.
+        :return: None
+        """
+        while True:
+            app_logger._wakeup.wait(app_logger.flush_interval)
+            app_logger._wakeup.clear()
+            try:
+                app_logger.flush()
+            except Exception as e:
+                # Logger thread must survive any error
+                print(f"Error. applog.py run(): {e}")
+
+    @staticmethod
+    def start():
+        """
+        Start flush thread (only one daemon thread per process).
+        :return: None
+        """
+        if app_logger._thread and app_logger._thread.is_alive():
+            return
+
+        with app_logger._lock:
+            if app_logger._thread and app_logger._thread.is_alive():
+                return
+            app_logger._thread = threading.Thread(target=app_logger.run, name='app_logger', daemon=True)
+            app_logger._thread.start()
+
+    @staticmethod
+    def stats():
+        """
+        Get logger statistics.
+        :return: dictionary {'buffered': int, 'dropped': int}
+        """
+        with app_logger._lock:
+            return {'buffered': len(app_logger._buffer), 'dropped': app_logger._dropped}
+
+
+# Do not lose buffered messages at normal process exit
+atexit.register(app_logger.flush)
@@ -2,11 +2,12 @@
 Authentication blueprint
 """
 
-from flask import Blueprint, flash, g, redirect, render_template, request, session, url_for
+from flask import Blueprint, flash, g, redirect, render_template, request, session, url_for, current_app
 from functools import wraps
 from werkzeug.security import check_password_hash, generate_password_hash
 from moex_invest.db import get_db
 from moex_invest.helpers import helpers_functions
+from moex_invest import rates_snapshot
 import re
 
 bp = Blueprint('auth', __name__, url_prefix="/auth")
@@ -79,10 +80,12 @@ def register():
             helpers_functions.app_log_add(f"Success. auth.py register(): Add new user to database "
                         f"user_id={max_user_id}, username={username}")
 
+            # Add public user to rates
+            rates_snapshot.update_user(database, max_user_id)
+
         except database.Error:
             # If username already exist
             database.execute("rollback")
-            database.close()
             helpers_functions.app_log_add("Error. auth.py register(): SQL error in transaction.")
             flash(f"Извините, невозможно добавить {username} , попробуйте другое имя пользователя.")
             return redirect('/auth/register')
@@ -132,12 +135,10 @@ def login():
 
         # Ensure username exists and password is correct
         if len(rows) != 1:
-            database.close()
             flash(f"Извините, похоже неверное имя пользователя ({request.form.get('username')}). Попробуйте еще раз. "
                   f"Если вы впервые на сайте, необходимо зарегистрироваться. (Регистрация).")
             return redirect("/auth/login")
         elif not check_password_hash(rows[0]["password_hash"], request.form.get("password")):
-            database.close()
             flash("Извините, похоже вы ввели неверный пароль. Попробуйте еще раз. Если вы впервые на сайте- создайте "
                   "нового пользователя в пункте Регистрация.")
             return redirect("/auth/login")
@@ -145,8 +146,6 @@ def login():
         # Remember which user has logged in
         session["user_id"] = rows[0]["user_id"]
 
-        database.close()
-
         helpers_functions.app_log_add(f"Success. auth.py login() user_id {session['user_id']} logged in.")
 
         # Redirect user to home page
@@ -172,6 +171,11 @@ def load_logged_in_user():
     """
     Create global variable g - as row of auth table.
     """
+    # Static files do not need user (and database connection)
+    if request.endpoint == 'static':
+        g.user = None
+        return
+
     user_id = session.get('user_id')
     if not user_id:
         g.user = None
@@ -192,6 +196,7 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         if g.user is None:
             return redirect(url_for('auth.login'))
-        return f(*args, **kwargs)
+        # Async views (coroutines) are run by Flask
+        return current_app.ensure_sync(f)(*args, **kwargs)
 
     return decorated_function
@@ -0,0 +1,65 @@
+"""
+Shared configuration of app services.
+create_app() (__init__.py), scheduler (schedule.py) and refresher (refresher.py) take settings from the same
+file - MOEX_SANDBOX_SETTINGS environment variable.
+"""
+
+from os import getcwd
+from flask import Config
+from moex_invest import iss
+from moex_invest.applog import app_logger
+from moex_invest.helpers import helpers_functions
+from moex_invest.mailer import mailer
+
+
+def load_config():
+    """
+    Load settings file of MOEX_SANDBOX_SETTINGS environment variable (for processes without Flask app).
+    :return: flask.Config
+    """
+    config = Config(getcwd())
+    config.from_envvar('MOEX_SANDBOX_SETTINGS')
+    return config
+
+
+def configure_services(config):
+    """
+    Configure database name, buffered app_log, MOEX API client, cache, currency rates and mailer.
+    :param config: app.config or flask.Config from load_config()
+    :return: None
+    """
+
+    # Register database with helpers_functions interface class
+    helpers_functions.database_name = config.get("DATABASE")
+    if config.get("SECURITIES_TTL"):
+        helpers_functions.securities_ttl = config.get("SECURITIES_TTL")
+
+    # Serve depo, rates, sell prices from quotes table if they are not older than QUOTE_MAX_AGE
+    if config.get("QUOTE_MAX_AGE"):
+        helpers_functions.quote_max_age = config.get("QUOTE_MAX_AGE")
+
+    # Fetch market prices with asyncio client (one event loop thread) instead of thread pool
+    if config.get("ISS_ASYNC") is not None:
+        helpers_functions.iss_async = bool(config.get("ISS_ASYNC"))
+
+    # Buffered app_log writer (LOG_DATABASE - separate database file for app_log table)
+    app_logger.configure(log_database=config.get("LOG_DATABASE"),
+                         buffer_size=config.get("LOG_BUFFER_SIZE"),
+                         flush_size=config.get("LOG_FLUSH_SIZE"),
+                         flush_interval=config.get("LOG_FLUSH_INTERVAL"))
+
+    # MOEX API client (connection pool, timeouts, concurrency), currency rates and cache of answers
+    iss.configure(config)
+
+    # SMTP server and connection pool for alert emails
+    mailer.configure(host=config.get("MAIL_HOST"),
+                     port=config.get("MAIL_PORT"),
+                     ssl=config.get("MAIL_SSL"),
+                     starttls=config.get("MAIL_STARTTLS"),
+                     skip_login=config.get("MAIL_SKIP_LOGIN"),
+                     sender=config.get("MAIL_SENDER"),
+                     pool_size=config.get("MAIL_POOL_SIZE"),
+                     retries=config.get("MAIL_RETRIES"),
+                     backoff=config.get("MAIL_BACKOFF"),
+                     max_attempts=config.get("MAIL_MAX_ATTEMPTS"),
+                     lease=config.get("MAIL_LEASE"))
@@ -3,10 +3,164 @@ Database logic.
 db.py registered at __init__.py and app init with init_app()
 """
 
+import queue
+import re
 import sqlite3
+import threading
 from flask import current_app, g, url_for
 from moex_invest.helpers import helpers_functions
 
+# Values of columns which are added to existing databases by migrate_db() ({(table, column): SQL})
+MIGRATION_FILL = {
+    ('log', 'date_epoch'): "UPDATE log SET date_epoch = CAST(strftime('%s', date_time) AS INTEGER)",
+}
+
+# SQL before index or trigger is created by migrate_db() ({name: [SQL, ...]})
+MIGRATION_BEFORE = {
+    # Unique depo rows of user: merge rows of the same ticker (bought twice before index was unique)
+    'depo_user': ["UPDATE depo "
+                  "SET number = (SELECT SUM(same.number) FROM depo AS same "
+                  "WHERE same.user_id = depo.user_id AND same.ticker = depo.ticker) "
+                  "WHERE id IN (SELECT MIN(id) FROM depo GROUP BY user_id, ticker HAVING COUNT(*) > 1)",
+                  "DELETE FROM depo "
+                  "WHERE id NOT IN (SELECT MIN(id) FROM depo GROUP BY user_id, ticker)"],
+}
+
+# SQL after table is created by migrate_db() ({table: [SQL, ...]})
+MIGRATION_AFTER = {
+    # Full text index of existing listing rows
+    'listing_fts': ["INSERT INTO listing_fts (listing_fts) VALUES ('rebuild')"],
+}
+
+
+class connection_pool:
+    """
+    Reusable sqlite3 connections of app requests: read-write connections and read-only connections (mode=ro URI)
+    for read-heavy routes. With WAL journal readers do not wait for trade transactions.
+    Pragmas are set once for every new connection.
+    """
+
+    # Default settings (override it with DB_POOL_SIZE, DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_BUSY_TIMEOUT, DB_MMAP_SIZE,
+    # DB_CACHE_SIZE in app.config)
+    # Max number of idle connections of every kind
+    pool_size = 8
+    journal_mode = 'WAL'
+    synchronous = 'NORMAL'
+    # Milliseconds to wait for locked database
+    busy_timeout = 5000
+    # Bytes of database file mapped to memory
+    mmap_size = 64 * 1024 * 1024
+    # Pages (positive) or KiB (negative) of page cache of every connection
+    cache_size = -16000
+
+    _lock = threading.Lock()
+    # {(database name, read only): LifoQueue of idle connections}
+    _pools = {}
+
+    @staticmethod
+    def configure(config):
+        """
+        Change settings with app.config. Idle connections are closed.
+        :param config: app.config
+        :return: None
+        """
+        with connection_pool._lock:
+            if config.get("DB_POOL_SIZE") is not None:
+                connection_pool.pool_size = int(config.get("DB_POOL_SIZE"))
+            if config.get("DB_JOURNAL_MODE"):
+                connection_pool.journal_mode = config.get("DB_JOURNAL_MODE")
+            if config.get("DB_SYNCHRONOUS"):
+                connection_pool.synchronous = config.get("DB_SYNCHRONOUS")
+            if config.get("DB_BUSY_TIMEOUT") is not None:
+                connection_pool.busy_timeout = int(config.get("DB_BUSY_TIMEOUT"))
+            if config.get("DB_MMAP_SIZE") is not None:
+                connection_pool.mmap_size = int(config.get("DB_MMAP_SIZE"))
+            if config.get("DB_CACHE_SIZE") is not None:
+                connection_pool.cache_size = int(config.get("DB_CACHE_SIZE"))
+            pools = list(connection_pool._pools.values())
+            connection_pool._pools = {}
+
+        for pool in pools:
+            connection_pool.close(pool)
+
+    @staticmethod
+    def connect(db_name, readonly=False):
+        """
+        Open new connection with pragmas (connection may be used by other thread of next request).
+        :param db_name: database file name
+        :param readonly: open database with mode=ro URI
+        :return: sqlite3.connection
+        """
+        if readonly:
+            connection = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            connection = sqlite3.connect(db_name, check_same_thread=False)
+        connection.execute(f"PRAGMA busy_timeout = {int(connection_pool.busy_timeout)}")
+        if not readonly:
+            # Journal mode is stored in database file - readers get it too
+            connection.execute(f"PRAGMA journal_mode = {connection_pool.journal_mode}")
+            connection.execute(f"PRAGMA synchronous = {connection_pool.synchronous}")
+        connection.execute(f"PRAGMA mmap_size = {int(connection_pool.mmap_size)}")
+        connection.execute(f"PRAGMA cache_size = {int(connection_pool.cache_size)}")
+        return connection
+
+    @staticmethod
+    def acquire(db_name, readonly=False):
+        """
+        Get idle connection from pool or open new one.
+        :param db_name: database file name
+        :param readonly: read-only connection
+        :return: sqlite3.connection with row factory as sqlite3.Row
+        """
+        with connection_pool._lock:
+            pool = connection_pool._pools.setdefault((db_name, readonly), queue.LifoQueue())
+        try:
+            connection = pool.get_nowait()
+        except queue.Empty:
+            connection = connection_pool.connect(db_name, readonly)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    @staticmethod
+    def release(db_name, connection, readonly=False):
+        """
+        Return connection to pool: not finished transaction is rolled back, view settings are reset.
+        Connection is closed if pool is full or connection is broken.
+        :param db_name: database file name
+        :param connection: sqlite3.connection from acquire()
+        :param readonly: read-only connection
+        :return: None
+        """
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+            # Views switch connection to autocommit mode for manual transactions
+            connection.isolation_level = ''
+            connection.row_factory = sqlite3.Row
+        except sqlite3.Error:
+            connection.close()
+            return
+
+        with connection_pool._lock:
+            pool = connection_pool._pools.get((db_name, readonly))
+        if pool is None or pool.qsize() >= connection_pool.pool_size:
+            connection.close()
+            return
+        pool.put(connection)
+
+    @staticmethod
+    def close(pool):
+        """
+        Close idle connections of pool.
+        :param pool: LifoQueue of connections
+        :return: None
+        """
+        while True:
+            try:
+                connection = pool.get_nowait()
+            except queue.Empty:
+                return
+            connection.close()
 
 
 def init_app(app):
@@ -16,38 +170,44 @@ def init_app(app):
     :return: None
     """
 
-    # Call it after every request (if forgot close db manually)
+    # Connection pool settings and pragmas
+    connection_pool.configure(app.config)
+
+    # Return connections to pool after every request
     app.teardown_appcontext(close_db)
 
 
-def get_db():
+def get_db(readonly=False):
     """
-    Return database connection with row factory as sqlite3.Row
+    Return pooled database connection with row factory as sqlite3.Row (one connection of every kind per request).
+    :param readonly: read-only connection (mode=ro) for routes which only read - they are not blocked by writers
     :return: sqlite3.connection
     """
 
-    if 'db' not in g:
+    key = 'db_ro' if readonly else 'db'
+    if key not in g:
         db_name = current_app.config.get("DATABASE")
 
         if not db_name:
             helpers_functions.app_log_add(f"Error. db.py get_db(): your application has not database.")
             raise ValueError
 
-        g.db = sqlite3.connect(current_app.config.get("DATABASE"), detect_types=sqlite3.PARSE_DECLTYPES)
-        g.db.row_factory = sqlite3.Row
+        setattr(g, key, connection_pool.acquire(db_name, readonly))
 
-    return g.db
+    return g.get(key)
 
 
 # e get with teardown_appcontext method (look at init_app function here)
 def close_db(e=None):
     """
-    Close db connection if it is existed
+    Return db connections to pool if they are existed
     :return: None
     """
-    db = g.pop('db', None)
-    if db:
-        db.close()
+    db_name = current_app.config.get("DATABASE")
+    for key, readonly in (('db', False), ('db_ro', True)):
+        db = g.pop(key, None)
+        if db:
+            connection_pool.release(db_name, db, readonly)
 
 
 def init_db():
@@ -68,6 +228,109 @@ def init_db():
                 f"{helpers_functions.take_symbols()}")
 
 
+def schema_statements(script):
+    """
+    Split SQL script to statements (triggers with ; inside are one statement).
+    :param script: str
+    :return: list of tuples (kind: 'table', 'index' or 'trigger', name, SQL)
+    """
+    statements = []
+    buffer = ''
+    for line in script.splitlines(keepends=True):
+        buffer += line
+        if not sqlite3.complete_statement(buffer):
+            continue
+        match = re.match(r"\s*CREATE\s+(?:UNIQUE\s+|VIRTUAL\s+)?(TABLE|INDEX|TRIGGER)\s+(\w+)", buffer, re.IGNORECASE)
+        if match:
+            statements.append((match.group(1).lower(), match.group(2), buffer.strip()))
+        buffer = ''
+    return statements
+
+
+def migrate_db():
+    """
+    Bring existing database (created by older version of schema.sql) to schema.sql: create new tables, add new
+    columns with their values, create new indexes and triggers and recreate changed ones. Done steps are skipped,
+    so it runs at every app start; all steps are one transaction (other app processes wait for it).
+    :return: None
+    """
+    db_name = current_app.config.get("DATABASE")
+    with current_app.open_resource('schema.sql') as f:
+        script = f.read().decode('utf8')
+
+    # 1. Objects of schema.sql as sqlite stores them (to compare with database)
+    reference = sqlite3.connect(":memory:")
+    reference.executescript(script)
+    expected = {name: sql for name, sql in reference.execute("SELECT name, sql FROM sqlite_master")}
+
+    database = sqlite3.connect(db_name, timeout=60)
+
+    # --------------------------TRANSACTION ----------------------------
+    database.isolation_level = None
+    database.execute("BEGIN IMMEDIATE")
+    try:
+        stored = {name: sql for name, sql in database.execute("SELECT name, sql FROM sqlite_master")}
+        statements = schema_statements(script)
+        changes = []
+        after = []
+
+        # 2. New tables (SQL after them runs when their columns are added)
+        for kind, name, sql in statements:
+            if kind == 'table' and name not in stored:
+                database.execute(sql)
+                after += MIGRATION_AFTER.get(name, [])
+                changes.append(f"table {name}")
+
+        # 3. New columns of existing tables with values
+        for kind, name, sql in statements:
+            if kind != 'table' or name not in stored:
+                continue
+            columns = {row[1] for row in database.execute(f"PRAGMA table_info({name})")}
+            for cid, column, column_type, notnull, default, pk in reference.execute(f"PRAGMA table_info({name})"):
+                if column in columns:
+                    continue
+                definition = column_type
+                if default is not None:
+                    definition += f" DEFAULT {default}"
+                if notnull:
+                    definition += " NOT NULL"
+                database.execute(f"ALTER TABLE {name} ADD COLUMN {column} {definition}")
+                if (name, column) in MIGRATION_FILL:
+                    database.execute(MIGRATION_FILL[(name, column)])
+                changes.append(f"column {name}.{column}")
+
+        for sql in after:
+            database.execute(sql)
+
+        # 4. Rows which are not allowed by schema.sql now (unknown tickers were saved before secid was NOT NULL,
+        # constraint of existing table is not changed - securities_save() does not save them)
+        deleted = database.execute("DELETE FROM securities WHERE secid IS NULL").rowcount
+        if deleted > 0:
+            changes.append(f"{deleted} securities rows without secid")
+
+        # 5. New and changed indexes and triggers
+        for kind, name, sql in statements:
+            if kind == 'table' or ' '.join((stored.get(name) or '').split()) == ' '.join(expected[name].split()):
+                continue
+            if name in stored:
+                database.execute(f"DROP {kind.upper()} {name}")
+            for before in MIGRATION_BEFORE.get(name, []):
+                database.execute(before)
+            database.execute(sql)
+            changes.append(f"{kind} {name}")
+
+        database.execute("COMMIT")
 
+    except sqlite3.Error as e:
+        database.execute("ROLLBACK")
+        helpers_functions.app_log_add(f"Error. db.py migrate_db(): Can not migrate database {db_name}: {e}.")
+        raise
 
+    finally:
+        database.close()
+        reference.close()
+    # -------------------------END TRANSACTION ---------------------------
 
+    if changes:
+        helpers_functions.app_log_add(f"Success. db.py migrate_db(): Database {db_name} is migrated: "
+                                      f"{', '.join(changes)}.")
@@ -0,0 +1,80 @@
+"""
+Streaming export of query rows (trade history, depo) for sandbox.py export routes.
+Rows are read from sqlite3 cursor and encoded by chunks in generators, so response is sent while query is running
+and memory does not grow with number of rows. Formats: CSV, JSON Lines; optional gzip.
+"""
+
+import csv
+import io
+import json
+import zlib
+
+# Rows in one chunk of response
+CHUNK_ROWS = 500
+
+# {format: (mimetype, file extension)}
+FORMATS = {'csv': ('text/csv', 'csv'),
+           'jsonl': ('application/x-ndjson', 'jsonl')}
+
+
+def csv_chunks(cursor, columns):
+    """
+    Encode rows as CSV table with header.
+    :param cursor: sqlite3 cursor of query with columns
+    :param columns: names of columns
+    :return: generator of str
+    """
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(columns)
+    yield text.getvalue()
+
+    while True:
+        rows = cursor.fetchmany(CHUNK_ROWS)
+        if not rows:
+            return
+        text.seek(0)
+        text.truncate()
+        writer.writerows(rows)
+        yield text.getvalue()
+
+
+def jsonl_chunks(cursor, columns):
+    """
+    Encode rows as JSON Lines (one JSON object per row).
+    :param cursor: sqlite3 cursor of query with columns
+    :param columns: names of columns
+    :return: generator of str
+    """
+    while True:
+        rows = cursor.fetchmany(CHUNK_ROWS)
+        if not rows:
+            return
+        yield ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows)
+
+
+def gzip_chunks(chunks):
+    """
+    Compress text chunks to gzip stream.
+    :param chunks: iterable of str
+    :return: generator of bytes
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream(cursor, columns, file_format, compress=False):
+    """
+    Get generator of export file.
+    :param cursor: sqlite3 cursor of query with columns
+    :param columns: names of columns
+    :param file_format: 'csv' or 'jsonl'
+    :param compress: gzip
+    :return: generator of str (bytes if compress)
+    """
+    chunks = csv_chunks(cursor, columns) if file_format == 'csv' else jsonl_chunks(cursor, columns)
+    return gzip_chunks(chunks) if compress else chunks
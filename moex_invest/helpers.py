@@ -1,361 +1,888 @@
+import asyncio
+import concurrent.futures
 import re
 import requests
 import sqlite3
+import time
 from datetime import datetime
 import pytz
+from moex_invest.applog import app_logger
+from moex_invest.iss import iss_client, async_iss_client, quote_cache, fx_rates
+from moex_invest.search import ticker_index
+
 
 class helpers_functions:
     # Get database name from __init__.py application fabric
     database_name = None
+    # Seconds to trust securities table rows (override it with SECURITIES_TTL in app.config)
+    securities_ttl = 7 * 24 * 60 * 60
+    # Max number of securities in one MOEX API request with securities= filter
+    lookup_batch_size = 10
+    # Seconds to trust quotes table rows in depo, rates, sell (override it with QUOTE_MAX_AGE in app.config)
+    quote_max_age = 5 * 60
+    # Fetch market prices of lookup_many() with asyncio client instead of threads (override it with ISS_ASYNC)
+    iss_async = False
 
     @staticmethod
     def lookup(symbol):
         """
         Look for MOEX API for ticker symbol.
-        :param app_log_add: function to logged
         :param symbol: ticker: str
         :return: tuple (errors, results:dict : isqualifiedinvestors secid name faceunit initialfacevalue currencyid lotsize
         prevadmittedquote bid offer)
         """
+        return helpers_functions.lookup_many([symbol])[symbol]
 
-        # Error message use for flash in client browser
-        error_messages = []
+    @staticmethod
+    def lookup_many(symbols, max_age=None):
+        """
+        Look for MOEX API for list of tickers.
+        Tickers are grouped by engine, market and primary board - every group is requested from MOEX API with one
+        request (securities= filter).
+        :param symbols: list of tickers: str
+        :param max_age: seconds - if set, market prices from quotes table (written by refresher.py) not older than
+        max_age are used instead of MOEX API request
+        :return: dictionary {symbol: tuple (errors, results:dict)} - tuple is the same as lookup() returns
+        """
+        symbols = list(dict.fromkeys(symbols))
 
-        def get_currency():
-            """
-            Get current usd, eur fixes from MOEX API.
-            :return: dictionary {'usd': value:float, 'eur':value:float}, if errors return None.
-            """
-
-            url_usd = 'https://iss.moex.com/iss/' \
-                      'engines/currency/' \
-                      'markets/index/' \
-                      'securities/usdfix.json' \
-                      '?iss.meta=off&' \
-                      'iss.only=marketdata&' \
-                      'marketdata.columns=CURRENTVALUE'
-
-            url_eur = 'https://iss.moex.com/iss/' \
-                      'engines/currency/' \
-                      'markets/index/' \
-                      'securities/eurfix.json' \
-                      '?iss.meta=off&' \
-                      'iss.only=marketdata&' \
-                      'marketdata.columns=CURRENTVALUE'
-
-            # Contact API
+        # Whole lookup runs on event loop of asyncio client (sync facade)
+        if helpers_functions.iss_async:
             try:
-                response_usd = requests.get(url_usd)
-                response_eur = requests.get(url_eur)
-            except requests.RequestException as e:
-                helpers_functions.app_log_add(f"Error. helpers.py lookup.get_currency(): {e}.")
-                return None
+                return async_iss_client.run(helpers_functions.lookup_many_async(symbols, max_age))
+            except concurrent.futures.TimeoutError:
+                helpers_functions.app_log_add(f"Error. helpers.py lookup_many(): MOEX API did not answer in "
+                                              f"{async_iss_client.facade_timeout} s for {len(symbols)} tickers.")
+                return {symbol: ([f'Извините, похоже не получается получить информацию о {symbol} '
+                                  'от московской биржи. Попробуйте другой тикер, при повторении ошибки свяжитесь с '
+                                  'администратором сайта.'], None) for symbol in symbols}
 
-            # parse response
-            try:
-                usd = response_usd.json()
-                eur = response_eur.json()
-                return {
-                    'usd': usd["marketdata"]["data"][0][0],
-                    'eur': eur["marketdata"]["data"][0][0]
-                }
-
-            except (KeyError, TypeError, ValueError) as e:
-                helpers_functions.app_log_add(f"Error. helpers.py lookup.get_currency(): {e}.")
-                return None
+        # 1. Get description (concurrently)
+        descriptions = [iss_client.submit(helpers_functions.get_description, symbol) for symbol in symbols]
+        descriptions = [description.result() for description in descriptions]
 
-        def get_description():
-            """
-            Get information for depo table and future request to MOEX API for market price.
-            :return tuple (error, result:dict)
-            """
+        # 2. Contact API - one request for every group, concurrently
+        answers, groups, batches = helpers_functions.lookup_plan(symbols, descriptions, max_age)
+        market_data_list = iss_client.map(lambda batch: helpers_functions.get_market_data(*batch), batches)
 
-            # Contact API
-            try:
+        return helpers_functions.lookup_apply(answers, groups, batches, market_data_list)
 
-                url = f"https://iss.moex.com/iss/securities/{symbol}.json?" \
-                      f"iss.meta=off&" \
-                      f"description.columns=name,value&" \
-                      f"boards.columns=secid,boardid,title,market,engine,is_primary,currencyid"
+    @staticmethod
+    async def lookup_many_async(symbols, max_age=None):
+        """
+        Coroutine of lookup_many() for asyncio client: descriptions and market prices of all groups are requested
+        concurrently by one event loop (run it in event loop of async_iss_client - await it from coroutines of
+        refresher.py, alerts.py or with async_iss_client.run() / call()).
+        :param symbols: list of tickers: str
+        :param max_age: seconds - see lookup_many()
+        :return: dictionary {symbol: tuple (errors, results:dict)} as lookup_many() returns
+        """
+        symbols = list(dict.fromkeys(symbols))
 
-                response = requests.get(url)
-                response.raise_for_status()
+        # 1. Get description (concurrently)
+        descriptions = await asyncio.gather(*(helpers_functions.get_description_async(symbol)
+                                              for symbol in symbols))
 
-            except requests.RequestException as e:
+        # 2. Contact API - one request for every group, concurrently (database work is done in threads)
+        answers, groups, batches = await asyncio.to_thread(helpers_functions.lookup_plan, symbols, descriptions,
+                                                           max_age)
+        answers_json = await async_iss_client.get_json_many(helpers_functions.market_data_url(*batch)
+                                                            for batch in batches)
+        market_data_list = [helpers_functions.parse_market_data(answer) if answer else None
+                            for answer in answers_json]
 
-                error_messages.append(f'Извините, похоже не получается получить информацию о {symbol} '
-                                      'от московской биржи. Попробуйте другой тикер, при повторении ошибки свяжитесь с '
-                                      'администратором сайта.')
-                helpers_functions.app_log_add(f'Error. helpers.py lookup.get_description(): {e}.')
-                return error_messages, None
+        return await asyncio.to_thread(helpers_functions.lookup_apply, answers, groups, batches, market_data_list)
 
-            # Parse response
-            try:
-                quote = response.json()
+    @staticmethod
+    def lookup_plan(symbols, descriptions, max_age=None):
+        """
+        Take market prices of lookup from cache (and quotes table) and group the rest for MOEX API requests.
+        :param symbols: list of unique tickers: str
+        :param descriptions: list of get_description() results in symbols order
+        :param max_age: seconds - see lookup_many()
+        :return: tuple (answers {symbol: (errors, results)}, groups {(engine, market, boardid): {secid: [symbol, ...]}},
+        batches [(engine, market, boardid, [secid, ...]), ...])
+        """
 
-                if quote:
+        answers = {}
+        # Tickers without cached market prices - {(engine, market, boardid): {secid: [symbol, ...]}}
+        groups = {}
+
+        # 1. Look for market prices at cache
+        for symbol, (errors, results) in zip(symbols, descriptions):
+            if not results:
+                helpers_functions.app_log_add(f'Error. helpers.py lookup_many() get empty return from '
+                                              f'helpers.get_description() function for {symbol}.')
+                # Errors are flashed by sandbox.py - they must be list of messages
+                answers[symbol] = (errors or [f'Извините, тикер {symbol} не найден на московской бирже. '
+                                              'Проверьте тикер или попробуйте другой.'], None)
+                continue
+
+            answers[symbol] = (None, results)
+
+            market = quote_cache.get('market', results.get('secid'))
+            if market:
+                results.update(market)
+                continue
+
+            group = groups.setdefault((results.get('engine'), results.get('market'), results.get('boardid')), {})
+            group.setdefault(results.get('secid'), []).append(symbol)
+
+        # Look for market prices at quotes table
+        if max_age and groups:
+            stored = helpers_functions.quotes_get([secid for group in groups.values() for secid in group], max_age)
+            for key in list(groups):
+                for secid in list(groups[key]):
+                    if secid in stored:
+                        for symbol in groups[key].pop(secid):
+                            answers[symbol][1].update(stored[secid])
+                if not groups[key]:
+                    del groups[key]
+
+        # 2. One request for every group (MOEX API allows limited number of securities in filter)
+        batches = []
+        for (engine, market, boardid), group in groups.items():
+            secids = list(group)
+            for i in range(0, len(secids), helpers_functions.lookup_batch_size):
+                batches.append((engine, market, boardid, secids[i:i + helpers_functions.lookup_batch_size]))
+
+        return answers, groups, batches
 
-                    result = {}
+    @staticmethod
+    def lookup_apply(answers, groups, batches, market_data_list):
+        """
+        Add market prices of MOEX API answers and currency rates to lookup answers.
+        :param answers: answers of lookup_plan()
+        :param groups: groups of lookup_plan()
+        :param batches: batches of lookup_plan()
+        :param market_data_list: list of parse_market_data() results (None if errors) in batches order
+        :return: dictionary {symbol: tuple (errors, results:dict)} as lookup_many() returns
+        """
 
-                    # 1. DESCRIPTION TABLE
+        for (engine, market, boardid, batch), market_data in zip(batches, market_data_list):
+            group = groups[(engine, market, boardid)]
+            for secid in batch:
+                data = market_data.get(secid) if market_data else None
+                if data and data['status'] == 'A':
+                    del data['status']
+                    quote_cache.set('market', secid, data)
+
+                for symbol in group[secid]:
+                    if not data:
+                        answers[symbol] = ([f'Извините, похоже не получается получить информацию о {symbol} '
+                                            'от московской биржи. Попробуйте другой тикер, при повторении ошибки '
+                                            'свяжитесь с администратором сайта.'], None)
+                    # If it is not available to buy or sell
+                    elif 'status' in data:
+                        helpers_functions.app_log_add(f"Warning. helpers.py lookup_many(). Status index of "
+                                                      f"{symbol} is {data['status']}")
+                        answers[symbol] = ([f"Извините, но в настоящее время {symbol} недоступен для торговли. "
+                                            f"Попробуйте другой тикер."], None)
+                    else:
+                        answers[symbol][1].update(data)
 
-                    # Get columns number in description table
-                    name_index = quote["description"]["columns"].index("name")
-                    value_index = quote["description"]["columns"].index("value")
+        # 3. Add currency rates (only foreign currencies are requested, concurrently)
+        fx_rates.get_rates(answers[symbol][1]['currencyid'] for symbol in answers if answers[symbol][1])
+        for symbol in answers:
+            if answers[symbol][1]:
+                answers[symbol] = helpers_functions.add_currency(answers[symbol][1])
 
-                    # Get data from description table for future price request and depo
-                    # ISQUALIFIEDINVESTORS, SECID, NAME, FACEUNIT, INITIALFACEVALUE
-                    # Look for this names in description table rows
-                    interesting_names = dict.fromkeys(
-                        ('ISQUALIFIEDINVESTORS', 'SECID', 'NAME', 'FACEUNIT', 'INITIALFACEVALUE'))
+        return answers
 
-                    for row in quote["description"]["data"]:
+    @staticmethod
+    def lookup_stored(symbols):
+        """
+        Look for tickers without MOEX API requests (for work in request which must not wait for MOEX API):
+        description from quote cache or securities table, market prices from quote cache or quotes table of any age
+        (only not cached currency rate may be requested, once per FX_RATES_TTL).
+        :param symbols: list of tickers: str
+        :return: dictionary {symbol: tuple (errors, results:dict)} as lookup_many() returns, tickers without stored
+        data have errors
+        """
 
-                        if row[name_index] in interesting_names:
+        answers = {}
+        not_stored = ['Нет сохраненных данных о цене.']
 
-                            if row[name_index] == 'INITIALFACEVALUE':
-                                result[row[name_index].lower()] = float(row[value_index])
-                            else:
-                                result[row[name_index].lower()] = row[value_index].lower()
+        # 1. Description
+        descriptions = {}
+        for symbol in dict.fromkeys(symbols):
+            results = quote_cache.get('description', symbol.lower()) or helpers_functions.securities_get(symbol)
+            if results:
+                descriptions[symbol] = dict(results)
+            else:
+                answers[symbol] = (not_stored, None)
 
-                    # 2. BOARDS TABLE
+        # 2. Market prices
+        stored = helpers_functions.quotes_get([results['secid'] for results in descriptions.values()
+                                               if not quote_cache.get('market', results['secid'])], None)
+        for symbol, results in descriptions.items():
+            market = quote_cache.get('market', results['secid']) or stored.get(results['secid'])
+            if not market:
+                answers[symbol] = (not_stored, None)
+                continue
+            results.update(market)
+            answers[symbol] = helpers_functions.add_currency(results)
 
-                    # Get columns number in description table
-                    boardid_index = quote["boards"]["columns"].index("boardid")
-                    market_index = quote["boards"]["columns"].index("market")
-                    engine_index = quote["boards"]["columns"].index("engine")
-                    is_primary_index = quote["boards"]["columns"].index("is_primary")
-                    currencyid_index = quote["boards"]["columns"].index("currencyid")
+        return answers
 
-                    # Get data from boards table for future price request and depo
-                    # Look for primary board in boards table rows
+    @staticmethod
+    def market_data_url(engine, market, boardid, secids):
+        """
+        Get MOEX API path of market prices for list of securities on one board.
+        :param engine: engine of primary board
+        :param market: market of primary board
+        :param boardid: primary board
+        :param secids: list of secid: str
+        :return: str
+        """
+        return f"engines/{engine}/" \
+               f"markets/{market}/" \
+               f"boards/{boardid}/" \
+               f"securities.json" \
+               f"?iss.meta=off&" \
+               f"iss.only=securities,marketdata&" \
+               f"securities={','.join(secids)}&" \
+               f"securities.columns=SECID,LOTSIZE,STATUS,PREVADMITTEDQUOTE&" \
+               f"marketdata.columns=SECID,BID,OFFER,SPREAD,VOLTODAY"
 
-                    for row in quote["boards"]["data"]:
-                        if row[is_primary_index] == 1:
-                            result["boardid"] = row[boardid_index]
-                            result["engine"] = row[engine_index]
-                            result["market"] = row[market_index]
-                            result["currencyid"] = row[currencyid_index].lower()
+    @staticmethod
+    def get_market_data(engine, market, boardid, secids):
+        """
+        Get market prices for list of securities on one board from MOEX API.
+        :param engine: engine of primary board
+        :param market: market of primary board
+        :param boardid: primary board
+        :param secids: list of secid: str
+        :return: dictionary {secid (lower case): {'lotsize', 'status', 'prevadmittedquote', 'bid', 'offer', 'spread',
+        'voltoday'}}, None if errors
+        """
 
-                    return None, result
+        # Contact API
+        try:
+            response = iss_client.get(helpers_functions.market_data_url(engine, market, boardid, secids))
+            response.raise_for_status()
+            response = response.json()
 
-            except (KeyError, TypeError, ValueError) as e:
-                error_messages.append(f'Извините, похоже не получается получить информацию о {symbol} '
-                                      'от московской биржи. Попробуйте другой тикер, при повторении ошибки свяжитесь с '
-                                      'администратором сайта.')
-                helpers_functions.app_log_add(f"Error. helpers.py lookup.get_description(): {e}")
-                return error_messages, None
+        except (requests.RequestException, ValueError) as e:
+            helpers_functions.app_log_add(f"Error. helpers.py get_market_data(): {e}.")
+            return None
 
-        results = get_description()[1]
+        return helpers_functions.parse_market_data(response)
 
-        if results:
+    @staticmethod
+    def parse_market_data(response):
+        """
+        Parse MOEX API answer with market prices (see market_data_url()).
+        :param response: dictionary - parsed JSON answer
+        :return: dictionary {secid (lower case): {'lotsize', 'status', 'prevadmittedquote', 'bid', 'offer', 'spread',
+        'voltoday'}}, None if errors
+        """
+        try:
+            result = {}
+
+            # 1. From securities table get lot size, if it is available, PREVADMITTEDQUOTE (market price)
+            columns = response["securities"]["columns"]
+            secid_index = columns.index("SECID")
+            lotsize_index = columns.index("LOTSIZE")
+            avaliable_index = columns.index("STATUS")
+            prevadmittedquote_index = columns.index("PREVADMITTEDQUOTE")
+
+            for row in response["securities"]["data"]:
+                result[row[secid_index].lower()] = {'lotsize': row[lotsize_index],
+                                                    'status': row[avaliable_index],
+                                                    'prevadmittedquote': row[prevadmittedquote_index],
+                                                    'bid': None,
+                                                    'offer': None,
+                                                    'spread': None,
+                                                    'voltoday': None}
+
+            # 2. From market data get BID (buy price), OFFER (sell price), SPREAD and VOLTODAY (for quote API)
+            columns = response["marketdata"]["columns"]
+            secid_index = columns.index("SECID")
+            bid_index = columns.index("BID")
+            offer_index = columns.index("OFFER")
+            spread_index = columns.index("SPREAD") if "SPREAD" in columns else None
+            voltoday_index = columns.index("VOLTODAY") if "VOLTODAY" in columns else None
+
+            for row in response["marketdata"]["data"]:
+                if row[secid_index].lower() in result:
+                    result[row[secid_index].lower()]['bid'] = row[bid_index]
+                    result[row[secid_index].lower()]['offer'] = row[offer_index]
+                    if spread_index is not None:
+                        result[row[secid_index].lower()]['spread'] = row[spread_index]
+                    if voltoday_index is not None:
+                        result[row[secid_index].lower()]['voltoday'] = row[voltoday_index]
+
+            return result
+
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            helpers_functions.app_log_add(f"Error. helpers.py parse_market_data(): {e}")
+            return None
 
-            # 1. Contact API
-            try:
-                # Get market info
-                url = f"https://iss.moex.com/iss/" \
-                      f"engines/{results.get('engine')}/" \
-                      f"markets/{results.get('market')}/" \
-                      f"boards/{results.get('boardid')}/" \
-                      f"securities/{results.get('secid')}.json" \
-                      f"?iss.meta=off&" \
-                      f"iss.only=securities,marketdata&" \
-                      f"securities.columns=LOTSIZE,STATUS,PREVADMITTEDQUOTE&" \
-                      f"marketdata.columns=BID,OFFER"
-
-                response = requests.get(url)
-                response.raise_for_status()
-
-            except requests.RequestException as e:
-                helpers_functions.app_log_add(f"Error. helpers.py lookup(): {e}.")
-                error_messages.append(f'Извините, похоже не получается получить информацию о {symbol} '
-                                      'от московской биржи. Попробуйте другой тикер, при повторении ошибки свяжитесь с '
-                                      'администратором сайта.')
+    @staticmethod
+    def add_currency(results):
+        """
+        Add rate of ticker currency to lookup results (results[currencyid] = rate). Rubles need no rate.
+        :param results: dictionary with description and market prices
+        :return: tuple (errors, results) as lookup() returns
+        """
+        currency = results.get('currencyid')
+        if currency in fx_rates.rubles:
+            return None, results
+
+        rate = fx_rates.get_rate(currency) if currency else None
+        if rate:
+            results[currency] = rate
+            return None, results
+        else:
+            helpers_functions.app_log_add(f"Error. helpers.py lookup() Can not get currency rate for {currency} "
+                                          f"of {results.get('secid')}.")
+            return ['Извините, сейчас валютные операции недоступны. '
+                    'Попробуйте другой тикер. При повторении ошибки обратитесь к администратору сайта.'], None
 
-                return error_messages, None
+    @staticmethod
+    def get_description(symbol):
+        """
+        Get information for depo table and future request to MOEX API for market price.
+        Look at quote cache, then at securities table of database, then ask MOEX API.
+        :param symbol: ticker: str
+        :return tuple (error, result:dict : isqualifiedinvestors secid name faceunit initialfacevalue boardid engine
+        market currencyid)
+        """
 
-            # Parse response
-            try:
+        # Description and primary board change rarely - look at cache and securities table first
+        result = helpers_functions.description_stored(symbol)
+        if result:
+            return None, result
 
-                response = response.json()
-
-                # 1. From securities table get lot size, if it is available, PREVADMITTEDQUOTE (market price)
-                lotsize_index = response["securities"]["columns"].index("LOTSIZE")
-                avaliable_index = response["securities"]["columns"].index("STATUS")
-                prevadmittedquote_index = response["securities"]["columns"].index("PREVADMITTEDQUOTE")
-
-                # 2. If it is not available to buy or sell
-                if response["securities"]["data"][0][avaliable_index] != 'A':
-                    helpers_functions.app_log_add(f"Warning. helpers.py lookup(). Status index of {symbol} is "
-                                f"{response['securities']['data'][0][avaliable_index]}")
-                    error_messages.append(
-                        f"Извините, но в настоящее время {symbol} недоступен для торговли. Попробуйте другой тикер.")
-                    return error_messages, None
-
-                results["lotsize"] = response["securities"]["data"][0][lotsize_index]
-                results["prevadmittedquote"] = response["securities"]["data"][0][prevadmittedquote_index]
-
-                # 3. From market data get BID (buy price) and OFFER (sell price)
-                bid_index = response["marketdata"]["columns"].index("BID")
-                offer_index = response["marketdata"]["columns"].index("OFFER")
-
-                results['bid'] = response["marketdata"]["data"][0][bid_index]
-                results['offer'] = response["marketdata"]["data"][0][offer_index]
-
-                # 4. Add currency values
-                currency = get_currency()
-                if currency:
-                    results['usd'] = float(currency['usd'])
-                    results['eur'] = float(currency['eur'])
-                    return None, results
-                else:
-                    helpers_functions.app_log_add("Error. helpers.py lookup() Can not get currency results - "
-                                                  "they are empty.")
-                    # if currency is important for this operation
-                    if results['currencyid'] != 'rub':
-                        return ['Извините, сейчас валютные операции недоступны. " \
-                            "Попробуйте другой тикер. При повторении ошибки обратитесь к администратору сайта.'], None
-                    else:
-                        return None, results
+        # Contact API
+        try:
+            response = iss_client.get(helpers_functions.description_url(symbol))
+            response.raise_for_status()
+            quote = response.json()
+
+        except (requests.RequestException, ValueError) as e:
+            helpers_functions.app_log_add(f'Error. helpers.py get_description(): {e}.')
+            return [f'Извините, похоже не получается получить информацию о {symbol} '
+                    'от московской биржи. Попробуйте другой тикер, при повторении ошибки свяжитесь с '
+                    'администратором сайта.'], None
+
+        return helpers_functions.parse_description(symbol, quote)
+
+    @staticmethod
+    async def get_description_async(symbol):
+        """
+        Coroutine of get_description() for asyncio client (run it in event loop of async_iss_client).
+        :param symbol: ticker: str
+        :return tuple (error, result:dict) as get_description() returns
+        """
+        result = await asyncio.to_thread(helpers_functions.description_stored, symbol)
+        if result:
+            return None, result
+
+        # Contact API (errors are logged by async_iss_client)
+        quote = await async_iss_client.get_json(helpers_functions.description_url(symbol))
+        if quote is None:
+            return [f'Извините, похоже не получается получить информацию о {symbol} '
+                    'от московской биржи. Попробуйте другой тикер, при повторении ошибки свяжитесь с '
+                    'администратором сайта.'], None
+
+        return await asyncio.to_thread(helpers_functions.parse_description, symbol, quote)
+
+    @staticmethod
+    def description_stored(symbol):
+        """
+        Get description of security from quote cache or from securities table of database.
+        :param symbol: ticker: str
+        :return: dictionary as get_description() result or None
+        """
+        result = quote_cache.get('description', symbol.lower())
+        if result:
+            return result
+
+        result = helpers_functions.securities_get(symbol)
+        if result:
+            quote_cache.set('description', symbol.lower(), result)
+        return result
+
+    @staticmethod
+    def description_url(symbol):
+        """
+        Get MOEX API path of security description and boards (with russian titles for get_details()).
+        :param symbol: ticker: str
+        :return: str
+        """
+        return f"securities/{symbol}.json?" \
+               f"iss.meta=off&" \
+               f"description.columns=name,title,value&" \
+               f"boards.columns=secid,boardid,title,market,engine,is_primary,currencyid"
+
+    @staticmethod
+    def parse_description(symbol, quote):
+        """
+        Parse MOEX API answer with security description (see description_url()), cache it and save it to securities
+        table.
+        :param symbol: ticker: str
+        :param quote: dictionary - parsed JSON answer
+        :return tuple (error, result:dict) as get_description() returns
+        """
 
-            except (KeyError, TypeError, ValueError) as e:
-                helpers_functions.app_log_add(f"Error. helpers.lookup(): {e}")
-                error_messages.append(f'Извините, похоже не получается получить информацию о {symbol} '
-                                      'от московской биржи. Попробуйте другой тикер, при повторении ошибки свяжитесь с '
-                                      'администратором сайта.')
+        # Error message use for flash in client browser
+        error_messages = []
+
+        try:
+            result = {}
+
+            if quote:
+
+                # 1. DESCRIPTION TABLE
+
+                # Get columns number in description table
+                name_index = quote["description"]["columns"].index("name")
+                value_index = quote["description"]["columns"].index("value")
+
+                # Get data from description table for future price request and depo
+                # ISQUALIFIEDINVESTORS, SECID, NAME, FACEUNIT, INITIALFACEVALUE
+                # Look for this names in description table rows
+                interesting_names = dict.fromkeys(
+                    ('ISQUALIFIEDINVESTORS', 'SECID', 'NAME', 'FACEUNIT', 'INITIALFACEVALUE'))
+
+                for row in quote["description"]["data"]:
+
+                    if row[name_index] in interesting_names:
+
+                        if row[name_index] == 'INITIALFACEVALUE':
+                            result[row[name_index].lower()] = float(row[value_index])
+                        else:
+                            result[row[name_index].lower()] = row[value_index].lower()
+
+                # 2. BOARDS TABLE
+
+                # Get columns number in description table
+                boardid_index = quote["boards"]["columns"].index("boardid")
+                market_index = quote["boards"]["columns"].index("market")
+                engine_index = quote["boards"]["columns"].index("engine")
+                is_primary_index = quote["boards"]["columns"].index("is_primary")
+                currencyid_index = quote["boards"]["columns"].index("currencyid")
+
+                # Get data from boards table for future price request and depo
+                # Look for primary board in boards table rows
+
+                for row in quote["boards"]["data"]:
+                    if row[is_primary_index] == 1:
+                        result["boardid"] = row[boardid_index]
+                        result["engine"] = row[engine_index]
+                        result["market"] = row[market_index]
+                        result["currencyid"] = row[currencyid_index].lower()
+
+            # Unknown ticker - MOEX API answers with empty tables, it is not cached and not saved
+            if not result.get('secid'):
+                helpers_functions.app_log_add(f"Warning. helpers.py parse_description(): "
+                                              f"MOEX API does not know {symbol}.")
+                error_messages.append(f'Извините, тикер {symbol} не найден на московской бирже. '
+                                      'Проверьте тикер или попробуйте другой.')
                 return error_messages, None
-        else:
-            helpers_functions.app_log_add('Error. helpers.py lookup() get empty return from '
-                                          'helpers.lookup.get_description() function.')
+
+            quote_cache.set('description', symbol.lower(), result)
+            helpers_functions.securities_save(result)
+
+            # Full description for quote page is in the same answer - get_details() does not ask MOEX API again
+            details = helpers_functions.parse_details(quote)
+            if details:
+                quote_cache.set('description', f"{symbol.lower()}:details", details)
+            return None, result
+
+        except (KeyError, TypeError, ValueError) as e:
+            error_messages.append(f'Извините, похоже не получается получить информацию о {symbol} '
+                                  'от московской биржи. Попробуйте другой тикер, при повторении ошибки свяжитесь с '
+                                  'администратором сайта.')
+            helpers_functions.app_log_add(f"Error. helpers.py parse_description(): {e}")
             return error_messages, None
 
     @staticmethod
-    def take_symbols():
+    def get_details(symbol):
         """
-        Take list of allowed symbols from MOEX.
-        (https://iss.moex.com/iss/reference/)
-        :return: Length of tickers list.
+        Get full description of security (russian titles for quote page) and title of primary board.
+        Look at quote cache (details are cached by parse_description() from the same MOEX API answer as description),
+        then ask MOEX API.
+        :param symbol: ticker: str
+        :return: tuple (error, result:dict : description [[name, title, value], ...], boardid, board_title)
         """
 
-        # Contact API
+        # Cached with description of security (changes rarely)
+        key = f"{symbol.lower()}:details"
+        result = quote_cache.get('description', key)
+        if result:
+            return None, result
 
-        base_url = "https://iss.moex.com/iss"
+        error_messages = [f'Извините, похоже не получается получить информацию о {symbol} '
+                          'от московской биржи. Попробуйте другой тикер, при повторении ошибки свяжитесь с '
+                          'администратором сайта.']
 
-        tickers = {}
+        # Contact API (description is not in cache - it was taken from securities table)
+        try:
+            response = iss_client.get(helpers_functions.description_url(symbol))
+            response.raise_for_status()
+            quote = response.json()
 
-        # 1. Get russian shares info (https://iss.moex.com/iss/engines/stock/markets/shares/securities/columns.html)
+        except (requests.RequestException, ValueError) as e:
+            helpers_functions.app_log_add(f'Error. helpers.py get_details(): {e}.')
+            return error_messages, None
 
-        url = f"{base_url}/engines/stock/markets/shares/securities.json?iss.only=securities&securities.columns=SECID," \
-              f"STATUS,SHORTNAME "
-        response = requests.get(url)
+        errors, _ = helpers_functions.parse_description(symbol, quote)
+        result = quote_cache.get('description', key)
+        if not result:
+            return errors or error_messages, None
+        return None, result
 
+    @staticmethod
+    def parse_details(quote):
+        """
+        Parse full description of security and title of primary board from MOEX API answer (see description_url()).
+        :param quote: dictionary - parsed JSON answer
+        :return: dictionary {description [[name, title, value], ...], boardid, board_title} or None if errors
+        """
         try:
-            response.raise_for_status()
-        except requests.RequestException:
-            helpers_functions.app_log_add("Error. helpers.py take_symbols(): "
-                                          "Can not get database update shares from MOEX.")
+            # Rows which are not interesting for users
+            not_interest = ('GROUP', 'TYPE', 'GROUPNAME', 'EMITTER_ID')
+
+            columns = quote["description"]["columns"]
+            name_index = columns.index("name")
+            title_index = columns.index("title")
+            value_index = columns.index("value")
+            result = {'description': [[row[name_index], row[title_index], row[value_index]]
+                                      for row in quote["description"]["data"]
+                                      if row[name_index] not in not_interest],
+                      'boardid': None,
+                      'board_title': None}
+
+            columns = quote["boards"]["columns"]
+            boardid_index = columns.index("boardid")
+            title_index = columns.index("title")
+            is_primary_index = columns.index("is_primary")
+            for row in quote["boards"]["data"]:
+                if row[is_primary_index] == 1:
+                    result['boardid'] = row[boardid_index]
+                    result['board_title'] = row[title_index]
+                    break
+
+        except (KeyError, TypeError, ValueError) as e:
+            helpers_functions.app_log_add(f"Error. helpers.py parse_details(): {e}")
             return None
-        # Parse response
+
+        return result if result['description'] else None
+
+    @staticmethod
+    def securities_get(symbol):
+        """
+        Get security description from securities table of database.
+        :param symbol: ticker: str
+        :return: dictionary as get_description() result or None if there is not full and fresh row for symbol
+        """
+
+        db_name = helpers_functions.database_name
+        if not db_name:
+            return None
+
+        database = sqlite3.connect(db_name)
+        database.row_factory = sqlite3.Row
         try:
-            symbols_json = response.json()
-            secid_index = symbols_json["securities"]['columns'].index('SECID')
-            status_index = symbols_json["securities"]['columns'].index('STATUS')
-            secname_index = symbols_json["securities"]['columns'].index('SHORTNAME')
+            row = database.execute("SELECT secid, name, isqualifiedinvestors, faceunit, initialfacevalue, "
+                                   "boardid, engine, market, currencyid, updated_at "
+                                   "FROM securities "
+                                   "WHERE secid = ?",
+                                   (symbol.lower(),)).fetchone()
+        except database.Error as e:
+            helpers_functions.app_log_add(f"Error. helpers.py securities_get(): sqlite3 {e}.")
+            return None
+        finally:
+            database.close()
+
+        # Row is added by take_symbols() but not filled with primary board yet
+        if not row or not row['updated_at']:
+            return None
+
+        # Row is stale - it must be refreshed from MOEX API
+        try:
+            updated_at = datetime.fromisoformat(row['updated_at'])
+        except ValueError:
+            return None
+        age = datetime.now(tz=pytz.timezone('Europe/Moscow')) - updated_at
+        if age.total_seconds() > helpers_functions.securities_ttl:
+            return None
 
-            # Delete redundancy tickers
+        result = dict(row)
+        del result['updated_at']
+        if result['initialfacevalue'] is None:
+            del result['initialfacevalue']
+        return result
+
+    @staticmethod
+    def securities_save(result: dict):
+        """
+        Insert or update row of securities table with get_description() result.
+        :param result: dictionary from get_description()
+        :return: None
+        """
 
-            for row in symbols_json['securities']['data']:
-                if row[status_index] == 'A' and row[secid_index] not in tickers:
-                    tickers[row[secid_index]] = row[secname_index]
-        except (ValueError, TypeError):
+        db_name = helpers_functions.database_name
+        if not db_name or not result.get('secid'):
             return None
 
-        # 2. Get russian bonds
+        database = sqlite3.connect(db_name)
+        try:
+            with database:
+                database.execute("INSERT INTO securities (secid, name, isqualifiedinvestors, faceunit, "
+                                 "initialfacevalue, boardid, engine, market, currencyid, updated_at) "
+                                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                                 "ON CONFLICT (secid) DO UPDATE SET "
+                                 "name = excluded.name, isqualifiedinvestors = excluded.isqualifiedinvestors, "
+                                 "faceunit = excluded.faceunit, initialfacevalue = excluded.initialfacevalue, "
+                                 "boardid = excluded.boardid, engine = excluded.engine, market = excluded.market, "
+                                 "currencyid = excluded.currencyid, updated_at = excluded.updated_at",
+                                 (result.get('secid'), result.get('name'), result.get('isqualifiedinvestors'),
+                                  result.get('faceunit'), result.get('initialfacevalue'), result.get('boardid'),
+                                  result.get('engine'), result.get('market'), result.get('currencyid'),
+                                  datetime.now(tz=pytz.timezone('Europe/Moscow')).isoformat()))
+        except database.Error as e:
+            helpers_functions.app_log_add(f"Error. helpers.py securities_save(): sqlite3 {e}.")
+        finally:
+            database.close()
 
-        url = f"{base_url}/engines/stock/markets/bonds/securities.json?iss.only=securities&securities.columns=SECID," \
-              f"STATUS,SHORTNAME "
-        response = requests.get(url)
+    @staticmethod
+    def quotes_get(secids, max_age):
+        """
+        Get market prices from quotes table of database.
+        :param secids: list of secid (lower case)
+        :param max_age: seconds - older rows are ignored, None - rows of any age
+        :return: dictionary {secid: {'lotsize', 'prevadmittedquote', 'bid', 'offer'}}
+        """
 
+        db_name = helpers_functions.database_name
+        if not db_name or not secids:
+            return {}
+
+        fresh_time = '' if max_age is None else \
+            datetime.fromtimestamp(datetime.now().timestamp() - max_age, tz=pytz.timezone('Europe/Moscow')).isoformat()
+
+        database = sqlite3.connect(db_name)
+        database.row_factory = sqlite3.Row
         try:
-            response.raise_for_status()
-        except requests.RequestException:
-            helpers_functions.app_log_add("Error. helpers.py take_symbols(): "
-                                          "Can not get database update bonds from MOEX.")
+            rows = database.execute(f"SELECT secid, lotsize, prevadmittedquote, bid, offer "
+                                    f"FROM quotes "
+                                    f"WHERE secid IN ({','.join('?' * len(secids))}) AND fetched_at >= ?",
+                                    (*secids, fresh_time)).fetchall()
+        except database.Error as e:
+            helpers_functions.app_log_add(f"Error. helpers.py quotes_get(): sqlite3 {e}.")
+            return {}
+        finally:
+            database.close()
+
+        return {row['secid']: {'lotsize': row['lotsize'], 'prevadmittedquote': row['prevadmittedquote'],
+                               'bid': row['bid'], 'offer': row['offer']} for row in rows}
+
+    @staticmethod
+    def quotes_save(results_list):
+        """
+        Insert or update rows of quotes table with lookup() results.
+        :param results_list: list of results dictionaries from lookup()
+        :return: number of saved rows or None if errors
+        """
+
+        db_name = helpers_functions.database_name
+        if not db_name:
             return None
-        # Parse response
+
+        fetched_at = datetime.now(tz=pytz.timezone('Europe/Moscow')).isoformat()
+
+        database = sqlite3.connect(db_name)
         try:
-            symbols_json = response.json()
-            secid_index = symbols_json["securities"]['columns'].index('SECID')
-            status_index = symbols_json["securities"]['columns'].index('STATUS')
-            secname_index = symbols_json["securities"]['columns'].index('SHORTNAME')
+            with database:
+                database.executemany("INSERT INTO quotes (secid, lotsize, prevadmittedquote, bid, offer, fetched_at) "
+                                     "VALUES (?, ?, ?, ?, ?, ?) "
+                                     "ON CONFLICT (secid) DO UPDATE SET "
+                                     "lotsize = excluded.lotsize, prevadmittedquote = excluded.prevadmittedquote, "
+                                     "bid = excluded.bid, offer = excluded.offer, fetched_at = excluded.fetched_at",
+                                     [(results['secid'], results.get('lotsize'), results.get('prevadmittedquote'),
+                                       results.get('bid'), results.get('offer'), fetched_at)
+                                      for results in results_list])
+            return len(results_list)
+        except database.Error as e:
+            helpers_functions.app_log_add(f"Error. helpers.py quotes_save(): sqlite3 {e}.")
+            return None
+        finally:
+            database.close()
 
-            # Delete redundancy tickers
+    @staticmethod
+    def refresh_securities(limit=100):
+        """
+        Incremental refresh of securities table: get description from MOEX API for tickers from depo table
+        which rows are not filled yet or stale.
+        :param limit: max number of tickers to refresh
+        :return: number of refreshed tickers or None if errors
+        """
 
-            for row in symbols_json['securities']['data']:
-                if row[status_index] == 'A' and row[secid_index] not in tickers:
-                    tickers[row[secid_index]] = row[secname_index]
-        except (ValueError, TypeError):
+        db_name = helpers_functions.database_name
+        if not db_name:
             return None
 
-        # 3. Get foreign shares
+        stale_time = datetime.fromtimestamp(datetime.now().timestamp() - helpers_functions.securities_ttl,
+                                            tz=pytz.timezone('Europe/Moscow')).isoformat()
 
-        url = f"{base_url}/engines/stock/markets/foreignshares/" \
-              f"securities.json?iss.only=securities&securities.columns=SECID,STATUS,SHORTNAME"
-        response = requests.get(url)
+        database = sqlite3.connect(db_name)
+        try:
+            rows = database.execute("SELECT DISTINCT depo.ticker "
+                                    "FROM depo "
+                                    "LEFT JOIN securities ON depo.ticker = securities.secid "
+                                    "WHERE securities.updated_at IS NULL OR securities.updated_at < ? "
+                                    "LIMIT ?",
+                                    (stale_time, limit)).fetchall()
+        except database.Error as e:
+            helpers_functions.app_log_add(f"Error. helpers.py refresh_securities(): sqlite3 {e}.")
+            return None
+        finally:
+            database.close()
+
+        refreshed = 0
+        for row in rows:
+            # Stale row is skipped by get_description() and rewritten from MOEX API
+            if helpers_functions.get_description(row[0])[1]:
+                refreshed += 1
 
+        return refreshed
+
+    @staticmethod
+    def get_market_listing(market: str):
+        """
+        Get traded securities of stock market from MOEX.
+        (https://iss.moex.com/iss/engines/stock/markets/shares/securities/columns.html)
+        :param market: 'shares', 'bonds' or 'foreignshares'
+        :return: list of (secid, secname, isin) or None if errors
+        """
+        url = f"engines/stock/markets/{market}/securities.json?iss.only=securities&securities.columns=SECID," \
+              f"STATUS,SHORTNAME,ISIN"
         try:
+            response = iss_client.get(url)
             response.raise_for_status()
         except requests.RequestException:
-            helpers_functions.app_log_add("Error. helpers.py take_symbols(): "
-                                          "Can not get database update foreign shares from MOEX.")
+            helpers_functions.app_log_add(f"Error. helpers.py get_market_listing(): "
+                                          f"Can not get database update {market} from MOEX.")
             return None
         # Parse response
         try:
             symbols_json = response.json()
-            secid_index = symbols_json["securities"]['columns'].index('SECID')
-            status_index = symbols_json["securities"]['columns'].index('STATUS')
-            secname_index = symbols_json["securities"]['columns'].index('SHORTNAME')
+            columns = symbols_json["securities"]['columns']
+            secid_index = columns.index('SECID')
+            status_index = columns.index('STATUS')
+            secname_index = columns.index('SHORTNAME')
+            isin_index = columns.index('ISIN') if 'ISIN' in columns else None
+
+            return [(row[secid_index], row[secname_index], row[isin_index] if isin_index is not None else None)
+                    for row in symbols_json['securities']['data']
+                    if row[status_index] == 'A']
+        except (ValueError, TypeError, KeyError):
+            helpers_functions.app_log_add(f"Error. helpers.py get_market_listing(): "
+                                          f"Can not parse {market} from MOEX.")
+            return None
+
+    @staticmethod
+    def take_symbols():
+        """
+        Take list of allowed symbols from MOEX and apply changes to listing table
+        (insert new tickers, update renamed, delete delisted).
+        (https://iss.moex.com/iss/reference/)
+        :return: Length of tickers list.
+        """
 
-            # Delete redundancy tickers
+        started = time.perf_counter()
 
-            for row in symbols_json['securities']['data']:
-                if row[status_index] == 'A' and row[secid_index] not in tickers:
-                    tickers[row[secid_index]] = row[secname_index]
-        except (ValueError, TypeError):
+        # 1. Contact API - get shares, bonds and foreign shares concurrently
+        # (ticker of several markets belongs to the first one)
+        market_names = ('shares', 'bonds', 'foreignshares')
+        listings = iss_client.map(helpers_functions.get_market_listing, market_names)
+        if any(listing is None for listing in listings):
             return None
 
-        # UPDATE DATABASE
+        # {secid: (secname, market, isin)}
+        tickers = {}
+        for market, listing in zip(market_names, listings):
+            for secid, secname, isin in listing:
+                if secid not in tickers:
+                    tickers[secid] = (secname, market, isin)
+
+        downloaded = time.perf_counter()
+
+        if not tickers:
+            return 0
+
+        # 2. UPDATE DATABASE
 
         database = sqlite3.connect(helpers_functions.database_name)
         database.row_factory = sqlite3.Row
 
-        if len(tickers) > 0:
-
-            # --------------------------TRANSACTION ----------------------------
-            # Transaction - write tickets to database listing table
-            database.isolation_level = None
-            database.execute("begin")
-            try:
-                # Drop old table listing
-                database.execute("DELETE FROM listing")
-
-                # Write data to listing table
-                for secid, secname in tickers.items():
-                    database.execute("INSERT "
-                                     "INTO listing (secid, secname) "
-                                     "VALUES (?, ?)",
-                                     (secid, secname))
-
-                # Commit changes
-                database.execute("commit")
-                helpers_functions.app_log_add(f"Success. helpers.py take_symbols(): "
-                                              f"Add {len(tickers)} rows to database listing table.")
-
-            except database.Error as e:
-                helpers_functions.app_log_add(f"Error. helpers.py take_symbols(): SQL error in transaction {e}.")
-                database.execute("rollback")
-            # -------------------------END TRANSACTION ---------------------------
-            database.close()
+        # --------------------------TRANSACTION ----------------------------
+        # Transaction - apply difference to database listing table (triggers keep listing_fts in sync)
+        database.isolation_level = None
+        database.execute("begin")
+        try:
+            # Compare with current listing
+            inserted = []
+            updated = []
+            deleted = []
+            current = set()
+            for row in database.execute("SELECT id, secid, secname, market, isin FROM listing").fetchall():
+                new = tickers.get(row['secid'])
+                if new is None or row['secid'] in current:
+                    # Delisted ticker (or duplicate row)
+                    deleted.append((row['id'],))
+                    continue
+                current.add(row['secid'])
+                if (row['secname'], row['market'], row['isin']) != new:
+                    updated.append(new + (row['id'],))
+            for secid, (secname, market, isin) in tickers.items():
+                if secid not in current:
+                    inserted.append((secid, secname, market, isin))
+
+            database.executemany("DELETE FROM listing WHERE id = ?", deleted)
+            database.executemany("UPDATE listing "
+                                 "SET secname = ?, market = ?, isin = ? "
+                                 "WHERE id = ?",
+                                 updated)
+            database.executemany("INSERT "
+                                 "INTO listing (secid, secname, market, isin) "
+                                 "VALUES (?, ?, ?, ?)",
+                                 inserted)
+
+            # Add new tickers to securities table (primary board is filled later by get_description())
+            database.executemany("INSERT INTO securities (secid, market, engine) "
+                                 "VALUES (?, ?, 'stock') "
+                                 "ON CONFLICT (secid) DO NOTHING",
+                                 [(secid.lower(), market) for secid, secname, market, isin in inserted])
+
+            # Delete tickers which are not traded now from securities table
+            if deleted:
+                database.execute("DELETE FROM securities "
+                                 "WHERE secid NOT IN (SELECT lower(secid) FROM listing)")
+
+            # Commit changes
+            database.execute("commit")
+            helpers_functions.app_log_add(f"Success. helpers.py take_symbols(): listing table has {len(tickers)} rows "
+                                          f"(inserted {len(inserted)}, updated {len(updated)}, "
+                                          f"deleted {len(deleted)}) in {time.perf_counter() - started:.2f} s "
+                                          f"(MOEX API {downloaded - started:.2f} s).")
+
+            # Reload autocomplete index with new listing
+            if inserted or updated or deleted:
+                ticker_index.load(helpers_functions.database_name)
+
+        except database.Error as e:
+            helpers_functions.app_log_add(f"Error. helpers.py take_symbols(): SQL error in transaction {e}.")
+            database.execute("rollback")
+        # -------------------------END TRANSACTION ---------------------------
+        database.close()
+
+        # Fill securities table for tickers which users have
+        helpers_functions.refresh_securities()
 
         return len(tickers)
 
@@ -383,6 +910,26 @@ class helpers_functions:
         else:
             return f"Sorry, your ticker ({ticker}) is empty."
 
+    @staticmethod
+    def check_search_text_fail(query: str):
+        """
+        Check search query for ticker autocomplete (part of ticker or company name).
+        :param query: str
+        :return: None if query consists of letters (any language), digits, spaces and -+=."' symbols
+        else return error message.
+        """
+        assert isinstance(query, str)
+
+        if query.strip():
+            pattern = re.compile(r"[\w +=.\"'-]{1,50}")
+            if not pattern.fullmatch(query):
+                return f"Sorry, your query ({query}) is not consists only from letters, digits and + - = symbols."
+            # Alright
+            return None
+
+        else:
+            return f"Sorry, your query ({query}) is empty."
+
     @staticmethod
     def check_count_text_fail(count: str):
         """
@@ -434,7 +981,7 @@ class helpers_functions:
                       'prevadmittedquote' - if you want moex cource;
         :param number: int number of lots
         :param results: dictionary from helpers.lookup()[1] - result of request to MOEX API;
-        :return: float final price in rubles with eur, usd, bond, shares input. lot * current price for bonds, shares,
+        :return: float final price in rubles with any currency, bond, shares input. lot * current price for bonds, shares,
                  foreign shares or None.
         """
 
@@ -449,40 +996,28 @@ class helpers_functions:
             # Check currencyid (Attention! may be more legal use results["faceunit"] on test bonds they are equal)
             currency = results["currencyid"]
 
+            # Get currency rate from lookup results or from currency rates provider
+            rate = results.get(currency) or fx_rates.get_rate(currency)
+            if not rate:
+                helpers_functions.app_log_add(f"Error. helpers.py check_final_price(): "
+                                              f"Can not get currency rate for {currency}.")
+                return None
+
+            # Check lotsize
+            lotsize = results["lotsize"]
+
             # If it is bonds
             if results["market"] == 'bonds':
 
                 # Check initialfacevalue
                 initialfacevalue = results["initialfacevalue"]
-                # Check lotsize
-                lotsize = results["lotsize"]
-                # Check usd/eur values
                 # Get final price
-                if currency == 'usd':
-                    final_price = int(number) * float(results[price]) * 0.01 * float(initialfacevalue) * int(
-                        lotsize) * float(results['usd'])
-                elif currency == 'eur':
-                    final_price = int(number) * float(results[price]) * 0.01 * float(initialfacevalue) * int(
-                        lotsize) * float(results['eur'])
-                elif currency == 'rub' or currency == 'sur':
-                    final_price = int(number) * float(results[price]) * 0.01 * float(initialfacevalue) * int(lotsize)
-                else:
-                    helpers_functions.app_log_add(f"Error. helpers.py check_final_price(): "
-                                                  f"Can not get currency in results.")
+                final_price = int(number) * float(results[price]) * 0.01 * float(initialfacevalue) * int(
+                    lotsize) * float(rate)
 
             # If it is shares or foreign shares
             else:
-                # Check lotsize
-                lotsize = results["lotsize"]
-                if currency == 'usd':
-                    final_price = int(number) * float(results[price]) * int(lotsize) * float(results['usd'])
-                elif currency == 'eur':
-                    final_price = int(number) * float(results[price]) * int(lotsize) * float(results['eur'])
-                elif currency == 'rub' or currency == 'sur':
-                    final_price = int(number) * int(lotsize) * float(results[price])
-                else:
-                    helpers_functions.app_log_add(f"Error. helpers.py check_final_price(): "
-                                                  f"Can not get currency in results.")
+                final_price = int(number) * float(results[price]) * int(lotsize) * float(rate)
 
             return final_price
 
@@ -506,7 +1041,7 @@ class helpers_functions:
     @staticmethod
     def app_log_add(text: str):
         """
-        Add row to app_log table of database
+        Add row to app_log table of database (buffered, see applog.py)
         :param text: text message to adding to database
         :return: None
         """
@@ -515,15 +1050,5 @@ class helpers_functions:
         except:
             message = 'Error. db.app_log_add() message to app_log is not string'
 
-        db_name = helpers_functions.database_name
-        if db_name:
-            database = sqlite3.connect(db_name)
-            with database:
-                database.execute("INSERT INTO app_log (log_text, date_time) "
-                                 "VALUES (?, ?)",
-                                 (message, datetime.now(tz=pytz.timezone('Europe/Moscow')).isoformat()))
-
-            database.close()
-
-        else:
-            print("Error. helpers.py app_log_add Can not get database name from class helper_functions")
\ No newline at end of file
+        # Buffered - written to app_log table in batches by applog.py app_logger
+        app_logger.add(message, helpers_functions.database_name)
\ No newline at end of file
@@ -0,0 +1,34 @@
+"""
+MOEX ISS API package: pooled client with timeouts and concurrency cap (client.py), asyncio client with sync
+facade (aio.py), cache of answers (cache.py), currency rates (currency.py).
+Flask app, scheduler and refresher configure it with configure() from the same config file
+(see moex_invest/config.py).
+"""
+
+from moex_invest.iss.client import iss_client
+from moex_invest.iss.aio import async_iss_client
+from moex_invest.iss.cache import quote_cache
+from moex_invest.iss.currency import fx_rates
+
+
+def configure(config):
+    """
+    Configure client, cache and currency rates from app.config (or flask.Config of worker).
+    :param config: mapping with ISS_*, FX_*, QUOTE_CACHE_*, DESCRIPTION_CACHE_TTL settings
+    :return: None
+    """
+
+    # Connection pool, timeouts, concurrency
+    iss_client.configure(base_url=config.get("ISS_BASE_URL"),
+                         timeout=config.get("ISS_TIMEOUT"),
+                         max_workers=config.get("ISS_MAX_WORKERS"),
+                         max_connections=config.get("ISS_MAX_CONNECTIONS"))
+    async_iss_client.configure()
+
+    # Currency rates provider
+    fx_rates.configure(ttl=config.get("FX_RATES_TTL"), fixes=config.get("FX_FIXES"))
+
+    # Process-wide cache of MOEX API answers
+    quote_cache.configure(maxsize=config.get("QUOTE_CACHE_SIZE"),
+                          description_ttl=config.get("DESCRIPTION_CACHE_TTL"),
+                          market_ttl=config.get("QUOTE_CACHE_TTL"))
@@ -0,0 +1,165 @@
+"""
+Asynchronous MOEX ISS API client (httpx).
+async_iss_client keeps one httpx.AsyncClient (keep-alive connections) on its own event loop thread, so many requests
+are made concurrently by one thread. Coroutines of client loop (helpers.py lookup_many_async(), refresher.py and
+alerts.py loops if ISS_ASYNC is set) await get() / get_json_many(), async views of other event loops await call(),
+sync code (Flask blueprints, helpers.py lookup_many() if ISS_ASYNC is set) uses sync facade run().
+async_iss_client configured with moex_invest.iss.configure() from app.config (the same settings as iss_client)
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+import httpx
+from moex_invest.iss.client import iss_client
+
+
+class async_iss_client:
+    # Wait for sync facade result not longer than this number of seconds
+    facade_timeout = 60
+
+    _lock = threading.Lock()
+    _loop = None
+    _thread = None
+    _client = None
+    _semaphore = None
+
+    @staticmethod
+    def configure():
+        """
+        Close client - it is recreated with current iss_client settings (base_url, timeout, max_connections)
+        on next request.
+        :return: None
+        """
+        with async_iss_client._lock:
+            loop = async_iss_client._loop
+        if loop is not None:
+            async_iss_client.run(async_iss_client.close())
+
+    @staticmethod
+    def loop():
+        """
+        Get event loop of client thread (loop and thread are started on first call).
+        :return: asyncio event loop
+        """
+        with async_iss_client._lock:
+            if async_iss_client._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='iss_async', daemon=True)
+                thread.start()
+                async_iss_client._loop = loop
+                async_iss_client._thread = thread
+            return async_iss_client._loop
+
+    @staticmethod
+    def client():
+        """
+        Get shared httpx.AsyncClient (call it in event loop of client thread).
+        :return: httpx.AsyncClient
+        """
+        if async_iss_client._client is None:
+            timeout = iss_client.timeout
+            if isinstance(timeout, tuple):
+                timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+            limits = httpx.Limits(max_connections=iss_client.max_connections,
+                                  max_keepalive_connections=iss_client.max_connections)
+            async_iss_client._client = httpx.AsyncClient(base_url=iss_client.base_url + '/', timeout=timeout,
+                                                         limits=limits)
+            async_iss_client._semaphore = asyncio.Semaphore(iss_client.max_connections)
+        return async_iss_client._client
+
+    @staticmethod
+    async def close():
+        """
+        Close shared client.
+        :return: None
+        """
+        client = async_iss_client._client
+        async_iss_client._client = None
+        if client is not None:
+            await client.aclose()
+
+    @staticmethod
+    async def get(path: str):
+        """
+        Make GET request to MOEX API with shared client and concurrency cap.
+        :param path: path relative to base_url or full url
+        :return: httpx.Response (raise httpx.HTTPError if errors)
+        """
+        client = async_iss_client.client()
+        async with async_iss_client._semaphore:
+            return await client.get(path.lstrip('/') if '://' not in path else path)
+
+    @staticmethod
+    async def get_json(path: str):
+        """
+        Get parsed JSON answer of MOEX API.
+        :param path: path relative to base_url or full url
+        :return: dictionary or None if errors (errors are written to app_log)
+        """
+        try:
+            response = await async_iss_client.get(path)
+            response.raise_for_status()
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            # helpers.py imports iss package - import it at call time
+            from moex_invest.helpers import helpers_functions
+            message = str(e).splitlines()[0] if str(e) else ''
+            helpers_functions.app_log_add(f"Error. aio.py get_json(): {path.split('?')[0]} "
+                                          f"{e.__class__.__name__} {message}.")
+            return None
+
+    @staticmethod
+    async def get_json_many(paths):
+        """
+        Get parsed JSON answers of MOEX API concurrently.
+        :param paths: iterable of paths
+        :return: list of dictionaries (None if errors) in paths order
+        """
+        return list(await asyncio.gather(*(async_iss_client.get_json(path) for path in paths)))
+
+    @staticmethod
+    def run(coroutine, timeout=-1):
+        """
+        Sync facade: run coroutine in event loop of client thread and wait for result.
+        Do not call it from coroutines of client loop.
+        :param coroutine: coroutine
+        :param timeout: seconds to wait (-1 - facade_timeout, None - wait without limit)
+        :return: result of coroutine (raise concurrent.futures.TimeoutError if timeout, coroutine is cancelled)
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, async_iss_client.loop())
+        try:
+            return future.result(timeout=async_iss_client.facade_timeout if timeout == -1 else timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    @staticmethod
+    async def call(coroutine, timeout=-1):
+        """
+        Await coroutine in event loop of client thread from other event loop (async Flask views).
+        :param coroutine: coroutine
+        :param timeout: seconds to wait (-1 - facade_timeout, None - wait without limit)
+        :return: result of coroutine (raise asyncio.TimeoutError if timeout, coroutine is cancelled)
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, async_iss_client.loop())
+        return await asyncio.wait_for(asyncio.wrap_future(future),
+                                      async_iss_client.facade_timeout if timeout == -1 else timeout)
+
+    @staticmethod
+    def get_json_many_sync(paths):
+        """
+        Sync facade of get_json_many().
+        :param paths: iterable of paths
+        :return: list of dictionaries (None if errors or timeout) in paths order
+        """
+        paths = list(paths)
+        if not paths:
+            return []
+        try:
+            return async_iss_client.run(async_iss_client.get_json_many(paths))
+        except concurrent.futures.TimeoutError:
+            from moex_invest.helpers import helpers_functions
+            helpers_functions.app_log_add(f"Error. aio.py get_json_many_sync(): MOEX API did not answer in "
+                                          f"{async_iss_client.facade_timeout} s for {len(paths)} requests.")
+            return [None] * len(paths)
@@ -0,0 +1,109 @@
+"""
+Process-wide cache for MOEX API answers.
+quote_cache configured with moex_invest.iss.configure() from app.config
+"""
+
+import threading
+from cachetools import TTLCache
+
+
+class quote_cache:
+    """
+    Two LRU caches with time to live:
+    'description' - static data of security (description and primary board), lives for hours;
+    'market' - bid, offer and prevadmittedquote, lives for seconds (MOEX API is 15 minutes delayed).
+    """
+
+    # Default settings (override it with QUOTE_CACHE_SIZE, DESCRIPTION_CACHE_TTL, QUOTE_CACHE_TTL in app.config)
+    maxsize = 1024
+    description_ttl = 6 * 60 * 60
+    market_ttl = 60
+
+    _lock = threading.Lock()
+    _caches = {
+        'description': TTLCache(maxsize=maxsize, ttl=description_ttl),
+        'market': TTLCache(maxsize=maxsize, ttl=market_ttl)
+    }
+    _counters = {
+        'description': {'hits': 0, 'misses': 0},
+        'market': {'hits': 0, 'misses': 0}
+    }
+
+    @staticmethod
+    def configure(maxsize=None, description_ttl=None, market_ttl=None):
+        """
+        Recreate caches with new settings. Cached values are dropped.
+        :param maxsize: max number of items in every cache (least recently used are evicted)
+        :param description_ttl: seconds to keep description of security
+        :param market_ttl: seconds to keep market prices
+        :return: None
+        """
+        with quote_cache._lock:
+            if maxsize:
+                quote_cache.maxsize = int(maxsize)
+            if description_ttl:
+                quote_cache.description_ttl = float(description_ttl)
+            if market_ttl:
+                quote_cache.market_ttl = float(market_ttl)
+
+            quote_cache._caches['description'] = TTLCache(maxsize=quote_cache.maxsize,
+                                                          ttl=quote_cache.description_ttl)
+            quote_cache._caches['market'] = TTLCache(maxsize=quote_cache.maxsize, ttl=quote_cache.market_ttl)
+
+    @staticmethod
+    def get(kind: str, key):
+        """
+        Get value from cache and count hit or miss.
+        :param kind: 'description' or 'market'
+        :param key: cache key (usually ticker)
+        :return: copy of cached dictionary or None
+        """
+        assert kind in quote_cache._caches
+
+        with quote_cache._lock:
+            value = quote_cache._caches[kind].get(key)
+            if value is None:
+                quote_cache._counters[kind]['misses'] += 1
+                return None
+            quote_cache._counters[kind]['hits'] += 1
+
+        # Callers change result dictionaries - do not give them cached object
+        return dict(value)
+
+    @staticmethod
+    def set(kind: str, key, value: dict):
+        """
+        Put value to cache.
+        :param kind: 'description' or 'market'
+        :param key: cache key (usually ticker)
+        :param value: dictionary to cache
+        :return: None
+        """
+        assert kind in quote_cache._caches
+
+        with quote_cache._lock:
+            quote_cache._caches[kind][key] = dict(value)
+
+    @staticmethod
+    def clear():
+        """
+        Drop all cached values (counters are kept).
+        :return: None
+        """
+        with quote_cache._lock:
+            for cache in quote_cache._caches.values():
+                cache.clear()
+
+    @staticmethod
+    def stats():
+        """
+        Get cache statistics.
+        :return: dictionary {kind: {'hits': int, 'misses': int, 'size': int, 'maxsize': int, 'ttl': float}}
+        """
+        with quote_cache._lock:
+            return {kind: {'hits': quote_cache._counters[kind]['hits'],
+                           'misses': quote_cache._counters[kind]['misses'],
+                           'size': len(cache),
+                           'maxsize': cache.maxsize,
+                           'ttl': cache.ttl}
+                    for kind, cache in quote_cache._caches.items()}
@@ -0,0 +1,127 @@
+"""
+MOEX ISS API client.
+All requests to MOEX API go through iss_client: one pooled requests.Session (keep-alive connections),
+per request timeouts, global concurrency cap and bounded thread pool for independent requests.
+iss_client configured with moex_invest.iss.configure() from app.config
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class iss_client:
+    # Default settings (override it with ISS_BASE_URL, ISS_TIMEOUT, ISS_MAX_WORKERS, ISS_MAX_CONNECTIONS in app.config)
+    base_url = 'https://iss.moex.com/iss'
+    # (connect timeout, read timeout) in seconds
+    timeout = (3.05, 10)
+    # Threads to make independent requests
+    max_workers = 8
+    # Max number of simultaneous requests to MOEX API from this process
+    max_connections = 8
+
+    _lock = threading.Lock()
+    _session = None
+    _executor = None
+    _semaphore = threading.BoundedSemaphore(max_connections)
+
+    @staticmethod
+    def configure(base_url=None, timeout=None, max_workers=None, max_connections=None):
+        """
+        Change client settings. Session and thread pool are recreated on next request.
+        :param base_url: MOEX API root url (may be local stub)
+        :param timeout: seconds or tuple (connect, read) seconds
+        :param max_workers: number of threads for concurrent requests
+        :param max_connections: max number of simultaneous requests
+        :return: None
+        """
+        with iss_client._lock:
+            if base_url:
+                iss_client.base_url = base_url.rstrip('/')
+            if timeout:
+                iss_client.timeout = tuple(timeout) if isinstance(timeout, (list, tuple)) else float(timeout)
+            if max_workers:
+                iss_client.max_workers = int(max_workers)
+            if max_connections:
+                iss_client.max_connections = int(max_connections)
+                iss_client._semaphore = threading.BoundedSemaphore(iss_client.max_connections)
+
+            if iss_client._session:
+                iss_client._session.close()
+                iss_client._session = None
+            if iss_client._executor:
+                iss_client._executor.shutdown(wait=False)
+                iss_client._executor = None
+
+    @staticmethod
+    def session():
+        """
+        Get shared requests session with connection pool.
+        :return: requests.Session
+        """
+        with iss_client._lock:
+            if iss_client._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=iss_client.max_connections)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                iss_client._session = session
+            return iss_client._session
+
+    @staticmethod
+    def executor():
+        """
+        Get shared thread pool for concurrent requests.
+        :return: ThreadPoolExecutor
+        """
+        with iss_client._lock:
+            if iss_client._executor is None:
+                iss_client._executor = ThreadPoolExecutor(max_workers=iss_client.max_workers,
+                                                          thread_name_prefix='iss')
+            return iss_client._executor
+
+    @staticmethod
+    def url(path: str):
+        """
+        Get full url for MOEX API path.
+        :param path: path like 'securities/sber.json?iss.meta=off' or full url
+        :return: url: str
+        """
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return f"{iss_client.base_url}/{path.lstrip('/')}"
+
+    @staticmethod
+    def get(path: str):
+        """
+        Make GET request to MOEX API with shared session, timeout and concurrency cap.
+        :param path: path relative to base_url or full url
+        :return: requests.Response (raise requests.RequestException if errors)
+        """
+        with iss_client._semaphore:
+            return iss_client.session().get(iss_client.url(path), timeout=iss_client.timeout)
+
+    @staticmethod
+    def submit(function, *args):
+        """
+        Run function in thread pool. Do not call submit() or map() from inside submitted function.
+        :param function: callable
+        :param args: arguments
+        :return: concurrent.futures.Future
+        """
+        return iss_client.executor().submit(function, *args)
+
+    @staticmethod
+    def map(function, items):
+        """
+        Run function for every item concurrently in thread pool.
+        :param function: callable with one argument
+        :param items: iterable of arguments
+        :return: list of function results in items order
+        """
+        items = list(items)
+        # Do not use threads for one request
+        if len(items) < 2:
+            return [function(item) for item in items]
+        return list(iss_client.executor().map(function, items))
@@ -0,0 +1,104 @@
+"""
+Currency rates provider.
+Daily MOEX fixes (usdfix, eurfix, cnyfix...) are requested lazily - only for currency that is really needed -
+and kept in own cache. fx_rates configured with moex_invest.iss.configure() from app.config
+"""
+
+import threading
+import requests
+from cachetools import TTLCache
+from moex_invest.iss.client import iss_client
+
+
+class fx_rates:
+    # Default settings (override it with FX_RATES_TTL, FX_FIXES in app.config)
+    ttl = 60 * 60
+    # currencyid: MOEX fix security on engines/currency/markets/index
+    fixes = {'usd': 'usdfix', 'eur': 'eurfix', 'cny': 'cnyfix'}
+    # Currencies which do not need conversion
+    rubles = ('rub', 'sur')
+
+    _lock = threading.Lock()
+    _cache = TTLCache(maxsize=64, ttl=ttl)
+
+    @staticmethod
+    def configure(ttl=None, fixes=None):
+        """
+        Change provider settings. Cached rates are dropped.
+        :param ttl: seconds to keep rate
+        :param fixes: dictionary {currencyid: fix secid} to add to default fixes
+        :return: None
+        """
+        with fx_rates._lock:
+            if ttl:
+                fx_rates.ttl = float(ttl)
+            if fixes:
+                fx_rates.fixes = dict(fx_rates.fixes, **{key.lower(): value for key, value in fixes.items()})
+            fx_rates._cache = TTLCache(maxsize=64, ttl=fx_rates.ttl)
+
+    @staticmethod
+    def get_rate(currency: str):
+        """
+        Get rate of currency to rubles.
+        :param currency: currencyid like 'usd', 'eur', 'sur'
+        :return: float (1.0 for rubles) or None if there is not fix for currency or errors
+        """
+        return fx_rates.get_rates([currency]).get(currency.lower())
+
+    @staticmethod
+    def get_rates(currencies):
+        """
+        Get rates of currencies to rubles. Not cached fixes are requested concurrently.
+        :param currencies: iterable of currencyid
+        :return: dictionary {currencyid: float}, currencies with errors are absent
+        """
+        rates = {}
+        missing = []
+        for currency in dict.fromkeys(currency.lower() for currency in currencies if currency):
+            if currency in fx_rates.rubles:
+                rates[currency] = 1.0
+                continue
+            with fx_rates._lock:
+                rate = fx_rates._cache.get(currency)
+            if rate is not None:
+                rates[currency] = rate
+            elif currency in fx_rates.fixes:
+                missing.append(currency)
+
+        for currency, rate in zip(missing, iss_client.map(fx_rates.request_rate, missing)):
+            if rate is not None:
+                with fx_rates._lock:
+                    fx_rates._cache[currency] = rate
+                rates[currency] = rate
+
+        return rates
+
+    @staticmethod
+    def request_rate(currency: str):
+        """
+        Get current fix of currency from MOEX API.
+        :param currency: currencyid from fx_rates.fixes
+        :return: float or None if errors
+        """
+        url = f"engines/currency/" \
+              f"markets/index/" \
+              f"securities/{fx_rates.fixes[currency]}.json" \
+              f"?iss.meta=off&" \
+              f"iss.only=marketdata&" \
+              f"marketdata.columns=CURRENTVALUE"
+
+        try:
+            response = iss_client.get(url)
+            response.raise_for_status()
+            return float(response.json()["marketdata"]["data"][0][0])
+        except (requests.RequestException, KeyError, IndexError, TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def clear():
+        """
+        Drop all cached rates.
+        :return: None
+        """
+        with fx_rates._lock:
+            fx_rates._cache.clear()
@@ -0,0 +1,74 @@
+"""
+Single-worker locks of background loops.
+Every process which builds the app (multi-worker WSGI server) starts refresher and alert engine threads, but only the
+process holding lock file of the loop (next to database file) does the work - the others check the lock every interval
+and take over when holder process exits. Standalone workers (python -m moex_invest.refresher, moex_invest.alerts) take
+the same locks.
+"""
+
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Not POSIX system - advisory file locks are not available, every process is the only one
+    fcntl = None
+
+
+class worker_lock:
+    _lock = threading.Lock()
+    # {name: open lock file} - locks held by this process (they are released by OS at process exit)
+    _held = {}
+
+    @staticmethod
+    def path(database_name, name):
+        """
+        Get lock file name of loop.
+        :param database_name: database file name
+        :param name: name of loop
+        :return: str
+        """
+        return f"{database_name}.{name}.lock"
+
+    @staticmethod
+    def acquire(database_name, name):
+        """
+        Take lock of loop without waiting (lock is kept until process exit or release()).
+        :param database_name: database file name
+        :param name: name of loop
+        :return: True if this process holds the lock
+        """
+        if not database_name:
+            return False
+        with worker_lock._lock:
+            if name in worker_lock._held:
+                return True
+            if fcntl is None:
+                worker_lock._held[name] = None
+                return True
+
+            lock_file = open(worker_lock.path(database_name, name), 'a')
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            lock_file.truncate(0)
+            lock_file.write(f"{os.getpid()}\n")
+            lock_file.flush()
+            worker_lock._held[name] = lock_file
+            return True
+
+    @staticmethod
+    def release(name):
+        """
+        Release lock of loop held by this process.
+        :param name: name of loop
+        :return: None
+        """
+        with worker_lock._lock:
+            lock_file = worker_lock._held.pop(name, None)
+        if lock_file is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            lock_file.close()
@@ -0,0 +1,306 @@
+"""
+Alert emails dispatch.
+Alerts are coalesced to one digest per recipient and written to outbox table (in transaction of caller), then
+dispatch() sends pending messages concurrently through small pool of reusable SMTP connections with retry and
+backoff. Messages are claimed (status 'sending' with lease) in one write transaction before sending, so concurrent
+dispatchers (scheduler, alert engine, other app processes) never send the same message. Every sent message is marked
+in outbox at once; lease of crashed run expires and its messages are sent again, so they are not lost.
+mailer configured with config.py configure_services() from app.config (MAIL_HOST, MAIL_PORT... - local SMTP sink
+like aiosmtpd may be used for tests).
+"""
+
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os import environ
+import pytz
+import yagmail
+
+
+class mailer:
+    # Default settings (override it with MAIL_HOST, MAIL_PORT, MAIL_SSL, MAIL_STARTTLS, MAIL_SKIP_LOGIN,
+    # MAIL_SENDER, MAIL_POOL_SIZE, MAIL_RETRIES, MAIL_BACKOFF, MAIL_MAX_ATTEMPTS, MAIL_LEASE in app.config)
+    host = 'smtp.gmail.com'
+    port = None
+    ssl = True
+    starttls = None
+    # Do not login (local SMTP sink)
+    skip_login = False
+    # From address if there is not mail_login environment variable
+    sender = None
+    # Number of SMTP connections (and sending threads)
+    pool_size = 2
+    # Tries to send one message in one dispatch, seconds before first retry (doubled for every next retry)
+    retries = 3
+    backoff = 1.0
+    # Message is failed after so many tries in all dispatches
+    max_attempts = 6
+    # Seconds of claim of messages by dispatch - messages of dispatch which did not finish in time are sent again
+    lease = 10 * 60
+
+    _lock = threading.Lock()
+    # Idle SMTP connections
+    _pool = queue.LifoQueue()
+
+    @staticmethod
+    def configure(host=None, port=None, ssl=None, starttls=None, skip_login=None, sender=None, pool_size=None,
+                  retries=None, backoff=None, max_attempts=None, lease=None):
+        """
+        Change mailer settings. Idle connections are closed.
+        :param host: SMTP server
+        :param port: SMTP port
+        :param ssl: use SMTP over SSL
+        :param starttls: use STARTTLS
+        :param skip_login: do not login to SMTP server
+        :param sender: from address if there is not mail_login environment variable
+        :param pool_size: max number of SMTP connections
+        :param retries: tries to send message in one dispatch
+        :param backoff: seconds before first retry
+        :param max_attempts: tries to send message in all dispatches
+        :param lease: seconds of claim of messages by dispatch
+        :return: None
+        """
+        with mailer._lock:
+            if host:
+                mailer.host = host
+            if port:
+                mailer.port = int(port)
+            if ssl is not None:
+                mailer.ssl = bool(ssl)
+            if starttls is not None:
+                mailer.starttls = starttls
+            if skip_login is not None:
+                mailer.skip_login = bool(skip_login)
+            if sender:
+                mailer.sender = sender
+            if pool_size:
+                mailer.pool_size = int(pool_size)
+            if retries:
+                mailer.retries = int(retries)
+            if backoff is not None:
+                mailer.backoff = float(backoff)
+            if max_attempts:
+                mailer.max_attempts = int(max_attempts)
+            if lease:
+                mailer.lease = float(lease)
+        mailer.close()
+
+    @staticmethod
+    def alert_text(row):
+        """
+        Make text of one alert.
+        :param row: dictionary {ticker, course ('minimal_limit' or 'maximum_limit'), min_border, max_border, price,
+        date_time}
+        :return: str
+        """
+        date_time = row.get('date_time')
+        when = f"{date_time.date().strftime('%d.%m.%y')} в {date_time.time().strftime('%H:%M:%S')} " \
+            if isinstance(date_time, datetime) else ''
+        if row.get('course') == 'minimal_limit':
+            return f"{when}{row.get('ticker').upper()} стоит меньше нижней границы " \
+                   f"{row.get('min_border')}. Текущая стоимость {row.get('price')}."
+        return f"{when}{row.get('ticker').upper()} стоит больше верхней границы " \
+               f"{row.get('max_border')}. Текущая стоимость {row.get('price')}."
+
+    @staticmethod
+    def digest(mail_list):
+        """
+        Coalesce alerts to one message per recipient.
+        :param mail_list: list of alert dictionaries with email key
+        :return: list of (recipient, subject, body)
+        """
+        alerts = {}
+        for row in mail_list:
+            if row.get('email'):
+                alerts.setdefault(row['email'], []).append(row)
+
+        text_footer = f"\n Это сообщение создано автоматически. Пожалуйста, не отвечайте на него. " \
+                      f"\n С уважением, Invest app Bot.  https://lastrole.pythonanywhere.com \n" \
+                      f"{datetime.now(tz=pytz.timezone('Europe/Moscow')).strftime('%d.%m.%y')}"
+
+        messages = []
+        for email, rows in alerts.items():
+            tickers = list(dict.fromkeys(row['ticker'].upper() for row in rows))
+            if len(tickers) == 1:
+                subject = f"Invest Bot {tickers[0]} out of border"
+            else:
+                subject = f"Invest Bot {len(tickers)} tickers out of border"
+            body = "Внимание!\n" + "\n".join(mailer.alert_text(row) for row in rows)
+            messages.append((email, subject, body + text_footer))
+        return messages
+
+    @staticmethod
+    def enqueue(database, mail_list):
+        """
+        Write digests of alerts to outbox table. Caller commits transaction.
+        :param database: sqlite3 connection
+        :param mail_list: list of alert dictionaries with email key
+        :return: number of messages
+        """
+        created_at = datetime.now(tz=pytz.timezone('Europe/Moscow')).isoformat()
+        messages = mailer.digest(mail_list)
+        database.executemany("INSERT INTO outbox (recipient, subject, body, created_at) "
+                             "VALUES (?, ?, ?, ?)",
+                             [message + (created_at,) for message in messages])
+        return len(messages)
+
+    @staticmethod
+    def connect():
+        """
+        Open SMTP connection with current settings (login and password from mail_login, mail_password
+        environment variables).
+        :return: yagmail.SMTP
+        """
+        return yagmail.SMTP(environ.get('mail_login') or mailer.sender, environ.get('mail_password'),
+                            host=mailer.host, port=mailer.port, smtp_ssl=mailer.ssl, smtp_starttls=mailer.starttls,
+                            smtp_skip_login=mailer.skip_login)
+
+    @staticmethod
+    def close():
+        """
+        Close idle SMTP connections.
+        :return: None
+        """
+        while True:
+            try:
+                connection = mailer._pool.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def send(recipient, subject, body):
+        """
+        Send one message with connection from pool, retry with backoff (broken connection is replaced).
+        :param recipient: email
+        :param subject: subject
+        :param body: text
+        :return: (None if success, else error text; number of tries)
+        """
+        error = None
+        for attempt in range(mailer.retries):
+            if attempt:
+                time.sleep(mailer.backoff * 2 ** (attempt - 1))
+            try:
+                connection = mailer._pool.get_nowait()
+            except queue.Empty:
+                connection = None
+            try:
+                if connection is None:
+                    connection = mailer.connect()
+                connection.send(to=recipient, subject=subject, contents=body)
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+                continue
+            mailer._pool.put(connection)
+            return None, attempt + 1
+        return error, mailer.retries
+
+    @staticmethod
+    def claim(database_name, limit):
+        """
+        Claim pending messages of outbox for one dispatch (messages with expired lease are pending again).
+        :param database_name: database file name
+        :param limit: max number of messages
+        :return: tuple (lease token, list of (id, recipient, subject, body, attempts))
+        """
+        token = secrets.token_hex(8)
+        now = time.time()
+
+        database = sqlite3.connect(database_name, timeout=30, isolation_level=None)
+        try:
+            # --------------------------TRANSACTION ----------------------------
+            # Write lock is taken at once - other dispatchers wait and see claimed messages as not pending
+            database.execute("BEGIN IMMEDIATE")
+            try:
+                database.execute("UPDATE outbox "
+                                 "SET status = 'pending', lease = NULL, lease_until = NULL "
+                                 "WHERE status = 'sending' AND lease_until < ?",
+                                 (now,))
+                ids = [row[0] for row in database.execute("SELECT id "
+                                                          "FROM outbox "
+                                                          "WHERE status = 'pending' "
+                                                          "ORDER BY id "
+                                                          "LIMIT ?",
+                                                          (limit,)).fetchall()]
+                database.executemany("UPDATE outbox "
+                                     "SET status = 'sending', lease = ?, lease_until = ? "
+                                     "WHERE id = ?",
+                                     [(token, now + mailer.lease, message_id) for message_id in ids])
+                messages = database.execute("SELECT id, recipient, subject, body, attempts "
+                                            "FROM outbox "
+                                            "WHERE lease = ? "
+                                            "ORDER BY id",
+                                            (token,)).fetchall()
+                database.execute("commit")
+            except sqlite3.Error:
+                database.execute("rollback")
+                raise
+            # -------------------------END TRANSACTION ---------------------------
+        finally:
+            database.close()
+        return token, messages
+
+    @staticmethod
+    def deliver(database_name, token, message):
+        """
+        Send claimed message of outbox and write result to outbox (own connection - called in thread).
+        Result is not written if lease was expired and message was claimed by other dispatch.
+        :param database_name: database file name
+        :param token: lease token of claim()
+        :param message: (id, recipient, subject, body, attempts)
+        :return: True if message is sent
+        """
+        message_id, recipient, subject, body, attempts = message
+        error, tries = mailer.send(recipient, subject, body)
+
+        database = sqlite3.connect(database_name, timeout=30)
+        try:
+            with database:
+                if error is None:
+                    database.execute("UPDATE outbox "
+                                     "SET status = 'sent', attempts = attempts + ?, sent_at = ?, last_error = NULL, "
+                                     "lease = NULL, lease_until = NULL "
+                                     "WHERE id = ? AND lease = ?",
+                                     (tries, datetime.now(tz=pytz.timezone('Europe/Moscow')).isoformat(), message_id,
+                                      token))
+                else:
+                    status = 'failed' if attempts + tries >= mailer.max_attempts else 'pending'
+                    database.execute("UPDATE outbox "
+                                     "SET status = ?, attempts = attempts + ?, last_error = ?, "
+                                     "lease = NULL, lease_until = NULL "
+                                     "WHERE id = ? AND lease = ?",
+                                     (status, tries, error, message_id, token))
+        finally:
+            database.close()
+        return error is None
+
+    @staticmethod
+    def dispatch(database_name, limit=1000):
+        """
+        Claim pending messages of outbox and send them concurrently (pool_size connections).
+        :param database_name: database file name
+        :param limit: max number of messages for one dispatch
+        :return: dictionary {'sent': int, 'failed': int}
+        """
+        token, messages = mailer.claim(database_name, limit)
+
+        if not messages:
+            return {'sent': 0, 'failed': 0}
+
+        with ThreadPoolExecutor(max_workers=mailer.pool_size, thread_name_prefix='mailer') as executor:
+            results = list(executor.map(lambda message: mailer.deliver(database_name, token, message), messages))
+
+        return {'sent': results.count(True), 'failed': results.count(False)}
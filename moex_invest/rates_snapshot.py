@@ -0,0 +1,218 @@
+"""
+Materialized rates table for public users.
+rates_snapshot table is rebuilt by refresher.py periodically and updated for one user after every trade,
+so sandbox.py rates() only reads top 10 with indexed queries. Trades update row with stored prices (no MOEX API
+requests in request), row with tickers without price is marked stale and recalculated with MOEX API prices in
+background thread.
+"""
+
+import sqlite3
+import threading
+from datetime import datetime
+import pytz
+from moex_invest.helpers import helpers_functions
+
+# Columns of rates_snapshot which rates page is sorted by (every one has index)
+RATE_COLUMNS = ('total_cash', 'diversity', 'purchase_value', 'purchase_number')
+
+# Users with background recalculation (see update_user())
+_pending_lock = threading.Lock()
+_pending = set()
+
+
+def ticker_prices(tickers, stored_only=False):
+    """
+    Get current price of one unit in rubles for tickers (bid, or prevadmittedquote if there is not bid).
+    :param tickers: list of tickers
+    :param stored_only: take prices only from quote cache and quotes table (helpers.lookup_stored()), do not ask
+    MOEX API
+    :return: dictionary {ticker: price}, tickers with errors are absent
+    """
+    prices = {}
+    if stored_only:
+        quotes = helpers_functions.lookup_stored(list(tickers))
+    else:
+        quotes = helpers_functions.lookup_many(list(tickers), max_age=helpers_functions.quote_max_age)
+    for ticker, (errors, results) in quotes.items():
+        if not results or not results.get('lotsize'):
+            helpers_functions.app_log_add(f"Error. rates_snapshot.py ticker_prices(): Can not get lotsize, "
+                                          f"bid or prevadmittedquote from helpers.lookup for ticker {ticker}.")
+            continue
+        if results.get('bid'):
+            price = helpers_functions.check_final_price('bid', 1, results)
+        elif results.get('prevadmittedquote'):
+            price = helpers_functions.check_final_price('prevadmittedquote', 1, results)
+        else:
+            price = None
+        if price is None:
+            helpers_functions.app_log_add(f"Error. rates_snapshot.py ticker_prices(): "
+                                          f"Can not get price for ticker {ticker}.")
+            continue
+        prices[ticker] = price / results['lotsize']
+    return prices
+
+
+def rebuild(database, user_ids=None, prices=None, stored_only=False):
+    """
+    Recalculate rates_snapshot rows for public users with one grouped query over auth, broker, depo and log.
+    Tickers without price are not counted in total_cash and row is marked stale.
+    :param database: sqlite3 connection with row_factory sqlite3.Row
+    :param user_ids: list of user_id to recalculate, None - recalculate all users
+    :param prices: dictionary {ticker: price of one unit}, None - get current prices with ticker_prices()
+    :param stored_only: get prices without MOEX API requests (see ticker_prices())
+    :return: tuple (number of written rows, number of stale rows), None if errors (snapshot is not changed)
+    """
+
+    # Restrict every part of query to user_ids
+    if user_ids is None:
+        users_filter = ''
+        depo_filter = ''
+        log_filter = ''
+        params = []
+    else:
+        user_ids = list(user_ids)
+        placeholders = ','.join('?' * len(user_ids))
+        users_filter = f"AND auth.user_id IN ({placeholders}) "
+        depo_filter = f"WHERE depo.user_id IN ({placeholders}) "
+        log_filter = f"WHERE log.user_id IN ({placeholders}) "
+        params = user_ids
+
+    # 1. Get current price for every distinct ticker of public users
+    if prices is None:
+        tickers = [row['ticker'] for row in database.execute(f"SELECT DISTINCT depo.ticker "
+                                                             f"FROM depo "
+                                                             f"JOIN auth ON depo.user_id = auth.user_id "
+                                                             f"WHERE auth.account_type = 'public' "
+                                                             f"{users_filter}",
+                                                             params).fetchall()]
+        prices = ticker_prices(tickers, stored_only)
+
+    updated_at = datetime.now(tz=pytz.timezone('Europe/Moscow')).isoformat()
+
+    # --------------------------TRANSACTION ----------------------------
+    isolation_level = database.isolation_level
+    database.isolation_level = None
+    database.execute("begin")
+    try:
+        # 2. Put prices to temporary table to join them with depo
+        database.execute("CREATE TEMP TABLE IF NOT EXISTS ticker_price ("
+                         "ticker TEXT PRIMARY KEY, "
+                         "price REAL NOT NULL)")
+        database.execute("DELETE FROM temp.ticker_price")
+        database.executemany("INSERT INTO temp.ticker_price (ticker, price) VALUES (?, ?)", prices.items())
+
+        # 3. Users may be deleted or not public - remove their old rows
+        if user_ids is None:
+            database.execute("DELETE FROM rates_snapshot")
+        else:
+            database.execute(f"DELETE FROM rates_snapshot WHERE user_id IN ({placeholders})", user_ids)
+
+        # 4. Total cash, diversity, number and volume of purchases per user
+        cursor = database.execute(f"INSERT INTO rates_snapshot (user_id, username, total_cash, diversity, "
+                                  f"purchase_number, purchase_value, stale, updated_at) "
+                                  f"SELECT auth.user_id, auth.username, "
+                                  f"COALESCE(depo_sum.value, 0) + broker.account, "
+                                  f"COALESCE(depo_sum.diversity, 0), "
+                                  f"COALESCE(log_sum.purchase_number, 0), "
+                                  f"COALESCE(log_sum.purchase_value, 0), "
+                                  f"COALESCE(depo_sum.missing, 0) > 0, "
+                                  f"? "
+                                  f"FROM auth "
+                                  f"JOIN broker ON broker.user_id = auth.user_id "
+                                  f"LEFT JOIN (SELECT depo.user_id, COUNT(*) AS diversity, "
+                                  f"TOTAL(depo.number * ticker_price.price) AS value, "
+                                  f"TOTAL(ticker_price.price IS NULL) AS missing "
+                                  f"FROM depo "
+                                  f"LEFT JOIN temp.ticker_price ON ticker_price.ticker = depo.ticker "
+                                  f"{depo_filter}"
+                                  f"GROUP BY depo.user_id) AS depo_sum ON depo_sum.user_id = auth.user_id "
+                                  f"LEFT JOIN (SELECT log.user_id, COUNT(*) AS purchase_number, "
+                                  f"TOTAL(log.price_total) AS purchase_value "
+                                  f"FROM log "
+                                  f"{log_filter}"
+                                  f"GROUP BY log.user_id) AS log_sum ON log_sum.user_id = auth.user_id "
+                                  f"WHERE auth.account_type = 'public' "
+                                  f"{users_filter}",
+                                  [updated_at] + params * (3 if user_ids is not None else 0))
+        written = cursor.rowcount
+        stale = database.execute(f"SELECT COUNT(*) "
+                                 f"FROM rates_snapshot "
+                                 f"JOIN auth ON auth.user_id = rates_snapshot.user_id "
+                                 f"WHERE rates_snapshot.stale "
+                                 f"{users_filter}",
+                                 params).fetchone()[0]
+        database.execute("commit")
+
+    except database.Error as e:
+        database.execute("rollback")
+        helpers_functions.app_log_add(f"Error. rates_snapshot.py rebuild(): SQL error in transaction {e}.")
+        return None
+
+    finally:
+        database.isolation_level = isolation_level
+    # -------------------------END TRANSACTION ---------------------------
+
+    return written, stale
+
+
+def update_user(database, user_id):
+    """
+    Recalculate rates_snapshot row of one user (after trade or settings change) with stored prices - request does
+    not wait for MOEX API. If some prices are not stored, row is marked stale and recalculated with MOEX API prices
+    in background thread.
+    :param database: sqlite3 connection with row_factory sqlite3.Row
+    :param user_id: user_id
+    :return: None
+    """
+    result = rebuild(database, [user_id], stored_only=True)
+    if result is None:
+        helpers_functions.app_log_add(f"Error. rates_snapshot.py update_user(): "
+                                      f"Can not update rates for user_id={user_id}.")
+    elif result[1]:
+        rebuild_later(user_id)
+
+
+def rebuild_later(user_id):
+    """
+    Recalculate rates_snapshot row of user with MOEX API prices in background thread (one thread per user).
+    :param user_id: user_id
+    :return: None
+    """
+    with _pending_lock:
+        if user_id in _pending:
+            return
+        _pending.add(user_id)
+
+    def run():
+        database = sqlite3.connect(helpers_functions.database_name, timeout=30)
+        database.row_factory = sqlite3.Row
+        try:
+            result = rebuild(database, [user_id])
+            if result is None or result[1]:
+                helpers_functions.app_log_add(f"Error. rates_snapshot.py rebuild_later(): "
+                                              f"Can not get all prices for rates of user_id={user_id}, "
+                                              f"row is stale.")
+        except Exception as e:
+            helpers_functions.app_log_add(f"Error. rates_snapshot.py rebuild_later(): {e}.")
+        finally:
+            database.close()
+            with _pending_lock:
+                _pending.discard(user_id)
+
+    threading.Thread(target=run, name='rates_snapshot', daemon=True).start()
+
+
+def get_top(database, column, limit=10):
+    """
+    Get top users from rates_snapshot.
+    :param database: sqlite3 connection with row_factory sqlite3.Row
+    :param column: one of RATE_COLUMNS
+    :param limit: number of rows
+    :return: list of sqlite3.Row (username, value of column, stale)
+    """
+    assert column in RATE_COLUMNS
+    return database.execute(f"SELECT username, {column}, stale "
+                            f"FROM rates_snapshot "
+                            f"ORDER BY {column} DESC "
+                            f"LIMIT ?",
+                            (limit,)).fetchall()
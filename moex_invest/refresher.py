@@ -0,0 +1,180 @@
+"""
+Background market data refresher.
+Periodically get current prices for all tickers from depo table and write them to quotes table (and rebuild
+rates_snapshot), so depo, rates and sell views do not wait for MOEX API.
+Started at __init__.py create_app() if QUOTE_REFRESH_INTERVAL is set, or run it as standalone worker from root folder:
+python -m moex_invest.refresher
+"""
+
+import asyncio
+import sqlite3
+import threading
+from moex_invest.helpers import helpers_functions
+from moex_invest.locks import worker_lock
+from moex_invest.iss import async_iss_client
+from moex_invest import rates_snapshot
+from moex_invest.config import load_config, configure_services
+
+
+class quotes_refresher:
+    # Seconds between refreshes (override it with QUOTE_REFRESH_INTERVAL in app.config)
+    interval = 60
+
+    _thread = None
+    # concurrent.futures.Future of run_async() task (ISS_ASYNC)
+    _task = None
+    _stop = threading.Event()
+
+    @staticmethod
+    def refresh():
+        """
+        Get prices for every distinct ticker of depo table (batch request) and write them to quotes table.
+        :return: number of refreshed tickers or None if errors
+        """
+        tickers = quotes_refresher.tickers()
+        if not tickers:
+            return None if tickers is None else 0
+        return quotes_refresher.save(helpers_functions.lookup_many(tickers))
+
+    @staticmethod
+    async def refresh_async():
+        """
+        Coroutine of refresh() for event loop of asyncio client: prices are requested natively by the loop, database
+        work is done in threads.
+        :return: number of refreshed tickers or None if errors
+        """
+        tickers = await asyncio.to_thread(quotes_refresher.tickers)
+        if not tickers:
+            return None if tickers is None else 0
+        answers = await helpers_functions.lookup_many_async(tickers)
+        return await asyncio.to_thread(quotes_refresher.save, answers)
+
+    @staticmethod
+    def tickers():
+        """
+        Get every distinct ticker of depo table.
+        :return: list of tickers or None if errors
+        """
+
+        db_name = helpers_functions.database_name
+        if not db_name:
+            print("Error. refresher.py tickers(): Can not get database name from class helper_functions")
+            return None
+
+        database = sqlite3.connect(db_name)
+        try:
+            return [row[0] for row in database.execute("SELECT DISTINCT ticker FROM depo").fetchall()]
+        except database.Error as e:
+            helpers_functions.app_log_add(f"Error. refresher.py tickers(): sqlite3 {e}.")
+            return None
+        finally:
+            database.close()
+
+    @staticmethod
+    def save(answers):
+        """
+        Write prices of lookup to quotes table and rebuild rates of public users with fresh prices.
+        :param answers: dictionary from helpers.lookup_many()
+        :return: number of refreshed tickers
+        """
+        refreshed = helpers_functions.quotes_save([results for errors, results in answers.values() if results])
+
+        database = sqlite3.connect(helpers_functions.database_name)
+        database.row_factory = sqlite3.Row
+        try:
+            if rates_snapshot.rebuild(database) is None:
+                helpers_functions.app_log_add("Error. refresher.py save(): Can not rebuild rates snapshot.")
+        except database.Error as e:
+            helpers_functions.app_log_add(f"Error. refresher.py save(): sqlite3 {e}.")
+        finally:
+            database.close()
+
+        return refreshed
+
+    @staticmethod
+    def run():
+        """
+        Refresh quotes every interval seconds until stop() (only in process holding 'refresher' worker lock).
+        :return: None
+        """
+        while not quotes_refresher._stop.is_set():
+            # Only one process of multi-worker server does the work, the others wait to take it over
+            if not worker_lock.acquire(helpers_functions.database_name, 'refresher'):
+                quotes_refresher._stop.wait(quotes_refresher.interval)
+                continue
+            try:
+                quotes_refresher.refresh()
+            except Exception as e:
+                # Refresher must survive any error and try again on next interval
+                helpers_functions.app_log_add(f"Error. refresher.py run(): {e}.")
+            quotes_refresher._stop.wait(quotes_refresher.interval)
+
+    @staticmethod
+    async def run_async():
+        """
+        Refresh quotes every interval seconds until stop() as task of event loop of asyncio client (ISS_ASYNC), only in
+        process holding 'refresher' worker lock.
+        :return: None
+        """
+        while not quotes_refresher._stop.is_set():
+            if worker_lock.acquire(helpers_functions.database_name, 'refresher'):
+                try:
+                    await quotes_refresher.refresh_async()
+                except Exception as e:
+                    # Task must survive any error and try again on next interval
+                    helpers_functions.app_log_add(f"Error. refresher.py run_async(): {e}.")
+            await asyncio.sleep(quotes_refresher.interval)
+
+    @staticmethod
+    def start(interval=None):
+        """
+        Start refresher in daemon thread, or as task of event loop of asyncio client if ISS_ASYNC is set (only one
+        per process).
+        :param interval: seconds between refreshes
+        :return: None
+        """
+        if interval:
+            quotes_refresher.interval = float(interval)
+
+        if quotes_refresher._thread and quotes_refresher._thread.is_alive():
+            return
+        if quotes_refresher._task and not quotes_refresher._task.done():
+            return
+
+        quotes_refresher._stop.clear()
+
+        # Task of event loop of asyncio client - no own thread
+        if helpers_functions.iss_async:
+            quotes_refresher._task = asyncio.run_coroutine_threadsafe(quotes_refresher.run_async(), async_iss_client.loop())
+            return
+
+        quotes_refresher._thread = threading.Thread(target=quotes_refresher.run, name='quotes_refresher',
+                                                    daemon=True)
+        quotes_refresher._thread.start()
+
+    @staticmethod
+    def stop():
+        """
+        Stop refresher thread or task.
+        :return: None
+        """
+        quotes_refresher._stop.set()
+        if quotes_refresher._task:
+            quotes_refresher._task.cancel()
+            quotes_refresher._task = None
+        if quotes_refresher._thread:
+            quotes_refresher._thread.join()
+            quotes_refresher._thread = None
+        worker_lock.release('refresher')
+
+
+if __name__ == "__main__":
+    # Standalone worker - take settings from the same file as create_app()
+    config = load_config()
+    configure_services(config)
+    if config.get("QUOTE_REFRESH_INTERVAL"):
+        quotes_refresher.interval = float(config.get("QUOTE_REFRESH_INTERVAL"))
+    if helpers_functions.iss_async:
+        async_iss_client.run(quotes_refresher.run_async(), timeout=None)
+    else:
+        quotes_refresher.run()
@@ -2,13 +2,17 @@
 Trader emulation blueprint
 """
 
-from flask import Blueprint, flash, g, redirect, render_template, request, session, url_for, jsonify
+from flask import Blueprint, flash, g, redirect, render_template, request, session, url_for, jsonify, current_app, \
+    Response, stream_with_context
 from moex_invest.auth import login_required
 from moex_invest.db import get_db
 from moex_invest.helpers import helpers_functions
+from moex_invest import rates_snapshot, trade, export
+from moex_invest.search import ticker_index, listing_search
+from moex_invest.iss import quote_cache, async_iss_client
+from moex_invest.api import api_tokens
 from werkzeug.security import check_password_hash, generate_password_hash
-from datetime import datetime
-import pytz
+import asyncio
 import re
 
 bp = Blueprint('sandbox', __name__, url_prefix="/sandbox")
@@ -25,18 +29,14 @@ def quote():
     if request.method == "GET":
         # Realize AJAX for input ticker tag
         if 'q' in request.args:
-            error_messages = helpers_functions.check_ticker_text_fail(request.args.get("q"))
+            error_messages = helpers_functions.check_search_text_fail(request.args.get("q"))
             if not error_messages:
-                database = get_db()
-                rows = database.execute("SELECT secid, secname "
-                                        "FROM listing WHERE secid LIKE ? "
-                                        "OR secid LIKE ? "
-                                        "LIMIT 10",
-                                        (f"%{request.args.get('q')}%".upper(),
-                                         f"%{request.args.get('q')}%".lower())).fetchall()
-                resp = jsonify([(row["secid"] + ' ' + row["secname"]) for row in rows])
-                database.close()
-                return resp
+                # Search ticker or company name in memory index or in FTS5 index of listing table
+                if current_app.config.get("SEARCH_BACKEND") == 'fts':
+                    rows = listing_search.search(get_db(readonly=True), request.args.get("q"), limit=10)
+                else:
+                    rows = ticker_index.search(request.args.get("q"), limit=10)
+                return jsonify([(secid + ' ' + secname) for secid, secname in rows])
             else:
                 return jsonify([])
         else:
@@ -85,92 +85,24 @@ def quote():
         final_price = helpers_functions.check_final_price('offer', number, results)
         lotsize = results["lotsize"]
 
-        # 5. Check broker account
+        # 5. Make trade (cash is checked in transaction - concurrent requests can not spend it twice)
 
         database = get_db()
-        user_account = \
-            database.execute("SELECT account FROM broker WHERE user_id = ?", (g.user['user_id'],)).fetchone()[0]
-
-        if not user_account:
-            helpers_functions.app_log_add(f"Error. sandbox.py quote(): user_id ({g.user['user_id']}) "
-                                          f"account from broker table from "
-                                          f"database is empty.")
-            flash("Извините, что-то не так с вашим счетом. Повторите попытку и при неудаче обратитесь к "
-                  "администратору сайта")
-            return redirect("/sandbox/quote")
-
-        # If user can not afford this
-        if float(user_account) < final_price:
-            flash(f"Извините, похоже на вашем счету не хватает средств для покупки "
-                  f"{lotsize} {symbol} по рыночной цене {results['offer']}. "
-                  f"Необходимо {helpers_functions.finance_format(final_price)}, "
-                  f"у вас в наличии {helpers_functions.finance_format(user_account)}.")
+        errors, user_account = trade.buy(database, g.user['user_id'], results, int(number) * int(lotsize), final_price)
+        if errors:
+            flash(','.join(errors))
             return redirect("/sandbox/quote")
 
-        # 6. Make transaction to DB
+        helpers_functions.app_log_add(f"Success. sandbox.py quote(): Userid {g.user['user_id']} make purchase.")
 
-        # Check if this user already has this type of stock (ticket variable)
-        database = get_db()
-        user_ticker_count = database.execute("SELECT COUNT(*) "
-                                             "FROM depo "
-                                             "WHERE user_id = ? AND ticker = ?",
-                                             (g.user['user_id'], results['secid'])).fetchone()[0]
-
-        database.isolation_level = None  # ON autocommit mode. Hand control of transaction-to group rollback
-
-        # -------------------------------TRANSACTION----------------------------
-        database.execute("begin")
-        try:
-
-            # 1 Add stock to depo table
-
-            if user_ticker_count > 0:
-                # If there are more than 1 row for user ticker - raise error
-                assert user_ticker_count == 1, "Error with number of users rows in depo table in database"
-                # User has this type of stock - increase share column
-                database.execute("UPDATE depo SET number = number + ? "
-                                 "WHERE user_id = ? "
-                                 "AND ticker = ?",
-                                 (int(number) * int(lotsize), g.user['user_id'], results['secid']))
-            else:
-                # User does not have this type of stock - add new row to depo table
-                database.execute("INSERT INTO depo (user_id, ticker, lotsize, name, isqualifiedinvestors, "
-                                 "initialfacevalue, number, currency, market, email_sent) "
-                                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                                 (g.user['user_id'], results["secid"], lotsize, results['name'],
-                                  results['isqualifiedinvestors'],
-                                  results.get('initialfacevalue'), int(number) * int(lotsize), results["currencyid"],
-                                  results['market'], False))
-
-            # 2 Decrease cash from users table
-            database.execute("UPDATE broker "
-                             "SET account = account - ?"
-                             "WHERE user_id = ?",
-                             (final_price, g.user['user_id']))
-
-            # 3 Add this purchase to log table
-            database.execute("INSERT "
-                             "INTO log (user_id, ticker, operation, price, price_total, number, date_time)"
-                             "VALUES (?,?,?,?,?,?,?)",
-                             (g.user['user_id'], results['secid'], 'buy', results['offer'], final_price,
-                              int(number) * int(lotsize), datetime.now(tz=pytz.timezone('Europe/Moscow')).isoformat()))
-
-            # 4 Commit transaction changes
-            database.execute("commit")
-            helpers_functions.app_log_add(f"Success. sandbox.py quote(): Userid {g.user['user_id']} make purchase.")
-
-        except database.Error as e:
-            database.execute("rollback")
-            database.close()
-            helpers_functions.app_log_add(f"Error. sandbox.py quote(): sqlite3 in TRANSACTION: {e}")
-
-        # -----------------------END TRANSACTION ----------------------
+        # Update user row of rates
+        rates_snapshot.update_user(database, g.user['user_id'])
 
         flash(f"Вы успешно приобрели {int(number) * int(lotsize)} единиц(у) {results['secid']} "
               f"по цене {results['offer']} на общую сумму "
               f"{helpers_functions.finance_format(final_price)} \u20bd. "
               f"Остаток на брокерском счете "
-              f"{helpers_functions.finance_format((user_account - final_price))} \u20bd.")
+              f"{helpers_functions.finance_format(user_account)} \u20bd.")
 
         return redirect("/sandbox/depo")
 
@@ -178,6 +110,173 @@ def quote():
         helpers_functions.app_log_add(f"Error. sandbox.py quote(): error with request methos qoute().")
 
 
+@bp.route("/api/quote/<ticker>")
+@login_required
+def api_quote(ticker):
+    """
+    Quote of ticker for quote and sell pages (quote_symbols_ajax.js, sell.js) from server-side quote cache - browsers
+    do not ask MOEX API, one shared request per ticker instead.
+    :param ticker: ticker
+    :return: JSON {secid, description [[name, title, value], ...], board {boardid, title, engine, market, currencyid},
+    LOTSIZE, PREVADMITTEDQUOTE, BID, OFFER, SPREAD, VOLTODAY} with ETag (304 if it is not changed) or
+    JSON {errors} with 404 status
+    """
+
+    # 1. Check ticker
+    error_messages = helpers_functions.check_ticker_text_fail(ticker)
+    if error_messages:
+        return jsonify(errors=[error_messages]), 404
+    ticker = ticker.lower()
+
+    # 2. Market prices and primary board (quote cache or MOEX API), titles of description (description cache)
+    errors, results = helpers_functions.lookup(ticker)
+    if not results:
+        return jsonify(errors=errors or []), 404
+    errors, details = helpers_functions.get_details(ticker)
+    if not details:
+        return jsonify(errors=errors or []), 404
+
+    # 3. Cached by browser for market cache time, then revalidated with ETag
+    response = jsonify(secid=results['secid'].upper(),
+                       description=details['description'],
+                       board={'boardid': results.get('boardid'),
+                              'title': details['board_title'],
+                              'engine': results.get('engine'),
+                              'market': results.get('market'),
+                              'currencyid': (results.get('currencyid') or '').upper()},
+                       LOTSIZE=results.get('lotsize'),
+                       PREVADMITTEDQUOTE=results.get('prevadmittedquote'),
+                       BID=results.get('bid'),
+                       OFFER=results.get('offer'),
+                       SPREAD=results.get('spread'),
+                       VOLTODAY=results.get('voltoday'))
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.max_age = int(quote_cache.market_ttl)
+    return response.make_conditional(request)
+
+
+@bp.route("/api/quotes")
+@login_required
+async def api_quotes():
+    """
+    Market prices of several tickers (tickers query parameter - comma separated). Async view: descriptions and
+    market prices are requested concurrently by asyncio client (helpers.lookup_many_async()), request does not hold
+    worker thread for sequential MOEX API requests.
+    :return: JSON {ticker: {secid, LOTSIZE, PREVADMITTEDQUOTE, BID, OFFER, SPREAD, VOLTODAY, currencyid, errors}} or
+    JSON {errors} with 400 status
+    """
+
+    # 1. Check tickers
+    tickers = [ticker.strip().lower() for ticker in request.args.get('tickers', '').split(',') if ticker.strip()]
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        return jsonify(errors=['tickers parameter is required (comma separated tickers).']), 400
+    max_tickers = current_app.config.get("API_MAX_TICKERS") or 100
+    if len(tickers) > max_tickers:
+        return jsonify(errors=[f"Too many tickers (max {max_tickers})."]), 400
+    for ticker in tickers:
+        error_messages = helpers_functions.check_ticker_text_fail(ticker)
+        if error_messages:
+            return jsonify(errors=[error_messages]), 400
+
+    # 2. One lookup in event loop of asyncio client (slow MOEX API gives errors for tickers, not 500)
+    try:
+        answers = await async_iss_client.call(helpers_functions.lookup_many_async(
+            tickers, max_age=helpers_functions.quote_max_age))
+    except asyncio.TimeoutError:
+        helpers_functions.app_log_add(f"Error. sandbox.py api_quotes(): MOEX API did not answer in "
+                                      f"{async_iss_client.facade_timeout} s for {len(tickers)} tickers.")
+        answers = {ticker: ([f'Извините, похоже не получается получить информацию о {ticker} от московской биржи. '
+                             'Повторите попытку позднее.'], None) for ticker in tickers}
+
+    # 3. Cached by browser for market cache time, then revalidated with ETag
+    quotes = {}
+    for ticker in tickers:
+        errors, results = answers[ticker]
+        results = results or {}
+        quotes[ticker] = {'secid': (results.get('secid') or ticker).upper(),
+                          'LOTSIZE': results.get('lotsize'),
+                          'PREVADMITTEDQUOTE': results.get('prevadmittedquote'),
+                          'BID': results.get('bid'),
+                          'OFFER': results.get('offer'),
+                          'SPREAD': results.get('spread'),
+                          'VOLTODAY': results.get('voltoday'),
+                          'currencyid': (results.get('currencyid') or '').upper() or None,
+                          'errors': errors or []}
+    response = jsonify(quotes)
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.max_age = int(quote_cache.market_ttl)
+    return response.make_conditional(request)
+
+
+def depo_prices(number, results):
+    """
+    Get current price and value of depo position.
+    :param number: number of securities in depo
+    :param results: dictionary from helpers.lookup()[1]
+    :return: tuple (current price (bid, if there is no bid - admitted price of prev day), value in rubles or None)
+    """
+    # Current price is BID if it exists. If not - current price is admitted price (market course prev day)
+    price = 'bid' if results['bid'] else 'prevadmittedquote'
+    if not results['lotsize']:
+        helpers_functions.app_log_add(f"Error. sandbox.py depo_prices(): "
+                                      f"results['lotsize'] for ticker {results['secid']} is empty.")
+        return results[price], None
+
+    # Final price as MOEX price * number of shares from depo table
+    final_price = helpers_functions.check_final_price(price, number, results)
+    if final_price is None:
+        return results[price], None
+    return results[price], final_price / results['lotsize']
+
+
+@bp.route("/api/depo/prices")
+@login_required
+def api_depo_prices():
+    """
+    Prices of user depo for depo page (depo.js). All tickers are priced with one batched lookup (quote cache, quotes
+    table, grouped MOEX API requests); ticker without price gets error and is not counted in total.
+    :return: JSON {tickers: {ticker: {current_price, final_price, error}}, cash, total, complete}
+    """
+
+    # 1. Get users tickers and cash
+    database = get_db(readonly=True)
+    rows = database.execute("SELECT ticker, number "
+                            "FROM depo "
+                            "WHERE user_id = ?", (g.user['user_id'],)).fetchall()
+    cash = database.execute("SELECT account FROM broker WHERE user_id = ?", (g.user['user_id'],)).fetchone()[0]
+
+    # 2. Get actual info from moex api (or from fresh quotes table) for all tickers (batch request)
+    quotes = helpers_functions.lookup_many([row['ticker'] for row in rows], max_age=helpers_functions.quote_max_age)
+
+    # 3. Price every position
+    total = float(cash)
+    complete = True
+    tickers = {}
+    for row in rows:
+        errors, results = quotes[row['ticker']]
+        item = {'current_price': None, 'final_price': None, 'error': None}
+        if results:
+            item['current_price'], item['final_price'] = depo_prices(row['number'], results)
+        if item['final_price'] is None:
+            helpers_functions.app_log_add(f"Error. sandbox.py api_depo_prices(): "
+                                          f"Can not get result from MOEX API ticker {row['ticker']}.")
+            item['error'] = ' '.join(errors) if errors else 'Нет данных о цене.'
+            complete = False
+        else:
+            total += item['final_price']
+        tickers[row['ticker']] = item
+
+    # 4. Cached by browser for market cache time, then revalidated with ETag
+    response = jsonify(tickers=tickers, cash=cash, total=total, complete=complete)
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.max_age = int(quote_cache.market_ttl)
+    return response.make_conditional(request)
+
+
 @bp.route("/depo", methods=("POST", "GET"))
 @login_required
 def depo():
@@ -189,75 +288,25 @@ def depo():
     # If request GET - show html
     if request.method == "GET":
 
-        # 1. Get users tickers
-        total = 0
-        tickers = []
+        # 1. Get users tickers from depo table only - prices are filled in by browser from /sandbox/api/depo/prices
+        # (see depo.js), so page is not waiting for MOEX API
         market_translate = {'shares': "акции", "foreignshares": "иностранные акции", "bonds": "облигации"}
-        database = get_db()
+        database = get_db(readonly=True)
         rows = database.execute(
-            "SELECT ticker, name, initialfacevalue, number, market, min_border, max_border, notification "
+            "SELECT ticker, name, number, currency, market, min_border, max_border, notification "
             "FROM depo "
             "WHERE user_id = ?", (g.user['user_id'],)).fetchall()
-        for row in rows:
-            item = {'ticker': row['ticker'], 'name': row['name'], 'number': row['number'],
-                    'market': market_translate.get(row['market']), 'min_border': row['min_border'],
-                    'max_border': row['max_border'], 'notification': row['notification']}
-            # Get info from depo table
-
-            # 2. For each ticker get actual info from moex api
-            api_response = helpers_functions.lookup(item['ticker'])
-
-            results = api_response[1]
-            errors = api_response[0]
-
-            # If there are errors
-            if not results:
-                helpers_functions.app_log_add(f"Error. sandbox.py depo(): "
-                                              f"Can not get result from MOEX API ticker {item['ticker']}.")
-                continue
-            else:
-                # Get current price if BIDd exist. If not - current price is admitted price (market course prev day)
-                if results['bid']:
-                    item['current_price'] = results['bid']
-                else:
-                    item['current_price'] = results['prevadmittedquote']
-
-                # Get final price as admitted MOEX price (market cource) * number of shares from depo table
-                if results['bid']:
-                    if results['lotsize']:
-                        item['final_price'] = helpers_functions.check_final_price('bid', item['number'],
-                                                                results) / results['lotsize']
-                    else:
-                        print(f"Error. sandbox.depo(): results['lotsize'] for ticker {results['secid']} is empty")
-                        item['final_price'] = 0
-                else:
-                    if results['lotsize']:
-                        item['final_price'] = helpers_functions.check_final_price('prevadmittedquote', item['number'],
-                                                                results) / results[
-                                                  'lotsize']
-                    else:
-                        print(f"Error. sandbox.depo(): results['lotsize'] for ticker {results['secid']} is empty")
-                        item['final_price'] = 0
-
-                # Get currency symbol on primary board for ticker
-                item['currency_symbol'] = results['currencyid']
-
-                # Append ticker to tickers list
-                tickers.append(item)
+        tickers = [{'ticker': row['ticker'], 'name': row['name'], 'number': row['number'],
+                    'market': market_translate.get(row['market']), 'currency_symbol': (row['currency'] or '').lower(),
+                    'min_border': row['min_border'], 'max_border': row['max_border'],
+                    'notification': row['notification']} for row in rows]
 
-                # Increase total value
-                total += item['final_price']
-
-        # Get user cash from broker table
+        # 2. Get user cash from broker table
         cash = database.execute("SELECT account FROM broker WHERE user_id = ?", (g.user['user_id'],)).fetchone()[0]
 
-        # Increase total with cash
-        total += float(cash)
-
-        # 3. Return index.html with JINJA (cash, total, ticker{ticker, name, number, market, current_price, 
-        # final_price, min_boarder, max_boarder, notification})
-
-        return render_template("/sandbox/depo.html", cash=cash, total=total, tickers=tickers)
+        # 3. Return depo.html with JINJA (cash, ticker{ticker, name, number, market, currency_symbol, min_boarder,
+        # max_boarder, notification})
+        return render_template("/sandbox/depo.html", cash=cash, tickers=tickers)
 
     # If request POST - change DB notification borders
     if request.method == "POST":
@@ -346,6 +395,10 @@ def depo():
                                      ((ticker_dict.get(ticker))[0], (ticker_dict.get(ticker))[1],
                                       (ticker_dict.get(ticker))[2], False,
                                       g.user['user_id'], ticker))
+                    # New borders - alerts of ticker are armed again
+                    database.execute("DELETE FROM alert_state "
+                                     "WHERE user_id = ? AND ticker = ?",
+                                     (g.user['user_id'], ticker))
 
                 except database.Error as e:
                     print(f"Error. sandbox.depo() sqlite3: {e}")
@@ -427,9 +480,9 @@ def sell():
             flash(error_messages)
             return redirect("/sandbox/sell")
 
-        # 3. Get actual information from  MOEX API
+        # 3. Get actual information from  MOEX API (or from quotes table if it is fresh)
 
-        api_response = helpers_functions.lookup(ticker)
+        api_response = helpers_functions.lookup_many([ticker], max_age=helpers_functions.quote_max_age)[ticker]
 
         results = api_response[1]
         errors = api_response[0]
@@ -451,80 +504,20 @@ def sell():
         final_price = helpers_functions.check_final_price('bid', number, results)
         lotsize = results["lotsize"]
 
-        # 5. Check user depo
+        # 5. Make trade (securities are checked in transaction - concurrent requests can not sell them twice)
 
         database = get_db()
-        row = database.execute("SELECT number "
-                               "FROM depo "
-                               "WHERE user_id = ? AND ticker = ?",
-                               (g.user['user_id'], results['secid'])).fetchone()
-        if not row:
-            flash(f"Похоже вы пытаетесь продать тикер {ticker}, которого нет у вас в депозитарии. "
-                  f"Проверьте депозитарий, в случае необходимости обратитесь к администратору сайта.")
-            return redirect("/sandbox/sell")
-
-        depo_number = row['number']
-
-        if not depo_number:
-            helpers_functions.app_log_add(f"Error. sandbox.py sell(): can not get number from depo table from "
-                        f"database for ticker {ticker}")
-            flash("Извините, невозможно получить количество ценных бумаг из депозитария. "
-                  "Попробуйте еще раз, при повторении ошибки свяжитесьс администратором сайта.")
+        errors, user_account = trade.sell(database, g.user['user_id'], results, int(number) * int(lotsize),
+                                          final_price)
+        if errors:
+            flash(','.join(errors))
             return redirect("/sandbox/sell")
 
-        # If user can not afford this
-        if depo_number < int(number) * lotsize:
-            flash(f"Извините, похоже у вас не хватает ценных бумаг для продажи "
-                  f"{number} лота(ов) {ticker}. "
-                  f"Необходимо {lotsize * int(number)} ед., "
-                  f"у вас в наличии {depo_number} ед.")
-            return redirect("/sandbox/sell")
+        helpers_functions.app_log_add(f"Success. sandbox.py sell(): "
+                                      f"userid({g.user['user_id']}) make a deal with {ticker}.")
 
-        # 6. Make transaction to DB
-        database = get_db()
-        database.isolation_level = None  # ON autocommit mode. Hand control of transaction-to group rollback
-
-        # -------------------------TRANSACTION----------------------------
-        database.execute("begin")
-        try:
-            # 1. Add cash to user's broker account
-            database.execute("UPDATE broker "
-                             "SET account = account + ? "
-                             "WHERE user_id = ?",
-                             (final_price, g.user['user_id']))
-
-            # 2. Check if depo number is equal number - then delete row from depo table
-            if depo_number == lotsize * int(number):
-                database.execute("DELETE FROM depo "
-                                 "WHERE ticker = ?",
-                                 (results['secid'],))
-            # 3. Decrease number of shares in depo table
-            else:
-                database.execute("UPDATE depo "
-                                 "SET number = number - ? "
-                                 "WHERE ticker = ?",
-                                 (lotsize * int(number), results['secid']))
-
-            # 4. Add this purchase to log table
-            database.execute("INSERT "
-                             "INTO log (user_id, ticker, operation, price, price_total, number, date_time)"
-                             "VALUES (?,?,?,?,?,?,?)",
-                             (g.user['user_id'], results['secid'], 'sell', results['bid'], final_price,
-                              int(number) * int(lotsize), datetime.now(tz=pytz.timezone('Europe/Moscow')).isoformat()))
-
-            # 5. Commit transaction changes
-            database.execute("commit")
-            helpers_functions.app_log_add(f"Success. sandbox.py sell(): "
-                                          f"userid({g.user['user_id']}) make a deal with {ticker}.")
-
-        except database.Error as e:
-
-            database.execute("rollback")
-            database.close()
-            helpers_functions.app_log_add(f"Error. sandbox.py sell(): userid({g.user['user_id']}) "
-                                          f"ticker: {ticker}. SQL error {e}.")
-
-        # ------------------------END TRANSACTION ----------------------
+        # Update user row of rates
+        rates_snapshot.update_user(database, g.user['user_id'])
 
         flash(f"Вы успешно продали {int(number) * int(lotsize)} единиц(у) {results['secid']} "
               f"по цене {results['bid']} на общую сумму {helpers_functions.finance_format(final_price)} \u20bd.")
@@ -540,32 +533,124 @@ def sell():
 @login_required
 def history():
     """
-    Show history for current user from log table of database.
+    Show history for current user from log table of database by pages (keyset pagination on index
+    log (user_id, date_epoch) or log (user_id, ticker, date_epoch) if ticker filter is set).
+    Query parameters: ticker, operation ('buy' or 'sell') - filters, cursor - '<date_epoch>-<id>' of last row of
+    previous page.
     :return: history.html template
     """
-    tickers = []
 
-    # Get history info from database
-    database = get_db()
-    rows = database.execute("SELECT ticker, operation, price, number, date_time "
-                            "FROM log "
-                            "WHERE user_id = ? "
-                            "ORDER BY date_time DESC",
-                            (g.user['user_id'],)).fetchall()
+    # 1. Check filters and cursor
+    ticker = request.args.get('ticker', '').strip().lower()
+    operation = request.args.get('operation', '')
+    cursor = request.args.get('cursor', '')
+
+    if ticker:
+        error_messages = helpers_functions.check_ticker_text_fail(ticker)
+        if error_messages:
+            flash(error_messages)
+            return redirect("/sandbox/history")
+    if operation not in ('', 'buy', 'sell'):
+        flash(f"Извините, неизвестный тип операции ({operation}).")
+        return redirect("/sandbox/history")
+    if cursor and not re.fullmatch(r"[0-9]+-[0-9]+", cursor):
+        flash("Извините, похоже что-то не так со страницей истории.")
+        return redirect("/sandbox/history")
+
+    conditions = ["user_id = ?"]
+    params = [g.user['user_id']]
+    if ticker:
+        conditions.append("ticker = ?")
+        params.append(ticker)
+    if operation:
+        conditions.append("operation = ?")
+        params.append(operation)
+    else:
+        conditions.append("operation IN ('buy', 'sell')")
+    if cursor:
+        conditions.append("(date_epoch, id) < (?, ?)")
+        params += [int(value) for value in cursor.split('-')]
+
+    # 2. One page from index (date_time is stored in Moscow time - date and time are cut in SQL)
+    page_size = int(current_app.config.get("HISTORY_PAGE_SIZE") or 50)
+    database = get_db(readonly=True)
+    rows = database.execute(f"SELECT id, date_epoch, upper(ticker) AS ticker, operation, price, number, "
+                            f"substr(date_time, 9, 2) || '.' || substr(date_time, 6, 2) || '.' || "
+                            f"substr(date_time, 1, 4) AS date, "
+                            f"substr(date_time, 12, 8) AS time "
+                            f"FROM log "
+                            f"WHERE {' AND '.join(conditions)} "
+                            f"ORDER BY date_epoch DESC, id DESC "
+                            f"LIMIT ?",
+                            (*params, page_size + 1)).fetchall()
+
+    # 3. Cursor of next page if there are more rows
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = f"{rows[-1]['date_epoch']}-{rows[-1]['id']}"
+
+    return render_template("/sandbox/history.html", tickers=rows, ticker=ticker, operation=operation,
+                           cursor=cursor, next_cursor=next_cursor)
+
+
+def export_response(name, query, params, columns):
+    """
+    Stream rows of query as file (format query parameter: 'csv' or 'jsonl', gzip=1 - compressed).
+    :param name: file name without extension
+    :param query: SQL query
+    :param params: query parameters
+    :param columns: names of query columns
+    :return: streamed response or redirect if format is unknown
+    """
+    file_format = request.args.get('format', 'csv')
+    if file_format not in export.FORMATS:
+        flash(f"Извините, неизвестный формат файла ({file_format}). Доступны: {', '.join(export.FORMATS)}.")
+        return redirect("/sandbox/depo")
+    compress = request.args.get('gzip') == '1'
+
+    # Rows are read by chunks while response is sent (read-only connection is not blocked by trades)
+    cursor = get_db(readonly=True).execute(query, params)
+    mimetype, extension = export.FORMATS[file_format]
+    response = Response(stream_with_context(export.stream(cursor, columns, file_format, compress)),
+                        mimetype='application/gzip' if compress else mimetype)
+    response.headers['Content-Disposition'] = \
+        f"attachment; filename={name}.{extension}{'.gz' if compress else ''}"
+    return response
+
+
+@bp.route("/export/history")
+@login_required
+def export_history():
+    """
+    Download full trade history of current user.
+    :return: streamed CSV or JSON Lines file
+    """
+    columns = ('ticker', 'operation', 'price', 'number', 'price_total', 'date_time')
+    return export_response("history",
+                           "SELECT upper(ticker), operation, price, number, price_total, date_time "
+                           "FROM log "
+                           "WHERE user_id = ? "
+                           "ORDER BY date_epoch DESC, id DESC",
+                           (g.user['user_id'],), columns)
 
-    for row in rows:
-        if row['operation'] in ('buy', 'sell'):
-            try:
-                date_time = datetime.fromisoformat(row['date_time'])
-                date = f"{date_time.date().day:02d}.{date_time.date().month:02d}.{date_time.date().year}"
-                time = f"{date_time.time().hour:02d}:{date_time.time().minute:02d}:{date_time.time().second:02d}"
-            except ValueError:
-                date = ''
-                time = ''
-            tickers.append({'ticker': row['ticker'].upper(), 'operation': row['operation'], 'number': row['number'],
-                            'price': row['price'], 'date': date, 'time': time})
 
-    return render_template("/sandbox/history.html", tickers=tickers)
+@bp.route("/export/depo")
+@login_required
+def export_depo():
+    """
+    Download current depo positions of current user.
+    :return: streamed CSV or JSON Lines file
+    """
+    columns = ('ticker', 'name', 'number', 'lotsize', 'currency', 'market', 'initialfacevalue', 'min_border',
+               'max_border', 'notification')
+    return export_response("depo",
+                           "SELECT upper(ticker), name, number, lotsize, upper(currency), market, initialfacevalue, "
+                           "min_border, max_border, notification "
+                           "FROM depo "
+                           "WHERE user_id = ? "
+                           "ORDER BY ticker",
+                           (g.user['user_id'],), columns)
 
 
 @bp.route("/settings", methods=["POST", "GET"])
@@ -620,6 +705,7 @@ def settings():
         email = request.form.get('email')
         account = request.form.get('account')
         delete_acc = request.form.get('delete_acc')
+        api_token = request.form.get('api_token')
 
         # 2. Check client data
 
@@ -674,6 +760,11 @@ def settings():
                 flash(f"Извините, похоже что-то не так с удаление вашего аккаунта.")
                 return redirect("/sandbox/settings")
 
+        # Check API token
+        if api_token and api_token != 'true':
+            flash("Извините, похоже что-то не так с созданием API токена.")
+            return redirect("/sandbox/settings")
+
         # 3. Change database
 
         flash_messages = []
@@ -711,21 +802,30 @@ def settings():
                                  "WHERE user_id = ?",
                                  (account, g.user['user_id']))
                 flash_messages.append("Баланс обновлен.")
-            # 5. Delete acc
+            # 5. Create new API token (old token stops working)
+            if api_token == 'true':
+                token = api_tokens.create(database, g.user['user_id'])
+                flash_messages.append(f"Ваш новый API токен: {token} . Сохраните его - он показывается только один "
+                                      f"раз.")
+            # 6. Delete acc
             if delete_acc == 'true':
                 database.execute("DELETE FROM auth WHERE user_id = ?", (g.user['user_id'],))
                 database.execute("DELETE FROM depo WHERE user_id = ?", (g.user['user_id'],))
+                database.execute("DELETE FROM alert_state WHERE user_id = ?", (g.user['user_id'],))
+                database.execute("DELETE FROM api_token WHERE user_id = ?", (g.user['user_id'],))
                 database.execute("DELETE FROM broker WHERE user_id = ?", (g.user['user_id'],))
                 flash_messages = [f"Аккаунт и вся информация о {g.user['username']} удалены."]
-            # 6. commit transaction changes
+            # 7. commit transaction changes
             database.execute("commit")
             helpers_functions.app_log_add(f"Success. sandbox.py setting(): "
                                           f"Update settings for user_id=({g.user['user_id']}).")
 
+            # Update (or delete) user row of rates
+            rates_snapshot.update_user(database, g.user['user_id'])
+
         except database.Error as e:
 
             database.execute("rollback")
-            database.close()
             helpers_functions.app_log_add(f"Error. sandbox.py setting(): "
                                           f"user_id=({g.user['user_id']}) sqlite3 TRANSACTION: {e}.")
 
@@ -748,96 +848,21 @@ def rates():
         flash("Извините, рейтинги доступны только пользователям с аккаунтом типа public.")
         return redirect("/sandbox/depo")
 
-    # Return render_template("/sandbox/rates.html")
-    # 1. Cash summary
-    # Get current price for every distinct ticker in depo table, create dictionary
+    # 1. Build rates snapshot if it was not built yet (refresher.py and trades keep it actual)
     database = get_db()
-    tickers_price = dict.fromkeys(
-        [row['ticker'] for row in database.execute("SELECT DISTINCT depo.ticker "
-                                                   "FROM depo "
-                                                   "JOIN auth ON "
-                                                   "depo.user_id=auth.user_id "
-                                                   "WHERE auth.account_type = 'public'").fetchall()])
-    for ticker in tickers_price:
-        results = helpers_functions.lookup(ticker)[1]
-        if results:
-            if results.get('bid') and results.get('lotsize'):
-                price = helpers_functions.check_final_price('bid', 1, results) / results['lotsize']
-                tickers_price[ticker] = price
-            elif results.get('prevadmittedquote') and results.get('lotsize'):
-                price = helpers_functions.check_final_price('prevadmittedquote', 1, results) / results['lotsize']
-                tickers_price[ticker] = price
-            else:
-                helpers_functions.app_log_add(f"Error. sandbox.py rates(): user_id={g.user['user_id']}, "
-                            f"Can not get response from helpers.lookup for ticker {ticker}.")
-                flash("Извините, сейчас рейтинги не доступны. Повторите попытку позднее, в случае поворения ошибки "
-                      "обратитесь к администратору сайта.")
-                return redirect("/sandbox/depo")
-        else:
-            helpers_functions.app_log_add(f"Error. sandbox.py rates(): Can not get lotsize, "
-                                          f"bid or prevadmittedquote from helpers.lookup "
-                                          f"for ticker {ticker}.")
+    if not database.execute("SELECT 1 FROM rates_snapshot LIMIT 1").fetchone():
+        if rates_snapshot.rebuild(database) is None:
+            helpers_functions.app_log_add(f"Error. sandbox.py rates(): user_id={g.user['user_id']}, "
+                                          f"Can not build rates snapshot.")
             flash("Извините, сейчас рейтинги не доступны. Повторите попытку позднее, в случае поворения ошибки "
                   "обратитесь к администратору сайта.")
             return redirect("/sandbox/depo")
 
-    # For each user calculate total cash
-    # Get list of users like dict 'user_id' : 'username'
-    users_list = {}
-    rows = database.execute("SELECT user_id, username "
-                            "FROM auth "
-                            "WHERE account_type='public'").fetchall()
-    for row in rows:
-        users_list[row['user_id']] = {'username': row['username'], 'total_cash': 0, 'diversity': 0}
-
-    # Get user_id, ticker, number from depo table of database
-    for user_id in users_list:
-        total_cash = 0
-        rows = database.execute("SELECT ticker, number FROM depo WHERE user_id = ?",
-                                (user_id,)).fetchall()
-
-        users_list[user_id]['diversity'] = len(rows)
-
-        for row in rows:
-            total_cash += row['number'] * tickers_price[row['ticker']]
-
-        bank_account = database.execute("SELECT account FROM broker WHERE user_id = ?", (user_id,)).fetchone()
-
-        if bank_account:
-            users_list[user_id]['total_cash'] = total_cash + bank_account['account']
-        else:
-            helpers_functions.app_log_add(f"Error. sandbox.py rates(): user_id={g.user['user_id']} "
-                        f"sqlite3: Can not get broker account data.")
-            flash("Извините, сейчас рейтинги не доступны. Повторите попытку позднее, в случае поворения ошибки "
-                  "обратитесь к администратору сайта.")
-            return redirect("/sandbox/depo")
-
-    # 2. Diversity count : Get number of different tickers for each user. look at return jinja variable.
-
-    # 3. Volume of purchases
-    # Add diversity and diversity summary to users_list dict
-    for user_id in users_list:
-        volume_purchase = 0
-        rows = database.execute("SELECT price, number, price_total "
-                                "FROM log "
-                                "WHERE user_id = ?",
-                                (user_id,)).fetchall()
-        # From log table for each user get number of sell-buy operations
-        users_list[user_id]['purchase_number'] = len(rows)
-        for row in rows:
-            # For each user from log get summ of sell/buy
-            volume_purchase += row['price_total']
-
-        users_list[user_id]['purchase_value'] = volume_purchase
-    # Send top 10 to table as jinja template in return as purchase_number
-    # Send top 10 to table in jinja template when return as cash_sum
-    # Send top 10 to table as jinja template in return as purchase_value
-    # Send top 10 to table in jinja template when return as diversity_rate
+    # 2. Send top 10 to tables in jinja template (cash_sum, diversity_rate, purchase_value, purchase_number)
+    # (read-only connection is not blocked by trades)
+    database = get_db(readonly=True)
     return render_template("/sandbox/rates.html",
-                           cash_sum=sorted(list(users_list.values()), key=lambda x: x['total_cash'], reverse=True)[:10],
-                           diversity_rate=sorted(list(users_list.values()), key=lambda x: x['diversity'],
-                                                 reverse=True)[:10],
-                           purchase_value=sorted(list(users_list.values()), key=lambda x: x['purchase_value'],
-                                                 reverse=True)[:10],
-                           purchase_number=sorted(list(users_list.values()), key=lambda x: x['purchase_number'],
-                                                  reverse=True)[:10])
+                           cash_sum=rates_snapshot.get_top(database, 'total_cash'),
+                           diversity_rate=rates_snapshot.get_top(database, 'diversity'),
+                           purchase_value=rates_snapshot.get_top(database, 'purchase_value'),
+                           purchase_number=rates_snapshot.get_top(database, 'purchase_number'))
@@ -1,536 +1,194 @@
 """
 Schedule registered at __init__.py file and there run init().
+Run it as module from root folder: python -m moex_invest.schedule
+(settings file is taken from MOEX_SANDBOX_SETTINGS environment variable as in create_app())
 """
 
 import sqlite3
+import time
 import pytz
-import requests
-import yagmail
-from os import environ
 from datetime import datetime
+from moex_invest.helpers import helpers_functions
+from moex_invest.mailer import mailer
+from moex_invest.config import load_config, configure_services
+
+# alert_state.direction of border: price is below min_border or above max_border
+DIRECTIONS = {'minimal_limit': 0, 'maximum_limit': 1}
+
+
+def send_alert_emails(mail_list):
+    """
+    Put alerts to outbox (one digest per recipient), mark them as fired in alert_state and send pending messages of
+    outbox.
+    :param mail_list: list of dicts {user_id, email, ticker, course ('minimal_limit' or 'maximum_limit'), min_border,
+    max_border, price, date_time}
+    :return: None if errors, number of sent emails if success
+    """
+    database_name = helpers_functions.database_name
+
+    # 1. Outbox and alert_state are changed together - crash does not lose or duplicate alerts
+    database = sqlite3.connect(database_name)
+    try:
+        with database:
+            queued = mailer.enqueue(database, mail_list)
+            fired_at = datetime.now(tz=pytz.timezone('Europe/Moscow')).isoformat()
+            database.executemany("INSERT OR IGNORE INTO alert_state (user_id, ticker, direction, fired_at) "
+                                 "VALUES (?, ?, ?, ?)",
+                                 [(row['user_id'], row['ticker'], DIRECTIONS[row['course']], fired_at)
+                                  for row in mail_list])
+    except database.Error as e:
+        helpers_functions.app_log_add(f"Error. schedule.py send_alert_emails(): sqlite3 {e}.")
+        return None
+    finally:
+        database.close()
+
+    # 2. Send (messages left from crashed runs too)
+    try:
+        result = mailer.dispatch(database_name)
+    except database.Error as e:
+        helpers_functions.app_log_add(f"Error. schedule.py send_alert_emails(): sqlite3 {e}.")
+        return None
+
+    helpers_functions.app_log_add(f"Success. schedule.py send_alert_emails(): "
+                                  f"Queue {queued} messages for {len(mail_list)} alerts, send {result['sent']}, "
+                                  f"not sent {result['failed']}.")
+    return result['sent']
 
 
 def schedule():
-    database_name = 'moex.db'
-
-    def lookup(symbol):
-        """
-        Look for MOEX API for ticker symbol.
-        :param app_log_add: function to logged
-        :param symbol: ticker: str
-        :return: tuple (errors, results:dict : isqualifiedinvestors secid name faceunit initialfacevalue currencyid lotsize
-        prevadmittedquote bid offer)
-        """
-
-        # Error message use for flash in client browser
-        error_messages = []
-
-        def get_currency():
-            """
-            Get current usd, eur fixes from MOEX API.
-            :return: dictionary {'usd': value:float, 'eur':value:float}, if errors return None.
-            """
-
-            url_usd = 'https://iss.moex.com/iss/' \
-                      'engines/currency/' \
-                      'markets/index/' \
-                      'securities/usdfix.json' \
-                      '?iss.meta=off&' \
-                      'iss.only=marketdata&' \
-                      'marketdata.columns=CURRENTVALUE'
-
-            url_eur = 'https://iss.moex.com/iss/' \
-                      'engines/currency/' \
-                      'markets/index/' \
-                      'securities/eurfix.json' \
-                      '?iss.meta=off&' \
-                      'iss.only=marketdata&' \
-                      'marketdata.columns=CURRENTVALUE'
-
-            # Contact API
-            try:
-                response_usd = requests.get(url_usd)
-                response_eur = requests.get(url_eur)
-            except requests.RequestException as e:
-                app_log_add(f"Error. schedule.py lookup.get_currency(): {e}.")
-                return None
-
-            # parse response
-            try:
-                usd = response_usd.json()
-                eur = response_eur.json()
-                return {
-                    'usd': usd["marketdata"]["data"][0][0],
-                    'eur': eur["marketdata"]["data"][0][0]
-                }
-
-            except (KeyError, TypeError, ValueError) as e:
-                app_log_add(f"Error. schedule.py lookup.get_currency(): {e}.")
-                return None
-
-        def get_description():
-            """
-            Get information for depo table and future request to MOEX API for market price.
-            :return tuple (error, result:dict)
-            """
-
-            # Contact API
-            try:
-
-                url = f"https://iss.moex.com/iss/securities/{symbol}.json?" \
-                      f"iss.meta=off&" \
-                      f"description.columns=name,value&" \
-                      f"boards.columns=secid,boardid,title,market,engine,is_primary,currencyid"
-
-                response = requests.get(url)
-                response.raise_for_status()
-
-            except requests.RequestException as e:
-
-                error_messages.append(f'Извините, похоже не получается получить информацию о {symbol} '
-                                      'от московской биржи. Попробуйте другой тикер, при повторении ошибки свяжитесь с '
-                                      'администратором сайта.')
-                app_log_add(f'Error. schedule.py lookup.get_description(): {e}.')
-                return error_messages, None
-
-            # Parse response
-            try:
-                quote = response.json()
-
-                if quote:
-
-                    result = {}
-
-                    # 1. DESCRIPTION TABLE
-
-                    # Get columns number in description table
-                    name_index = quote["description"]["columns"].index("name")
-                    value_index = quote["description"]["columns"].index("value")
-
-                    # Get data from description table for future price request and depo
-                    # ISQUALIFIEDINVESTORS, SECID, NAME, FACEUNIT, INITIALFACEVALUE
-                    # Look for this names in description table rows
-                    interesting_names = dict.fromkeys(
-                        ('ISQUALIFIEDINVESTORS', 'SECID', 'NAME', 'FACEUNIT', 'INITIALFACEVALUE'))
-
-                    for row in quote["description"]["data"]:
-
-                        if row[name_index] in interesting_names:
-
-                            if row[name_index] == 'INITIALFACEVALUE':
-                                result[row[name_index].lower()] = float(row[value_index])
-                            else:
-                                result[row[name_index].lower()] = row[value_index].lower()
-
-                    # 2. BOARDS TABLE
-
-                    # Get columns number in description table
-                    boardid_index = quote["boards"]["columns"].index("boardid")
-                    market_index = quote["boards"]["columns"].index("market")
-                    engine_index = quote["boards"]["columns"].index("engine")
-                    is_primary_index = quote["boards"]["columns"].index("is_primary")
-                    currencyid_index = quote["boards"]["columns"].index("currencyid")
-
-                    # Get data from boards table for future price request and depo
-                    # Look for primary board in boards table rows
-
-                    for row in quote["boards"]["data"]:
-                        if row[is_primary_index] == 1:
-                            result["boardid"] = row[boardid_index]
-                            result["engine"] = row[engine_index]
-                            result["market"] = row[market_index]
-                            result["currencyid"] = row[currencyid_index].lower()
-
-                    return None, result
-
-            except (KeyError, TypeError, ValueError) as e:
-                error_messages.append(f'Извините, похоже не получается получить информацию о {symbol} '
-                                      'от московской биржи. Попробуйте другой тикер, при повторении ошибки свяжитесь с '
-                                      'администратором сайта.')
-                app_log_add(f"Error. schedule.py lookup.get_description(): {e}")
-                return error_messages, None
-
-        results = get_description()[1]
-
-        if results:
-
-            # 1. Contact API
-            try:
-                # Get market info
-                url = f"https://iss.moex.com/iss/" \
-                      f"engines/{results.get('engine')}/" \
-                      f"markets/{results.get('market')}/" \
-                      f"boards/{results.get('boardid')}/" \
-                      f"securities/{results.get('secid')}.json" \
-                      f"?iss.meta=off&" \
-                      f"iss.only=securities,marketdata&" \
-                      f"securities.columns=LOTSIZE,STATUS,PREVADMITTEDQUOTE&" \
-                      f"marketdata.columns=BID,OFFER"
-
-                response = requests.get(url)
-                response.raise_for_status()
-
-            except requests.RequestException as e:
-                app_log_add(f"Error. schedule.py lookup(): {e}.")
-                error_messages.append(f'Извините, похоже не получается получить информацию о {symbol} '
-                                      'от московской биржи. Попробуйте другой тикер, при повторении ошибки свяжитесь с '
-                                      'администратором сайта.')
-
-                return error_messages, None
-
-            # Parse response
-            try:
-
-                response = response.json()
-
-                # 1. From securities table get lot size, if it is available, PREVADMITTEDQUOTE (market price)
-                lotsize_index = response["securities"]["columns"].index("LOTSIZE")
-                avaliable_index = response["securities"]["columns"].index("STATUS")
-                prevadmittedquote_index = response["securities"]["columns"].index("PREVADMITTEDQUOTE")
-
-                # 2. If it is not available to buy or sell
-                if response["securities"]["data"][0][avaliable_index] != 'A':
-                    app_log_add(f"Warning. schedule.py lookup(). Status index of {symbol} is "
-                                f"{response['securities']['data'][0][avaliable_index]}")
-                    error_messages.append(
-                        f"Извините, но в настоящее время {symbol} недоступен для торговли. Попробуйте другой тикер.")
-                    return error_messages, None
-
-                results["lotsize"] = response["securities"]["data"][0][lotsize_index]
-                results["prevadmittedquote"] = response["securities"]["data"][0][prevadmittedquote_index]
-
-                # 3. From market data get BID (buy price) and OFFER (sell price)
-                bid_index = response["marketdata"]["columns"].index("BID")
-                offer_index = response["marketdata"]["columns"].index("OFFER")
-
-                results['bid'] = response["marketdata"]["data"][0][bid_index]
-                results['offer'] = response["marketdata"]["data"][0][offer_index]
-
-                # 4. Add currency values
-                currency = get_currency()
-                if currency:
-                    results['usd'] = float(currency['usd'])
-                    results['eur'] = float(currency['eur'])
-                    return None, results
-                else:
-                    app_log_add("Error. schedule.py lookup() Can not get currency results - "
-                                "they are empty.")
-                    # if currency is important for this operation
-                    if results['currencyid'] != 'rub':
-                        return ['Извините, сейчас валютные операции недоступны. " \
-                               "Попробуйте другой тикер. При повторении ошибки обратитесь к администратору сайта.'], None
-                    else:
-                        return None, results
-
-            except (KeyError, TypeError, ValueError) as e:
-                app_log_add(f"Error. schedule.lookup(): {e}")
-                error_messages.append(f'Извините, похоже не получается получить информацию о {symbol} '
-                                      'от московской биржи. Попробуйте другой тикер, при повторении ошибки свяжитесь с '
-                                      'администратором сайта.')
-                return error_messages, None
-        else:
-            app_log_add('Error. schedule.py lookup() get empty return from '
-                        'schedule.lookup.get_description() function.')
-            return error_messages, None
-
-    def app_log_add(text: str):
-        """
-        Add row to app_log table of database
-        :param text: text message to adding to database
-        :return: None
-        """
-        try:
-            message = str(text)
-        except:
-            message = 'Error. db.app_log_add() message to app_log is not string'
-
-        db_name = database_name
-        if db_name:
-            database = sqlite3.connect(db_name)
-            with database:
-                database.execute("INSERT INTO app_log (log_text, date_time) "
-                                 "VALUES (?, ?)",
-                                 (message, datetime.now(tz=pytz.timezone('Europe/Moscow')).isoformat()))
-
-            database.close()
-
-        else:
-            print("Error. schedule.py app_log_add Can not get database name from class helper_functions")
+    # Database and MOEX API client are configured with config.py configure_services()
+    database_name = helpers_functions.database_name
+    app_log_add = helpers_functions.app_log_add
 
     # If database don't work with pythonanywhere - delete it from update_current_prices - there are only for log
 
     def update_current_prices(database):
         """
         Get current bid, offer, prevadmitted price for ticker with depo.notification == true
+        Pipeline: distinct tickers (SQL) -> batch concurrent quotes (helpers lookup_many) ->
+        borders evaluation with one SQL join against temporary prices table.
         database: database name from app.config
-        :return: sand_mail: dict of emails to send. (with email_sent = true if email already sent).
-        To send mail daily, not every hour., If errors - return None.
+        :return: sand_mail: list of dicts to send - only new crossings (alert_state has not this border).
+        If errors - return None.
         """
 
-        # Get interesting data from database
-        email_list = {}
+        started = time.perf_counter()
         db_con = sqlite3.connect(database)
         db_con.row_factory = sqlite3.Row
-        rows = db_con.execute(
-            "SELECT auth.user_id, auth.email, depo.ticker, depo.min_border, depo.max_border, depo.email_sent "
-            "FROM depo "
-            "JOIN auth "
-            "ON depo.user_id=auth.user_id "
-            "WHERE notification = 'true'").fetchall()
 
-        if rows:
-            for row in rows:
-                if row['ticker'] not in email_list:
-                    email_list[row['ticker']] = [{'user_id': row['user_id'], 'email': row['email'],
-                                                  'min_border': row['min_border'], 'max_border': row['max_border'],
-                                                  'email_sent': row['email_sent']}]
-                else:
-                    email_list[row['ticker']].append({'user_id': row['user_id'], 'email': row['email'],
-                                                      'min_border': row['min_border'], 'max_border': row['max_border'],
-                                                      'email_sent': row['email_sent']})
+        try:
+            # 1. Get distinct tickers with notifications
+            tickers = [row['ticker'] for row in db_con.execute("SELECT DISTINCT ticker "
+                                                               "FROM depo "
+                                                               "WHERE notification = 'true'").fetchall()]
+            if not tickers:
+                app_log_add(f"Warning. schedule.py update_current_prices(): "
+                            f"Not notification in database {database}.")
+                return None
+            selected = time.perf_counter()
 
-            db_con.close()
+            # 2. For every ticker get bid or prevadmitted price from MOEX API (batch concurrent request)
             price_list = {}
-            # For every ticker get bid or prevadmitted price from MOEX API
-            for ticker in email_list.keys():
-                result = lookup(ticker)[1]
-                if result:
-
-                    # If bid exist - take bid, else take prevadmitted
-                    if result['bid']:
-                        price_list[ticker] = result['bid']
-                    elif result['prevadmittedquote']:
-                        price_list[ticker] = result['prevadmittedquote']
-                    else:
-                        price_list[ticker] = None
-                        app_log_add(f"Error. schedule.py update_current_prices(): "
-                                    f"Result from moex {result} "
-                                    f"for ticker {ticker} not contain bid or prevadmitted")
-
-                else:
+            quotes = helpers_functions.lookup_many(tickers)
+            for ticker in tickers:
+                result = quotes[ticker][1]
+                if not result:
                     app_log_add(f"Error. schedule.py update_current_prices(): "
                                 f"result from moex API for ticker {ticker} is empty")
                     continue
 
-            # Check if ticker is not between borders
-            # For each ticker in price_list look for borders in email_list
-            sand_mail = []
-            for ticker in price_list.keys():
-                for row in email_list[ticker]:
-                    row['price'] = price_list[ticker]
-                    row['ticker'] = ticker
-                    row['date_time'] = datetime.now(tz=pytz.timezone('Europe/Moscow'))
-                    if row['min_border']:
-                        if float(row['min_border']) >= float(price_list[ticker]):
-                            row['course'] = 'minimal_limit'
-                            sand_mail.append(row)
-                    if row['max_border']:
-                        if float(row['max_border']) <= float(price_list[ticker]):
-                            row['course'] = 'maximum_limit'
-                            sand_mail.append(row)
-                    else:
-                        continue
+                # If bid exist - take bid, else take prevadmitted
+                if result['bid']:
+                    price_list[ticker] = result['bid']
+                elif result['prevadmittedquote']:
+                    price_list[ticker] = result['prevadmittedquote']
+                else:
+                    app_log_add(f"Error. schedule.py update_current_prices(): "
+                                f"Result from moex {result} "
+                                f"for ticker {ticker} not contain bid or prevadmitted")
+            fetched = time.perf_counter()
+
+            # 3. Check if ticker is not between borders - join depo with temporary prices table
+            # (empty border from depo form is stored as '' - it is not a border)
+            db_con.execute("CREATE TEMP TABLE IF NOT EXISTS alert_price ("
+                           "ticker TEXT PRIMARY KEY, "
+                           "price REAL NOT NULL)")
+            db_con.execute("DELETE FROM temp.alert_price")
+            db_con.executemany("INSERT INTO temp.alert_price (ticker, price) VALUES (?, ?)", price_list.items())
+
+            # Re-arm alerts: price returned inside the border (only tickers with price)
+            with db_con:
+                rearmed = db_con.execute("DELETE FROM alert_state "
+                                         "WHERE ticker IN (SELECT ticker FROM temp.alert_price) "
+                                         "AND NOT EXISTS (SELECT 1 "
+                                         "FROM depo "
+                                         "JOIN temp.alert_price ON alert_price.ticker = depo.ticker "
+                                         "WHERE depo.user_id = alert_state.user_id "
+                                         "AND depo.ticker = alert_state.ticker "
+                                         "AND depo.notification = 'true' "
+                                         "AND CASE alert_state.direction "
+                                         "WHEN 0 THEN typeof(depo.min_border) IN ('integer', 'real') "
+                                         "AND depo.min_border != 0 AND depo.min_border >= alert_price.price "
+                                         "ELSE typeof(depo.max_border) IN ('integer', 'real') "
+                                         "AND depo.max_border != 0 AND depo.max_border <= alert_price.price "
+                                         "END)").rowcount
+
+            # Crossed borders, fired - email was already sent for this border
+            date_time = datetime.now(tz=pytz.timezone('Europe/Moscow'))
+            rows = db_con.execute("SELECT auth.user_id, auth.email, depo.ticker, depo.min_border, depo.max_border, "
+                                  "alert_price.price, 'minimal_limit' AS course, "
+                                  "alert_state.user_id IS NOT NULL AS fired "
+                                  "FROM depo "
+                                  "JOIN temp.alert_price ON alert_price.ticker = depo.ticker "
+                                  "JOIN auth ON depo.user_id = auth.user_id "
+                                  "LEFT JOIN alert_state ON alert_state.user_id = depo.user_id "
+                                  "AND alert_state.ticker = depo.ticker AND alert_state.direction = 0 "
+                                  "WHERE depo.notification = 'true' "
+                                  "AND typeof(depo.min_border) IN ('integer', 'real') AND depo.min_border != 0 "
+                                  "AND depo.min_border >= alert_price.price "
+                                  "UNION ALL "
+                                  "SELECT auth.user_id, auth.email, depo.ticker, depo.min_border, depo.max_border, "
+                                  "alert_price.price, 'maximum_limit' AS course, "
+                                  "alert_state.user_id IS NOT NULL AS fired "
+                                  "FROM depo "
+                                  "JOIN temp.alert_price ON alert_price.ticker = depo.ticker "
+                                  "JOIN auth ON depo.user_id = auth.user_id "
+                                  "LEFT JOIN alert_state ON alert_state.user_id = depo.user_id "
+                                  "AND alert_state.ticker = depo.ticker AND alert_state.direction = 1 "
+                                  "WHERE depo.notification = 'true' "
+                                  "AND typeof(depo.max_border) IN ('integer', 'real') AND depo.max_border != 0 "
+                                  "AND depo.max_border <= alert_price.price").fetchall()
+            sand_mail = [dict(row, date_time=date_time) for row in rows if not row['fired']]
+            suppressed = len(rows) - len(sand_mail)
+            evaluated = time.perf_counter()
+
+        except db_con.Error as e:
+            app_log_add(f"Error. schedule.py update_current_prices(): sqlite3 {e}.")
+            return None
+        finally:
+            db_con.close()
 
-            return sand_mail
+        app_log_add(f"Success. schedule.py update_current_prices(): {len(tickers)} tickers, "
+                    f"{len(price_list)} prices, {len(sand_mail)} borders crossed, "
+                    f"{suppressed} already sent (suppressed), {rearmed} re-armed. "
+                    f"Timing: tickers {selected - started:.3f} s, quotes {fetched - selected:.3f} s, "
+                    f"borders {evaluated - fetched:.3f} s.")
 
-        else:
-            app_log_add(f"Warning. schedule.py update_current_prices(): "
-                        f"Not notification in database {database}.")
-            return None
+        return sand_mail
 
     def mail(database):
         """
         Schedule job to send email every first email immediately if borders are exceeded.
         :return: None if errors, number of sent emails if success
         """
-        # Check notifications and current prices
-        # Remove emails for client that already sent
+        # Check notifications and current prices (alerts with sent emails are suppressed)
         full_list = update_current_prices(database)
         if full_list:
             mail_list = full_list
         else:
             return None
 
-        # Send email
-        try:
-            yag_session = yagmail.SMTP(environ.get('mail_login'), environ.get('mail_password'))
-        except:
-            app_log_add("Error. schedule.py first_mail(): Can not connect to gmail account.")
-            return None
-
-        text_footer = f"\n Это сообщение создано автоматически. Пожалуйста, не отвечайте на него. " \
-                      f"\n С уважением, Invest app Bot.  https://lastrole.pythonanywhere.com \n" \
-                      f"{datetime.now(tz=pytz.timezone('Europe/Moscow')).strftime('%d.%m.%y')}"
-
-        sent_mail_number = 0
-
-        for row in mail_list:
-
-            # Set email title
-            text_title = f"Invest Bot {row.get('ticker').upper()} out of border"
-            text_body = ''
-
-            # Set text_body
-            if row.get('course') == 'minimal_limit':
-                if isinstance(row.get('date_time'), datetime):
-                    text_body = f"Внимание!\n{row.get('date_time').date().strftime('%d.%m.%y')} в " \
-                                f"{row.get('date_time').time().strftime('%H.%M.%S')} " \
-                                f"{row.get('ticker').upper()} стоит меньше нижней границы " \
-                                f"{row.get('min_border')}. Текущая стоимость {row.get('price')}."
-                else:
-                    text_body = f"Внимание!\n{row.get('ticker').upper()} стоит меньше нижней границы " \
-                                f"{row.get('min_border')}. Текущая стоимость {row.get('price')}."
-            elif row.get('course') == 'maximum_limit':
-                if isinstance(row.get('date_time'), datetime):
-                    text_body = f"Внимание!\n{row.get('date_time').date().strftime('%d.%m.%y')} в " \
-                                f"{row.get('date_time').time().strftime('%H:%M:%S')} " \
-                                f"{row.get('ticker').upper()} стоит больше верхней границы " \
-                                f"{row.get('max_border')}. Текущая стоимость {row.get('price')}."
-                else:
-                    text_body = f"Внимание!\n{row.get('ticker').upper()} стоит больше верхней границы " \
-                                f"{row.get('max_border')}. Текущая стоимость {row.get('price')}."
-
-            # Send email
-            try:
-                yag_session.send(to=f"{row.get('email')}", subject=text_title, contents=text_body + text_footer)
-                sent_mail_number += 1
-            except:
-                app_log_add(
-                    f"Error. schedule.py first_mail(): Can not sen email to {row.get('email')}")
-                continue
-
-        app_log_add(f"Success. schedule.py first_mail(): "
-                    f"Send {sent_mail_number} with notifications.")
-        return sent_mail_number
-
-    def take_symbols():
-        """
-        Take list of allowed symbols from MOEX.
-        (https://iss.moex.com/iss/reference/)
-        :return: Length of tickers list.
-        """
-
-        # Contact API
-
-        base_url = "https://iss.moex.com/iss"
-
-        tickers = {}
-
-        # 1. Get russian shares info (https://iss.moex.com/iss/engines/stock/markets/shares/securities/columns.html)
-
-        url = f"{base_url}/engines/stock/markets/shares/securities.json?iss.only=securities&securities.columns=SECID," \
-              f"STATUS,SHORTNAME "
-        response = requests.get(url)
-
-        try:
-            response.raise_for_status()
-        except requests.RequestException:
-            app_log_add("Error. schedule.py take_symbols(): "
-                        "Can not get database update shares from MOEX.")
-            return None
-        # Parse response
-        try:
-            symbols_json = response.json()
-            secid_index = symbols_json["securities"]['columns'].index('SECID')
-            status_index = symbols_json["securities"]['columns'].index('STATUS')
-            secname_index = symbols_json["securities"]['columns'].index('SHORTNAME')
-
-            # Delete redundancy tickers
-
-            for row in symbols_json['securities']['data']:
-                if row[status_index] == 'A' and row[secid_index] not in tickers:
-                    tickers[row[secid_index]] = row[secname_index]
-        except (ValueError, TypeError):
-            return None
-
-        # 2. Get russian bonds
-
-        url = f"{base_url}/engines/stock/markets/bonds/securities.json?iss.only=securities&securities.columns=SECID," \
-              f"STATUS,SHORTNAME "
-        response = requests.get(url)
-
-        try:
-            response.raise_for_status()
-        except requests.RequestException:
-            app_log_add("Error. schedule.py take_symbols(): "
-                        "Can not get database update bonds from MOEX.")
-            return None
-        # Parse response
-        try:
-            symbols_json = response.json()
-            secid_index = symbols_json["securities"]['columns'].index('SECID')
-            status_index = symbols_json["securities"]['columns'].index('STATUS')
-            secname_index = symbols_json["securities"]['columns'].index('SHORTNAME')
-
-            # Delete redundancy tickers
-
-            for row in symbols_json['securities']['data']:
-                if row[status_index] == 'A' and row[secid_index] not in tickers:
-                    tickers[row[secid_index]] = row[secname_index]
-        except (ValueError, TypeError):
-            return None
-
-        # 3. Get foreign shares
-
-        url = f"{base_url}/engines/stock/markets/foreignshares/" \
-              f"securities.json?iss.only=securities&securities.columns=SECID,STATUS,SHORTNAME"
-        response = requests.get(url)
-
-        try:
-            response.raise_for_status()
-        except requests.RequestException:
-            app_log_add("Error. schedule.py take_symbols(): "
-                        "Can not get database update foreign shares from MOEX.")
-            return None
-        # Parse response
-        try:
-            symbols_json = response.json()
-            secid_index = symbols_json["securities"]['columns'].index('SECID')
-            status_index = symbols_json["securities"]['columns'].index('STATUS')
-            secname_index = symbols_json["securities"]['columns'].index('SHORTNAME')
-
-            # Delete redundancy tickers
-
-            for row in symbols_json['securities']['data']:
-                if row[status_index] == 'A' and row[secid_index] not in tickers:
-                    tickers[row[secid_index]] = row[secname_index]
-        except (ValueError, TypeError):
-            return None
-
-        # UPDATE DATABASE
-
-        database = sqlite3.connect(database_name)
-        database.row_factory = sqlite3.Row
-
-        if len(tickers) > 0:
-
-            # --------------------------TRANSACTION ----------------------------
-            # Transaction - write tickets to database listing table
-            database.isolation_level = None
-            database.execute("begin")
-            try:
-                # Drop old table listing
-                database.execute("DELETE FROM listing")
-
-                # Write data to listing table
-                for secid, secname in tickers.items():
-                    database.execute("INSERT "
-                                     "INTO listing (secid, secname) "
-                                     "VALUES (?, ?)",
-                                     (secid, secname))
-
-                # Commit changes
-                database.execute("commit")
-                app_log_add(f"Success. schedule.py take_symbols(): "
-                            f"Add {len(tickers)} rows to database listing table.")
-
-            except database.Error as e:
-                app_log_add(f"Error. schedule.py take_symbols(): SQL error in transaction {e}.")
-                database.execute("rollback")
-            # -------------------------END TRANSACTION ---------------------------
-            database.close()
-
-        return len(tickers)
+        return send_alert_emails(mail_list)
 
     def update_symbols():
         """
@@ -538,7 +196,7 @@ def schedule():
         :return: None
         """
 
-        ticker_number = take_symbols()
+        ticker_number = helpers_functions.take_symbols()
 
         app_log_add(f"Success. schedule.py update_symbols(): "
                     f"Scheduler Update tickers listing from MOEX API. Number = {ticker_number}")
@@ -548,4 +206,6 @@ def schedule():
 
 
 if __name__ == "__main__":
+    # Take settings from the same file as create_app()
+    configure_services(load_config())
     schedule()
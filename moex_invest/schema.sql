@@ -15,7 +15,7 @@ notification TEXT,
 email_sent TEXT,
 FOREIGN KEY (user_id) REFERENCES auth (user_id)
 );
-CREATE INDEX depo_user ON depo (user_id, ticker);
+CREATE UNIQUE INDEX depo_user ON depo (user_id, ticker);
 
 
 CREATE TABLE broker (
@@ -35,6 +35,7 @@ email TEXT,
 account_type TEXT
 );
 CREATE INDEX auth_user ON auth (username);
+CREATE INDEX auth_account_type ON auth (account_type);
 
 CREATE TABLE log (
 id INTEGER PRIMARY KEY,
@@ -45,20 +46,114 @@ price REAL,
 number INTEGER,
 price_total REAL,
 date_time TEXT NOT NULL,
+date_epoch INTEGER NOT NULL DEFAULT 0,
 FOREIGN KEY (user_id) REFERENCES auth (user_id)
 );
-CREATE INDEX log_user ON log (user_id);
+CREATE INDEX log_user ON log (user_id, price_total);
+CREATE INDEX log_user_date ON log (user_id, date_epoch);
+CREATE INDEX log_user_ticker_date ON log (user_id, ticker, date_epoch);
 
 CREATE TABLE listing (
 id INTEGER PRIMARY KEY AUTOINCREMENT,
 secid TEXT NOT NULL,
-secname TEXT COLLATE NOCASE
+secname TEXT COLLATE NOCASE,
+market TEXT,
+isin TEXT
 );
 CREATE INDEX listing_ticker ON listing (secid);
-CREATE INDEX listing_secname ON listing (secname);
+
+CREATE VIRTUAL TABLE listing_fts USING fts5 (
+secid, secname, market, isin,
+content='listing', content_rowid='id',
+tokenize='unicode61 remove_diacritics 2',
+prefix='1 2 3'
+);
+CREATE TRIGGER listing_fts_insert AFTER INSERT ON listing BEGIN
+INSERT INTO listing_fts (rowid, secid, secname, market, isin)
+VALUES (new.id, new.secid, new.secname, new.market, new.isin);
+END;
+CREATE TRIGGER listing_fts_delete AFTER DELETE ON listing BEGIN
+INSERT INTO listing_fts (listing_fts, rowid, secid, secname, market, isin)
+VALUES ('delete', old.id, old.secid, old.secname, old.market, old.isin);
+END;
+CREATE TRIGGER listing_fts_update AFTER UPDATE ON listing BEGIN
+INSERT INTO listing_fts (listing_fts, rowid, secid, secname, market, isin)
+VALUES ('delete', old.id, old.secid, old.secname, old.market, old.isin);
+INSERT INTO listing_fts (rowid, secid, secname, market, isin)
+VALUES (new.id, new.secid, new.secname, new.market, new.isin);
+END;
+
+CREATE TABLE securities (
+secid TEXT NOT NULL PRIMARY KEY,
+name TEXT,
+isqualifiedinvestors TEXT,
+faceunit TEXT,
+initialfacevalue REAL,
+boardid TEXT,
+engine TEXT,
+market TEXT,
+currencyid TEXT,
+updated_at TEXT
+);
+
+CREATE TABLE quotes (
+secid TEXT PRIMARY KEY,
+lotsize INTEGER,
+prevadmittedquote REAL,
+bid REAL,
+offer REAL,
+fetched_at TEXT NOT NULL
+);
+
+CREATE TABLE rates_snapshot (
+user_id INTEGER PRIMARY KEY,
+username TEXT NOT NULL,
+total_cash REAL NOT NULL DEFAULT 0,
+diversity INTEGER NOT NULL DEFAULT 0,
+purchase_number INTEGER NOT NULL DEFAULT 0,
+purchase_value REAL NOT NULL DEFAULT 0,
+stale INTEGER NOT NULL DEFAULT 0,
+updated_at TEXT NOT NULL,
+FOREIGN KEY (user_id) REFERENCES auth (user_id)
+);
+CREATE INDEX rates_snapshot_total_cash ON rates_snapshot (total_cash DESC);
+CREATE INDEX rates_snapshot_diversity ON rates_snapshot (diversity DESC);
+CREATE INDEX rates_snapshot_purchase_number ON rates_snapshot (purchase_number DESC);
+CREATE INDEX rates_snapshot_purchase_value ON rates_snapshot (purchase_value DESC);
 
 CREATE TABLE app_log (
 id INTEGER PRIMARY KEY AUTOINCREMENT,
 log_text TEXT NOT NULL,
 date_time TEXT NOT NULL
-);
\ No newline at end of file
+);
+
+CREATE TABLE outbox (
+id INTEGER PRIMARY KEY AUTOINCREMENT,
+recipient TEXT NOT NULL,
+subject TEXT NOT NULL,
+body TEXT NOT NULL,
+status TEXT NOT NULL DEFAULT 'pending',
+attempts INTEGER NOT NULL DEFAULT 0,
+last_error TEXT,
+created_at TEXT NOT NULL,
+sent_at TEXT,
+lease TEXT,
+lease_until REAL
+);
+CREATE INDEX outbox_status ON outbox (status, id);
+CREATE INDEX outbox_lease ON outbox (lease);
+
+CREATE TABLE alert_state (
+user_id INTEGER NOT NULL,
+ticker TEXT NOT NULL,
+direction INTEGER NOT NULL,
+fired_at TEXT NOT NULL,
+PRIMARY KEY (user_id, ticker, direction)
+) WITHOUT ROWID;
+
+CREATE TABLE api_token (
+token_hash TEXT PRIMARY KEY,
+user_id INTEGER UNIQUE NOT NULL,
+created_at TEXT NOT NULL,
+FOREIGN KEY (user_id) REFERENCES auth (user_id)
+) WITHOUT ROWID;
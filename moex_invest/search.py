@@ -0,0 +1,216 @@
+"""
+Search over listing table for ticker autocomplete.
+ticker_index - in-memory index, loaded at __init__.py create_app(), reloaded by helpers.py take_symbols() and when
+listing table is changed by other process (scheduler).
+listing_search - SQLite FTS5 listing_fts table, kept in sync with listing table by triggers (schema.sql).
+Backend is chosen with SEARCH_BACKEND in app.config ('memory' or 'fts').
+"""
+
+import bisect
+import re
+import sqlite3
+import threading
+import time
+
+
+class ticker_index:
+    # Seconds between checks that listing table was not changed by other process
+    check_interval = 60
+
+    _lock = threading.Lock()
+    # (entries [(secid, secname)], secid prefix list [(secid, i)], secname words prefix list [(word, i)],
+    # trigrams {trigram: set(i)})
+    _data = ([], [], [], {})
+    _signature = None
+    _checked_at = 0.0
+    database_name = None
+
+    @staticmethod
+    def trigrams(text: str):
+        """
+        Get set of trigrams of text.
+        :param text: lower case string
+        :return: set of 3 chars strings
+        """
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    @staticmethod
+    def signature(database):
+        """
+        Get cheap signature of listing table to find out that it was changed.
+        :param database: sqlite3 connection
+        :return: tuple
+        """
+        return tuple(database.execute("SELECT COUNT(*), MAX(id), TOTAL(length(secid) + length(secname)) "
+                                      "FROM listing").fetchone())
+
+    @staticmethod
+    def load(database_name=None):
+        """
+        Build index from listing table.
+        :param database_name: database file name (saved for future reloads)
+        :return: number of indexed tickers or None if errors
+        """
+        if database_name:
+            ticker_index.database_name = database_name
+        if not ticker_index.database_name:
+            return None
+
+        database = sqlite3.connect(ticker_index.database_name)
+        try:
+            signature = ticker_index.signature(database)
+            rows = database.execute("SELECT secid, secname FROM listing ORDER BY secid").fetchall()
+        except database.Error:
+            return None
+        finally:
+            database.close()
+
+        entries = []
+        secids = []
+        words = []
+        trigrams = {}
+        for i, (secid, secname) in enumerate(rows):
+            secname = secname or ''
+            entries.append((secid, secname))
+            secids.append((secid.lower(), i))
+            for word in secname.lower().replace('-', ' ').replace('"', ' ').split():
+                words.append((word, i))
+            for trigram in ticker_index.trigrams(f"{secid} {secname}".lower()):
+                trigrams.setdefault(trigram, set()).add(i)
+        secids.sort()
+        words.sort()
+
+        # Replace index at once - readers take whole tuple
+        with ticker_index._lock:
+            ticker_index._data = (entries, secids, words, trigrams)
+            ticker_index._signature = signature
+            ticker_index._checked_at = time.monotonic()
+
+        return len(entries)
+
+    @staticmethod
+    def reload_if_changed():
+        """
+        Reload index if listing table was changed (checked not more often than check_interval).
+        :return: None
+        """
+        if time.monotonic() - ticker_index._checked_at < ticker_index.check_interval:
+            return
+        ticker_index._checked_at = time.monotonic()
+
+        if not ticker_index.database_name:
+            return
+        database = sqlite3.connect(ticker_index.database_name)
+        try:
+            signature = ticker_index.signature(database)
+        except database.Error:
+            return
+        finally:
+            database.close()
+
+        if signature != ticker_index._signature:
+            ticker_index.load()
+
+    @staticmethod
+    def prefix_matches(sorted_list, prefix):
+        """
+        Get indexes of entries which keys start with prefix.
+        :param sorted_list: sorted list of (key, entry index)
+        :param prefix: lower case string
+        :return: generator of entry indexes
+        """
+        position = bisect.bisect_left(sorted_list, (prefix,))
+        while position < len(sorted_list) and sorted_list[position][0].startswith(prefix):
+            yield sorted_list[position][1]
+            position += 1
+
+    @staticmethod
+    def search(query: str, limit=10):
+        """
+        Search tickers: ticker prefix matches first, then company name word prefix, then substring matches.
+        :param query: part of ticker or company name
+        :param limit: max number of results
+        :return: list of (secid, secname)
+        """
+        ticker_index.reload_if_changed()
+
+        query = query.strip().lower()
+        if not query:
+            return []
+
+        entries, secids, words, trigrams = ticker_index._data
+        found = {}
+
+        # 1. Ticker prefix (shorter tickers first)
+        for i in sorted(ticker_index.prefix_matches(secids, query), key=lambda i: len(entries[i][0])):
+            found.setdefault(i)
+            if len(found) >= limit:
+                break
+
+        # 2. Company name word prefix
+        if len(found) < limit:
+            for i in ticker_index.prefix_matches(words, query):
+                found.setdefault(i)
+                if len(found) >= limit:
+                    break
+
+        # 3. Substring anywhere in ticker or name - candidates from trigrams intersection
+        # (query shorter than trigram is checked against all entries)
+        if len(found) < limit:
+            if len(query) < 3:
+                candidates = range(len(entries))
+            else:
+                candidates = None
+                for trigram in ticker_index.trigrams(query):
+                    candidates = trigrams.get(trigram, set()) if candidates is None \
+                        else candidates & trigrams.get(trigram, set())
+                    if not candidates:
+                        break
+            for i in sorted(candidates or ()):
+                if query in f"{entries[i][0]} {entries[i][1]}".lower():
+                    found.setdefault(i)
+                    if len(found) >= limit:
+                        break
+
+        return [entries[i] for i in found]
+
+
+class listing_search:
+
+    @staticmethod
+    def match_query(query: str):
+        """
+        Make FTS5 MATCH expression: every word of query is a prefix (all words must match).
+        :param query: part of ticker, company name or ISIN
+        :return: str or None if there are no words in query
+        """
+        words = re.findall(r"[\w-]+", query.lower())
+        words = [word.strip('-') for word in words if word.strip('-')]
+        if not words:
+            return None
+        return ' '.join(f'"{word}"*' for word in words)
+
+    @staticmethod
+    def search(database, query: str, limit=10):
+        """
+        Search tickers in listing_fts: ticker prefix matches first, then by bm25 rank (ticker and ISIN weigh more
+        than company name).
+        :param database: sqlite3 connection
+        :param query: part of ticker, company name or ISIN
+        :param limit: max number of results
+        :return: list of (secid, secname)
+        """
+        match = listing_search.match_query(query)
+        if not match:
+            return []
+
+        rows = database.execute("SELECT listing.secid, listing.secname "
+                                "FROM listing_fts "
+                                "JOIN listing ON listing.id = listing_fts.rowid "
+                                "WHERE listing_fts MATCH ? "
+                                "ORDER BY listing.secid LIKE ? DESC, "
+                                "bm25(listing_fts, 10.0, 2.0, 0.5, 10.0), "
+                                "length(listing.secid) "
+                                "LIMIT ?",
+                                (match, f"{query.strip()}%", limit)).fetchall()
+        return [(row[0], row[1] or '') for row in rows]
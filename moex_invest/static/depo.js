@@ -0,0 +1,63 @@
+// Depo page is rendered from depo table without prices, prices of all tickers are asked once from server
+// (one batched request, server caches MOEX API answers) and filled in when they come
+
+function finance_format(value){
+  // The same as finance filter of jinja: 1,234.50
+  return Number(value).toLocaleString('en-US', {minimumFractionDigits: 2, maximumFractionDigits: 2});
+}
+
+function fill_depo_prices(depo_data){
+
+  // 1. Prices and values of every ticker (ticker without price gets "N/A" with error as hint)
+  for (let element of document.querySelectorAll(".current_price, .final_price")){
+    let item = depo_data["tickers"][element.dataset.ticker];
+    let value = item ? item[element.classList.contains("current_price") ? "current_price" : "final_price"] : null;
+
+    if (value === null || value === undefined){
+      element.innerHTML = "N/A";
+      element.title = item && item["error"] ? item["error"] : "Нет данных о цене.";
+    }
+    else{
+      element.innerHTML = finance_format(value);
+    }
+  }
+
+  // 2. Total (cash + values of priced tickers)
+  for (let element of document.querySelectorAll(".depo_total")){
+    element.innerHTML = finance_format(depo_data["total"]);
+    if (!depo_data["complete"]){
+      element.innerHTML += "*";
+      element.title = "Без учета бумаг, цены которых сейчас нет.";
+    }
+  }
+}
+
+function fail_depo_prices(){
+  // Server is not available - prices are unknown, total is unknown
+  for (let element of document.querySelectorAll(".current_price, .final_price, .depo_total")){
+    element.innerHTML = "N/A";
+  }
+}
+
+function ajax_get_depo_prices(){
+
+  var aj = new XMLHttpRequest();
+
+  /* Callback function */
+  aj.onreadystatechange = function(){
+
+    if (aj.readyState == 4){
+      if (aj.status == 200){
+        fill_depo_prices(JSON.parse(aj.responseText));
+      }
+      else{
+        fail_depo_prices();
+      }
+    }
+  }
+
+  aj.open("GET", "/sandbox/api/depo/prices", true);
+  aj.send();
+}
+
+document.addEventListener("DOMContentLoaded", ajax_get_depo_prices);
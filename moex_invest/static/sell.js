@@ -35,102 +35,43 @@ function ajax_get_primary_board(){
 
       if (aj.readyState == 4 && aj.status == 200){
         
-        /* Get json from moex api server */
-        let primary_data = JSON.parse(aj.responseText);
-       
-        if (primary_data){
-
-          /* Get columns number in description table */
-          let name_index = primary_data["description"]["columns"].indexOf("name");
-          let title_index = primary_data["description"]["columns"].indexOf("title");
-          let value_index = primary_data["description"]["columns"].indexOf("value");
-
-          /* Append data to result object */
-          const not_interest = ["GROUP", "TYPE", "GROUPNAME", "EMITTER_ID"];
-          for (let row of primary_data["description"]["data"]){
-            if (!not_interest.includes(row[name_index])){
-              result[row[name_index]] = [row[title_index], row[value_index]];
-            }
-          }
-          
-          /* Get data for furure price request */
-          title_index = primary_data["boards"]["columns"].indexOf("title");
-          let market_index = primary_data["boards"]["columns"].indexOf("market");
-          let engine_index = primary_data["boards"]["columns"].indexOf("engine");
-          let is_primary_index = primary_data["boards"]["columns"].indexOf("is_primary");
-          let boardid_index = primary_data["boards"]["columns"].indexOf("boardid");
-          let currencyid_index = primary_data["boards"]["columns"].indexOf("currencyid");
-
-          for (row of primary_data["boards"]["data"]){
-
-            /* Looking for primary trade board */
-            if (row[is_primary_index] == 1){  
-              var market = row[market_index];
-              var engine = row[engine_index];
-              var boardid = row[boardid_index];
-              result['PRIME_BOARD'] = [["Основной режим торгов"], row[title_index]];
-              result["CURRENCY_ID"] = [["Основная валюта"], row[currencyid_index]];
-              break;
-            }
-          }
+        /* Get json from server quote API (server caches MOEX API answers) */
+        let quote_data = JSON.parse(aj.responseText);
+        
+        if (quote_data){
 
-          /* New AJAX request to get current market price with engine, market, boardid. Add info to result{}*/
-          if (engine && market && boardid && symbol){
-            ajax_get_market_price(engine, market, boardid, symbol);
-          }
-          else {
-            create_ticker_alert('Извините, не удалось получить информацию по вашему тикеру. Попробуйте другой.');
+          /* Append description rows to result object */
+          for (let row of quote_data["description"]){
+            result[row[0]] = [row[1], row[2]];
           }
+          
+          /* Primary trade board */
+          result['PRIME_BOARD'] = [["Основной режим торгов"], quote_data["board"]["title"]];
+          result["CURRENCY_ID"] = [["Основная валюта"], quote_data["board"]["currencyid"]];
+
+          /* Current market price */
+          result['LOTSIZE'] = [["Размер лота"], quote_data["LOTSIZE"]];
+          result['PREVADMITTEDQUOTE'] = [["Котировка"], quote_data["PREVADMITTEDQUOTE"]];
+          result['BID'] = [["Спрос"], quote_data["BID"]];
+          result['OFFER'] = [["Предложение"], quote_data["OFFER"]];
+          result['SPRED'] = [["Спред"], quote_data["SPREAD"]];
+          result['VOLTODAY'] = [["Объем продаж последний"], quote_data["VOLTODAY"]];
+
+          // Change detail info html block
+          change_detail_info(symbol, quote_data["board"]["market"]);
         }
       }
+      else if (aj.readyState == 4){
+        create_ticker_alert('Извините, не удалось получить информацию по вашему тикеру. Попробуйте другой.');
+      }
     };
-    aj.open("GET", `https://iss.moex.com/iss/securities/${symbol}.json?iss.meta=off&description.columns=name,title,value&boards.columns=secid,boardid,title,market,engine,is_primary,currencyid`, true);
+    aj.open("GET", `/sandbox/api/quote/${encodeURIComponent(symbol)}`, true);
     aj.send();
   }
 
   else console.log(`Error: ajax_get_primary_board: there is not symbol`);
 }
 
-
-function ajax_get_market_price(engine, market, boardid, symbol){
-
-  /* Get current price from moex with API and change result object */
-  var aj_1 = new XMLHttpRequest();
-  
-  /* Callback function */
-  aj_1.onreadystatechange = function(){
-
-    if (aj_1.readyState == 4 && aj_1.status == 200){
-      
-      /* Get json from moex api server */
-      let price_data = JSON.parse(aj_1.responseText);
-      
-      /* Get lotsize */
-      let lot_size_index = price_data["securities"]["columns"].indexOf("LOTSIZE");
-      let addmited_price_index = price_data["securities"]["columns"].indexOf("PREVADMITTEDQUOTE");
-
-      result['LOTSIZE'] = [["Размер лота"], price_data["securities"]["data"][0][lot_size_index]];
-      result['PREVADMITTEDQUOTE'] = [["Котировка"], price_data["securities"]["data"][0][addmited_price_index]];
-      
-      /* Get current prices */
-      let bid_index = price_data["marketdata"]["columns"].indexOf("BID");
-      let offer_index = price_data["marketdata"]["columns"].indexOf("OFFER");
-      let spread_index = price_data["marketdata"]["columns"].indexOf("SPREAD");
-      let voltoday_index = price_data["marketdata"]["columns"].indexOf("VOLTODAY");
-
-      result['BID'] = [["Спрос"], price_data["marketdata"]["data"][0][bid_index]];
-      result['OFFER'] = [["Предложение"], price_data["marketdata"]["data"][0][offer_index]];
-      result['SPRED'] = [["Спред"], price_data["marketdata"]["data"][0][spread_index]];
-      result['VOLTODAY'] = [["Объем продаж последний"], price_data["marketdata"]["data"][0][voltoday_index]];
-      
-      // Change detail info html block
-      change_detail_info(symbol, market);
-    }
-  }
-  aj_1.open("GET", `https://iss.moex.com/iss/engines/${engine}/markets/${market}/boards/${boardid}/securities/${symbol}.json?iss.meta=off&iss.only=securities,marketdata&securities.columns=LOTSIZE,STATUS,PREVADMITTEDQUOTE&marketdata.columns=BID,OFFER,SPREAD,VOLTODAY`, true);
-  aj_1.send();
-}
-
 function change_detail_info(symbol, market){
 
   if (result){
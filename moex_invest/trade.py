@@ -0,0 +1,134 @@
+"""
+Trade execution for sandbox.py buy (quote()) and sell().
+Every trade is one short write transaction started with BEGIN IMMEDIATE (writer lock is taken at once, so concurrent
+trades wait for busy_timeout instead of failing on lock upgrade). Cash and securities are checked by conditional
+UPDATE statements inside transaction, so concurrent requests of one user can not spend the same money or sell the same
+securities twice. Depo row is upserted on unique index depo (user_id, ticker).
+"""
+
+from datetime import datetime
+import pytz
+from moex_invest.helpers import helpers_functions
+
+
+def execute(database, statements):
+    """
+    Run function in BEGIN IMMEDIATE transaction of connection, commit if it returns no error, else rollback.
+    :param database: sqlite3 connection (read-write)
+    :param statements: function(database) -> (error, result)
+    :return: tuple (error, result) of statements, or (error message, None) if SQL errors
+    """
+    # --------------------------TRANSACTION ----------------------------
+    isolation_level = database.isolation_level
+    database.isolation_level = None
+    try:
+        database.execute("BEGIN IMMEDIATE")
+        try:
+            error, result = statements(database)
+            database.execute("rollback" if error else "commit")
+            return error, result
+        except database.Error:
+            database.execute("rollback")
+            raise
+    except database.Error as e:
+        helpers_functions.app_log_add(f"Error. trade.py execute(): SQL error in transaction {e}.")
+        return ['Извините, не удалось провести сделку. Повторите попытку, при повторении ошибки обратитесь к '
+                'администратору сайта.'], None
+    finally:
+        database.isolation_level = isolation_level
+    # -------------------------END TRANSACTION ---------------------------
+
+
+def buy(database, user_id, results, number, price_total):
+    """
+    Buy securities: decrease cash if user has enough, add securities to depo, write log row.
+    :param database: sqlite3 connection (read-write)
+    :param user_id: user_id
+    :param results: dictionary from helpers.lookup() (secid, name, isqualifiedinvestors, initialfacevalue, lotsize,
+    currencyid, market, offer)
+    :param number: number of securities (lots * lotsize)
+    :param price_total: price of all securities in rubles
+    :return: tuple (errors, account after trade)
+    """
+
+    def statements(database):
+        # 1. Decrease cash only if it is enough
+        if not database.execute("UPDATE broker "
+                                "SET account = account - ? "
+                                "WHERE user_id = ? AND account >= ?",
+                                (price_total, user_id, price_total)).rowcount:
+            row = database.execute("SELECT account FROM broker WHERE user_id = ?", (user_id,)).fetchone()
+            return [f"Извините, похоже на вашем счету не хватает средств для покупки "
+                    f"{number} {results['secid']} по рыночной цене {results['offer']}. "
+                    f"Необходимо {helpers_functions.finance_format(price_total)}, "
+                    f"у вас в наличии {helpers_functions.finance_format(row[0] if row else 0)}."], None
+
+        # 2. Add securities to depo
+        database.execute("INSERT INTO depo (user_id, ticker, lotsize, name, isqualifiedinvestors, "
+                         "initialfacevalue, number, currency, market, email_sent) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                         "ON CONFLICT (user_id, ticker) DO UPDATE SET "
+                         "number = number + excluded.number",
+                         (user_id, results['secid'], results['lotsize'], results['name'],
+                          results['isqualifiedinvestors'], results.get('initialfacevalue'), number,
+                          results['currencyid'], results['market'], False))
+
+        # 3. Log
+        date_time = datetime.now(tz=pytz.timezone('Europe/Moscow'))
+        database.execute("INSERT "
+                         "INTO log (user_id, ticker, operation, price, price_total, number, date_time, date_epoch) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (user_id, results['secid'], 'buy', results['offer'], price_total, number,
+                          date_time.isoformat(), int(date_time.timestamp())))
+
+        return None, database.execute("SELECT account FROM broker WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    return execute(database, statements)
+
+
+def sell(database, user_id, results, number, price_total):
+    """
+    Sell securities: decrease securities in depo if user has enough (row is deleted when it is empty), increase
+    cash, write log row.
+    :param database: sqlite3 connection (read-write)
+    :param user_id: user_id
+    :param results: dictionary from helpers.lookup() (secid, bid)
+    :param number: number of securities (lots * lotsize)
+    :param price_total: price of all securities in rubles
+    :return: tuple (errors, account after trade)
+    """
+
+    def statements(database):
+        # 1. Decrease securities only if there are enough of them
+        if not database.execute("UPDATE depo "
+                                "SET number = number - ? "
+                                "WHERE user_id = ? AND ticker = ? AND number >= ?",
+                                (number, user_id, results['secid'], number)).rowcount:
+            row = database.execute("SELECT number FROM depo WHERE user_id = ? AND ticker = ?",
+                                   (user_id, results['secid'])).fetchone()
+            if not row:
+                return [f"Похоже вы пытаетесь продать тикер {results['secid']}, которого нет у вас в депозитарии. "
+                        f"Проверьте депозитарий, в случае необходимости обратитесь к администратору сайта."], None
+            return [f"Извините, похоже у вас не хватает ценных бумаг для продажи {results['secid']}. "
+                    f"Необходимо {number} ед., у вас в наличии {row[0]} ед."], None
+        database.execute("DELETE FROM depo "
+                         "WHERE user_id = ? AND ticker = ? AND number = 0",
+                         (user_id, results['secid']))
+
+        # 2. Add cash
+        database.execute("UPDATE broker "
+                         "SET account = account + ? "
+                         "WHERE user_id = ?",
+                         (price_total, user_id))
+
+        # 3. Log
+        date_time = datetime.now(tz=pytz.timezone('Europe/Moscow'))
+        database.execute("INSERT "
+                         "INTO log (user_id, ticker, operation, price, price_total, number, date_time, date_epoch) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (user_id, results['secid'], 'sell', results['bid'], price_total, number,
+                          date_time.isoformat(), int(date_time.timestamp())))
+
+        return None, database.execute("SELECT account FROM broker WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    return execute(database, statements)
@@ -0,0 +1,60 @@
+"""
+Regression tests of lookup of tickers which MOEX API does not know.
+MOEX API is replaced by answer with empty tables (as ISS answers for unknown securities).
+Run it from root folder: python -m pytest tests
+"""
+
+import pytest
+from moex_invest.helpers import helpers_functions
+from moex_invest.iss import iss_client, quote_cache
+
+
+class empty_answer:
+    """
+    Response of MOEX API for unknown security.
+    """
+    status_code = 200
+
+    @staticmethod
+    def raise_for_status():
+        return None
+
+    @staticmethod
+    def json():
+        return {"description": {"columns": ["name", "title", "value"], "data": []},
+                "boards": {"columns": ["secid", "boardid", "title", "market", "engine", "is_primary", "currencyid"],
+                           "data": []}}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(iss_client, 'get', staticmethod(lambda path: empty_answer()))
+    settings = tmp_path / 'settings.py'
+    # Sessions are stored in tmp_path too - test writes nothing to instance folder of repo
+    settings.write_text(f"DATABASE = {str(tmp_path / 'moex.db')!r}\nSECRET_KEY = 'test'\nTESTING = True\n"
+                        f"SESSION_FILE_DIR = {str(tmp_path / 'sessions')!r}\n")
+    monkeypatch.setenv('MOEX_SANDBOX_SETTINGS', str(settings))
+
+    from moex_invest import create_app
+    app = create_app()
+    client = app.test_client()
+    client.post('/auth/register', data={'username': 'test', 'password': 'test', 'confirmation': 'test',
+                                        'type': 'private'})
+    client.post('/auth/login', data={'username': 'test', 'password': 'test'})
+    yield client
+    quote_cache.clear()
+
+
+def test_lookup_many_unknown_ticker_has_error_messages(monkeypatch):
+    monkeypatch.setattr(helpers_functions, 'get_description', staticmethod(lambda symbol: (None, {})))
+    errors, results = helpers_functions.lookup_many(['qqqq'])['qqqq']
+    assert results is None
+    assert errors and all(isinstance(error, str) for error in errors)
+
+
+@pytest.mark.parametrize('path', ['/sandbox/quote', '/sandbox/sell'])
+def test_trade_unknown_ticker_is_flashed(client, path):
+    response = client.post(path, data={'symbol': 'qqqq', 'number': '1'})
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert session.get('_flashes')